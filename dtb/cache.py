@@ -0,0 +1,59 @@
+"""Classes and functions to cache file system information."""
+
+import time
+import logging
+from collections import OrderedDict
+
+from dtb import storage
+
+
+CACHE_SIZE = 4096  # maximum number of directory listings to keep
+RACY = 2.0  # seconds a modification time must age before it can be trusted
+
+
+class DirectoryCache(object):
+    """Caches directory listings until a directory's mtime changes."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._listings = OrderedDict()  # path -> (mtime, count, names)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._listings)
+
+    def listdir(self, path):
+        """Get the names of the entries in a directory.
+
+        @param path: path to a directory
+
+        @return: list of names, only read from disk when the directory changed
+        """
+        mtime = storage.stat(path).st_mtime_ns
+        listing = self._listings.get(path)
+        if listing and listing[0] == mtime:
+            logging.debug("unchanged folder: {}".format(path))
+            self._listings.move_to_end(path)
+            self.hits += 1
+            return list(listing[2])
+        self.misses += 1
+        names = storage.listdir(path)
+        # Changes within the file system's mtime resolution could be missed
+        if time.time() - mtime / 1e9 > RACY:
+            self._listings[path] = (mtime, len(names), tuple(names))
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.size:
+                self._listings.popitem(last=False)
+        else:
+            self._listings.pop(path, None)
+        return names
+
+    def count(self, path):
+        """Get the number of entries in a directory as of the last listing."""
+        listing = self._listings.get(path)
+        return listing[1] if listing else None
+
+    def clear(self):
+        """Forget all cached listings."""
+        self._listings.clear()
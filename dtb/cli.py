@@ -9,8 +9,10 @@ import argparse
 import logging
 
 from dtb import CLI
-from dtb import share, user, gui
+from dtb import share, user, gui, poll, history, config, schedule, tracing
+from dtb import transfer, search, control, lease
 from dtb.common import SHARED, WarningFormatter
+from dtb.song import group
 from dtb import settings
 
 
@@ -25,19 +27,46 @@ def main(args=None):
                         help="if terminal mode, run forever")
     parser.add_argument('-q', '--no-log', action='store_true',
                         help="do not create a log for downloads")
-    # TODO: support sharing multiple songs
+    parser.add_argument('--min-delay', metavar='SEC', type=float,
+                        help="daemon delay between scans while active")
+    parser.add_argument('--max-delay', metavar='SEC', type=float,
+                        help="daemon delay between scans while idle")
+    parser.add_argument('--order', choices=schedule.POLICIES,
+                        help="order to download incoming songs")
     parser.add_argument('-s', '--share', metavar='PATH',
-                        help="recommend a song")
+                        help="recommend a song or a folder of songs")
+    parser.add_argument('--import', metavar='PATH', dest='folder',
+                        help="add a folder of songs to the library")
+    parser.add_argument('--workers', metavar='N', type=int,
+                        help="number of processes for folders of songs")
     parser.add_argument('-i', '--incoming', action='store_true',
                         help="display the incoming songs")
     parser.add_argument('-o', '--outgoing', action='store_true',
                         help="display the outgoing songs")
+    parser.add_argument('--stats', action='store_true',
+                        help="display statistics from the download log")
+    parser.add_argument('--history', action='store_true',
+                        help="display the received and shared songs")
+    parser.add_argument('-r', '--request', metavar='TITLE',
+                        help="request a song from friends")
+    parser.add_argument('--artist', metavar='NAME',
+                        help="artist of the requested song")
+    parser.add_argument('--requests', action='store_true',
+                        help="display the requested songs")
+    parser.add_argument('-f', '--filter', metavar='WORDS',
+                        help="display songs matching filenames or friends")
     parser.add_argument('-u', '--users', metavar='n', nargs='*',
                         help="filter to the specified usernames")
     parser.add_argument('-n', '--new', metavar='"First Last"',
                         help="create a new user")
     parser.add_argument('-x', '--delete', action='store_true',
                         help="delete the current user")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="delete unlinked songs and invalid folders")
+    parser.add_argument('--migrate', action='store_true',
+                        help="move shared songs to the 'drops' layout")
+    parser.add_argument('--retry', action='store_true',
+                        help="retry failed and quarantined downloads now")
     # Hidden argument to override the root sharing directory path
     parser.add_argument('--root', metavar="PATH", help=argparse.SUPPRESS)
     # Hidden argument to override the home directory
@@ -54,7 +83,8 @@ def main(args=None):
 
     # Run the program
     try:
-        success = _run(args, os.getcwd(), parser.error)
+        with tracing.session(args.profile, args.trace):
+            success = _run(args, os.getcwd(), parser.error)
     except KeyboardInterrupt:
         logging.debug("command canceled")
     else:
@@ -101,6 +131,17 @@ def _run(args, cwd, err):  # pylint: disable=W0613
         logging.info("launching the GUI...")
         return gui.run(args)
 
+    # Load settings from arguments and the environment
+    cfg = config.Config(overrides={'min_delay': args.min_delay,
+                                   'max_delay': args.max_delay,
+                                   'workers': args.workers,
+                                   'order': args.order})
+    try:
+        cfg.check()
+    except ValueError as error:
+        err(str(error))
+    cfg.apply()
+
     # Find the sharing directory
     root = args.root or share.find()
 
@@ -113,37 +154,23 @@ def _run(args, cwd, err):  # pylint: disable=W0613
         this = user.User(os.path.join(root, args.test))
     else:
         this = user.get_current(root)
-    this.cleanup()
-
-    # Delete user and exit
-    if args.delete:
-        this.delete()
-        print("deleted: {}".format(this))
-        return True
-
-    # Display incoming, share a song, and/or display outgoing and exit
-    if any((args.incoming, args.share, args.outgoing)):
+    cfg.path = this.path_settings
+    cfg.reload()
+    cfg.apply()
 
-        if args.incoming:
-            logging.info("displaying incoming songs...")
-            for song in this.incoming:
-                print("incoming: {}".format(song))
+    # Forget failed downloads before downloading again
+    if args.retry:
+        count = this.library.clear_failures()
+        print("retrying: {} song(s)".format(count))
 
-        if args.share:
-            path = os.path.abspath(args.share)
-            song = this.recommend(path, args.users)
-            print("shared: {}".format(path))
-
-        if args.outgoing:
-            logging.info("displaying outgoing songs...")
-            for song in this.outgoing:
-                print("outgoing: {}".format(song))
-
-        return True
+    # Run a single command and exit
+    command = _command(this, args, cfg)
+    if command:
+        return command()
 
     # Run the command-line interface loop
     logging.info("starting the main loop...")
-    return _loop(this, args.daemon, not args.no_log)
+    return _loop(this, args.daemon, not args.no_log, cfg)
 
 
 def _new(name, root):
@@ -158,28 +185,342 @@ def _new(name, root):
     return True
 
 
-def _loop(this, daemon, log):
+def _command(this, args, cfg):
+    """Get the command to run once instead of the main loop.
+
+    @param this: current User
+    @param args: Namespace of CLI arguments
+    @param cfg: current Config
+
+    @return: function to run or None to run the main loop
+    """
+    commands = (
+        (args.delete, lambda: _delete(this)),
+        (args.cleanup, lambda: _cleanup(this)),
+        (args.migrate, lambda: _migrate(this, cfg.drops)),
+        (args.stats, lambda: _stats(this)),
+        (args.history, lambda: _history(this, args.users)),
+        (args.request or args.requests,
+         lambda: _requests(this, args.request, args.artist, args.requests)),
+        (args.folder, lambda: _import(this, args.folder, cfg.workers)),
+        (any((args.incoming, args.share, args.outgoing)),
+         lambda: _songs(this, args, cfg)),
+    )
+    for enabled, command in commands:
+        if enabled:
+            return command
+    return None
+
+
+def _delete(this):
+    """Delete the current user."""
+    this.delete()
+    print("deleted: {}".format(this))
+    return True
+
+
+def _cleanup(this):
+    """Clean up the sharing directory."""
+    this.cleanup()
+    print("cleaned up: {}".format(this.root))
+    state = this.library.get_state('cleanup') or {}
+    if state.get('evicted'):
+        print("reclaimed: {:.1f} MB from {} expired song(s)".format(
+            state['reclaimed'] / 1024 / 1024, state['evicted']))
+    return True
+
+
+def _migrate(this, layout):
+    """Move shared songs to a layout."""
+    count = this.migrate_drops(layout)
+    print("migrated: {} song(s) to {}".format(count, layout))
+    return True
+
+
+def _requests(this, title=None, artist=None, display=False):
+    """Request a song and/or display requests."""
+    if title:
+        request = this.request(title, artist)
+        print("requested: {}".format(_request_string(request)))
+    if display:
+        this.match_requests()
+        for request in this.requests:
+            print("{}: {}".format(request['status'],
+                                  _request_string(request)))
+    return True
+
+
+def _import(this, path, workers=None):
+    """Add a folder of songs to the library."""
+    count = this.import_folder(path, workers=workers, progress=_progress)
+    print("imported: {} song(s)".format(count))
+    return True
+
+
+def _songs(this, args, cfg):
+    """Display incoming, share a song, and/or display outgoing."""
+    if args.incoming:
+        logging.info("displaying incoming songs...")
+        rows = _request(this, 'incoming', query=args.filter)
+        if rows is None:
+            rows = control.incoming(this, _filter(this.incoming, args.filter))
+        for row in rows:
+            if row['quarantined']:
+                print("quarantined: {} ({} attempts: {})".format(
+                    row['path'], *row['quarantined']))
+            else:
+                print("incoming: {}".format(row['path']))
+
+    if args.share:
+        path = os.path.abspath(args.share)
+        if os.path.isdir(path):
+            count = this.import_folder(path, share=True, users=args.users,
+                                       workers=cfg.workers,
+                                       progress=_progress)
+            print("shared: {} song(s) from {}".format(count, path))
+        else:
+            try:
+                _share(this, path, args.users)
+            except (control.Error, transfer.SpaceError) as error:
+                logging.error(error)
+                return False
+            print("shared: {}".format(path))
+
+    if args.outgoing:
+        logging.info("displaying outgoing songs...")
+        rows = _request(this, 'outgoing', query=args.filter)
+        if rows is None:
+            rows = control.outgoing(_filter(this.outgoing, args.filter))
+        for row in rows:
+            print("outgoing: {}".format(row['path']))
+
+    return True
+
+
+def _request_string(request):
+    """Get the string representation for a request."""
+    text = request['title']
+    if request.get('artist'):
+        text += " by {}".format(request['artist'])
+    if request.get('status') == 'matched':
+        text += " ({} from {})".format(
+            os.path.basename(request['song']), request['friend'])
+    return text
+
+
+def _filter(songs, query):
+    """Get the songs matching a search query or all songs without one."""
+    if not query:
+        return songs
+    songs = list(songs)
+    index = search.Index()
+    index.update(songs)
+    return index.filter(songs, query)
+
+
+def _request(this, command, **arguments):
+    """Get the result of a query from the user's daemon.
+
+    @return: result of the query or None to run it directly
+    """
+    try:
+        return control.request(this.path, command, **arguments)
+    except OSError as error:
+        logging.debug("no daemon, scanning directly: {}".format(error))
+    except control.Error as error:
+        logging.warning("daemon failed, scanning directly: {}".format(error))
+    return None
+
+
+def _share(this, path, users=None):
+    """Share a song using the user's daemon if it is running."""
+    try:
+        control.request(this.path, 'share', path=path, users=users)
+    except OSError as error:
+        logging.debug("no daemon, sharing directly: {}".format(error))
+        this.recommend(path, users)
+
+
+def _progress(count, total):
+    """Display the progress of processing a folder of songs."""
+    sys.stderr.write("\rprocessed: {}/{}".format(count, total))
+    if count == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def _stats(this):
+    """Display download statistics per friend."""
+    downloads = this.path_downloads
+    if not downloads:
+        logging.error("no downloads folder configured")
+        return False
+    path = os.path.join(downloads, history.FILENAME)
+    totals = history.summarize(path)
+    for friendname, total in sorted(totals.items()):
+        print("{}: {} song(s), {:.1f} MB, {:.1f} seconds".format(
+            friendname, total['count'], total['bytes'] / 1024 / 1024,
+            total['seconds']))
+    return True
+
+
+def _history(this, users=None):
+    """Display the songs received and shared."""
+    this.reconcile()
+    for friendname in users or [None]:
+        for name, friend, _, _, _, when in this.library.downloads(friendname):
+            print("received: {} from {} ({})".format(name, friend,
+                                                     _timestamp(when)))
+        for _, friend, name, _, when, _ in this.library.links(
+                incoming=False, friend=friendname, current=False):
+            print("shared: {} to {} ({})".format(name, friend,
+                                                 _timestamp(when)))
+    return True
+
+
+def _timestamp(seconds):
+    """Format a time for display."""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(seconds))
+
+
+def _loop(this, daemon, log, cfg=None):
     """Run the main CLI loop."""
-    while True:
-        for song in this.incoming:
-            path = song.download()
-            if path:
-                print("downloaded: {}".format(path))
-                # Append download message to the log
-                if log:
-                    dirpath, filename = os.path.split(path)
-                    logpath = os.path.join(dirpath, CLI + '.log')
-                    with open(logpath, 'a') as log:
-                        msg = "{} from {}".format(filename, song.friendname)
-                        log.write(msg + '\n')
+    if cfg is None:
+        cfg = config.Config(this.path_settings)
+        cfg.apply()
+    poller = poll.Poller(cfg.min_delay, cfg.max_delay)
+    fingerprint = None
+    deferred = None  # time to try songs that did not fit again
+    logs = {}  # downloads folder -> DownloadLog
+    server = control.Server(this)  # only answers commands as a daemon
+    try:
         if daemon:
-            logging.debug("daemon sleeping for 5 seconds...")
-            time.sleep(5)
-        else:
-            break
+            server.start()
+        while True:
+            if cfg.reload():
+                cfg.apply()
+                poller = _reload_poller(poller, cfg)
+            with server.lock:
+                this.cleanup(cfg.cleanup_time, cfg.cleanup_items)
+                current = _fingerprint(this)
+                active = current != fingerprint or \
+                    _due(this.library.next_retry(), deferred)
+            if active:
+                with server.lock:
+                    pending, full = _download(this, logs if log else None,
+                                              cfg.order)
+                # Free space is not watched so songs that did not fit are
+                # only tried again after the longest delay between scans
+                deferred = time.time() + cfg.max_delay if full else None
+                server.model.invalidate('incoming')
+                for downloads in logs.values():
+                    downloads.flush()
+                # Rescan next time if any downloads need to be retried, and
+                # keep the fingerprint from before the scan so links added
+                # during the scan are found next time
+                fingerprint = None if pending else current
+            else:
+                logging.debug("no changes since the last scan")
+            if daemon:
+                delay = poller.update(active)
+                logging.debug("daemon sleeping for {:.1f} seconds...".format(
+                    delay))
+                time.sleep(delay)
+            else:
+                break
+    finally:
+        server.close()
+        for downloads in logs.values():
+            downloads.close()
 
     return True
 
 
+def _due(*times):
+    """Determine if any of the scheduled times (or None) have passed."""
+    return any(when is not None and when <= time.time() for when in times)
+
+
+def _fingerprint(this):
+    """Get a value that changes when the user's incoming songs change."""
+    # Links added to segments do not change the folders themselves
+    return poll.fingerprint(this.path, ignore=(user.User.PRIVATE,),
+                            files=this.segments)
+
+
+def _reload_poller(poller, cfg):
+    """Create a new poller with the current settings if they are valid."""
+    logging.info("reloaded settings")
+    try:
+        cfg.check()
+    except ValueError as error:
+        logging.warning("delays not changed: {}".format(error))
+        return poller
+    return poll.Poller(cfg.min_delay, cfg.max_delay)
+
+
+def _download(this, logs=None, order=schedule.FIFO):
+    """Download all incoming songs.
+
+    @param this: current User
+    @param logs: dictionary of download logs to append to or None
+    @param order: policy for the order to download songs
+
+    @return: indications that some songs could not be downloaded but do
+        not need to wait to be retried, and that some songs did not fit
+    """
+    pending = deferred = False
+    queue = schedule.Scheduler(order)
+    queue.extend(group(this.incoming))
+    claimed = []  # songs waiting for their new leases to settle
+    for song in queue:
+        if not os.path.isdir(song.downloads):
+            # Songs are downloaded on the next scan after the folder exists
+            logging.error("invalid download location: {}".format(
+                song.downloads))
+            break
+        if _download_song(song, logs):
+            continue
+        if lease.Lease(song.path).read().get('owner') == lease.OWNER:
+            claimed.append(song)
+        elif song.deferred:
+            deferred = True
+        elif os.path.exists(song.path) and this.library.can_retry(song.path):
+            pending = True
+    # Wait once for all the leases created during this scan
+    if claimed:
+        time.sleep(lease.SETTLE)
+    for song in claimed:
+        if _download_song(song, logs):
+            continue
+        if song.deferred:
+            deferred = True
+        elif os.path.exists(song.path) and this.library.can_retry(song.path):
+            pending = True
+    this.library.prune_failures()
+    return pending, deferred
+
+
+def _download_song(song, logs=None):
+    """Download an incoming song and log it.
+
+    @return: path to the downloaded file or None if not downloaded
+    """
+    start = time.time()
+    path = song.download()
+    if path:
+        duration = time.time() - start
+        print("downloaded: {}".format(path))
+        # Append download message to the log
+        if logs is not None:
+            dirpath = os.path.dirname(path)
+            if dirpath not in logs:
+                logpath = os.path.join(dirpath, history.FILENAME)
+                logs[dirpath] = history.DownloadLog(logpath)
+            logs[dirpath].write(path, song.friendname,
+                                os.path.getsize(path), duration)
+    return path
+
+
 if __name__ == '__main__':  # pragma: no cover (manual test)
     main()
@@ -1,5 +1,6 @@
 """Common classes and functions."""
 
+import os
 import argparse
 import logging
 
@@ -29,9 +30,17 @@ class WarningFormatter(logging.Formatter, object):
             self._style._fmt = self.default_format  # pylint: disable=W0212
         return super().format(record)
 
+
+# Files kept on this computer only, outside of the synced sharing folder
+LOCAL = os.path.join(os.path.expanduser('~'), '.dtb')
+
 # Shared command-line arguments
 DEBUG = argparse.ArgumentParser(add_help=False)
 DEBUG.add_argument('-V', '--version', action='version', version=VERSION)
 DEBUG.add_argument('-v', '--verbose', action='count', default=0,
                    help="enable verbose logging")
+DEBUG.add_argument('--profile', metavar='PATH',
+                   help="write cProfile statistics to a file")
+DEBUG.add_argument('--trace', metavar='PATH',
+                   help="write timed spans to a Chrome trace file")
 SHARED = {'formatter_class': HelpFormatter, 'parents': [DEBUG]}
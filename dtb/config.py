@@ -0,0 +1,148 @@
+"""Classes and functions to load performance settings."""
+
+import os
+import logging
+from collections import OrderedDict
+
+import yaml
+
+from dtb import cache, poll, readiness, schedule, share, transfer, user
+from dtb import manifest, shards, lease
+
+
+PREFIX = 'DTB_'  # prefix for environment variables that override settings
+ENVIRONMENT = ('share_depth',)  # settings needed before the file is found
+
+# name -> (type, default, minimum or allowed values)
+FIELDS = OrderedDict([
+    ('min_delay', (float, poll.MIN_DELAY, 0.1)),
+    ('max_delay', (float, poll.MAX_DELAY, 0.1)),
+    ('workers', (int, None, 1)),
+    ('chunk_size', (int, transfer.CHUNK_SIZE, 1024)),
+    ('cache_size', (int, cache.CACHE_SIZE, 0)),
+    ('share_depth', (int, share.SHARE_DEPTH, 1)),
+    ('read_rate', (int, 0, 0)),  # bytes per second, 0 for no limit
+    ('write_rate', (int, 0, 0)),  # bytes per second, 0 for no limit
+    ('order', (str, schedule.FIFO, schedule.POLICIES)),
+    ('cleanup_time', (float, user.CLEANUP_TIME, 0.0)),
+    ('cleanup_items', (int, user.CLEANUP_ITEMS, 1)),
+    ('settle_time', (float, readiness.SETTLE, 0.0)),
+    ('lease_time', (float, lease.SETTLE, 0.0)),
+    ('reserve', (int, transfer.RESERVE, 0)),  # bytes to leave free
+    ('links', (str, manifest.FILES, manifest.LAYOUTS)),
+    ('drops', (str, shards.FLAT, shards.LAYOUTS)),
+    ('retention_days', (float, user.RETENTION_DAYS, 0.0)),
+    ('retention_bytes', (int, user.RETENTION_BYTES, 0)),
+    ('retention_count', (int, user.RETENTION_COUNT, 0)),
+])
+
+
+class Config(object):
+    """Settings merged from arguments, the environment, and a file.
+
+    Values are looked up in that order before falling back to defaults.
+    The file is only parsed again after its modification time changes.
+    Settings only change the package's defaults once they are applied.
+    """
+
+    def __init__(self, path=None, overrides=None, environ=None):
+        self.path = path
+        self._overrides = self._validate(overrides or {}, "argument")
+        environ = os.environ if environ is None else environ
+        self._environ = self._validate(
+            {name: environ[PREFIX + name.upper()] for name in FIELDS
+             if PREFIX + name.upper() in environ}, "environment variable")
+        self._file = {}
+        self._mtime = None
+        self.reload()
+
+    def __getattr__(self, name):
+        if name not in FIELDS:
+            raise AttributeError(name)
+        for values in (self._overrides, self._environ, self._file):
+            if name in values:
+                return values[name]
+        return FIELDS[name][1]
+
+    def reload(self):
+        """Parse the settings file if it changed since it was last read.
+
+        @return: indication that the settings changed
+        """
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        data = {}
+        if mtime is not None:
+            logging.debug("loading {}...".format(self.path))
+            with open(self.path, 'r') as infile:
+                try:
+                    data = yaml.safe_load(infile.read())
+                except yaml.error.YAMLError as error:  # pylint: disable=E1101
+                    logging.warning("invalid YAML: {}: {}".format(self.path,
+                                                                  error))
+        if not isinstance(data, dict):
+            data = {}
+        for name in ENVIRONMENT:
+            if name in data:
+                logging.warning("setting only read from the environment: "
+                                "{}".format(name))
+                del data[name]
+        self._file = self._validate(data, "setting")
+        return True
+
+    def check(self):
+        """Verify the settings are consistent with each other.
+
+        @raise ValueError: if the delays between scans are invalid
+        """
+        if self.max_delay < self.min_delay:
+            raise ValueError("invalid delays: {}, {}".format(self.min_delay,
+                                                             self.max_delay))
+
+    def apply(self):
+        """Update the package's defaults with the current settings."""
+        transfer.CHUNK_SIZE = self.chunk_size
+        transfer.RESERVE = self.reserve
+        user.CACHE.size = self.cache_size
+        share.SHARE_DEPTH = self.share_depth
+        readiness.SETTLE = self.settle_time
+        lease.SETTLE = self.lease_time
+        manifest.LAYOUT = self.links
+        shards.LAYOUT = self.drops
+        user.RETENTION_DAYS = self.retention_days
+        user.RETENTION_BYTES = self.retention_bytes
+        user.RETENTION_COUNT = self.retention_count
+        transfer.READ.configure(self.read_rate)
+        transfer.WRITE.configure(self.write_rate)
+
+    @staticmethod
+    def _validate(values, kind):
+        """Convert values to their types, dropping unknown or invalid ones."""
+        valid = {}
+        for name, value in values.items():
+            if name not in FIELDS:
+                logging.warning("unknown {}: {}".format(kind, name))
+                continue
+            if value is None:
+                continue
+            convert, _, minimum = FIELDS[name]
+            try:
+                value = convert(value)
+                if isinstance(minimum, tuple):
+                    if value not in minimum:
+                        raise ValueError("must be one of: {}".format(
+                            ', '.join(minimum)))
+                elif value < minimum:
+                    raise ValueError("must be at least {}".format(minimum))
+            except (TypeError, ValueError) as error:
+                logging.warning("invalid {}: {}: {}".format(kind, name, error))
+            else:
+                valid[name] = value
+        return valid
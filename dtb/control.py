@@ -0,0 +1,287 @@
+"""Classes and functions to answer commands from a running daemon."""
+
+import os
+import json
+import socket
+import hashlib
+import logging
+import tempfile
+import threading
+import socketserver
+
+from dtb import poll, search, transfer, manifest
+from dtb.user import CACHE
+
+
+TIMEOUT = 10.0  # seconds to wait for the daemon to answer
+LIMIT = 64 * 1024  # maximum bytes in a request
+
+
+class Error(Exception):
+    """Error reported by the daemon while running a command."""
+
+
+def available():
+    """Determine if this platform supports the daemon's socket."""
+    return hasattr(socket, 'AF_UNIX') and \
+        hasattr(socketserver, 'ThreadingUnixStreamServer')
+
+
+def address(path):
+    """Get the path to the socket of the daemon for a user.
+
+    Sockets cannot be created in most synced folders so they are kept in
+    the temporary folder, named by a hash of the user's folder.
+
+    @param path: path to the user's folder
+    """
+    digest = hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(tempfile.gettempdir(), "dtb-{}.sock".format(
+        digest[:16]))
+
+
+def request(userpath, command, **arguments):
+    """Send a command to the daemon for a user.
+
+    @param userpath: path to the user's folder
+    @param command: name of the command to run
+    @param arguments: keyword arguments for the command
+
+    @return: result of the command
+
+    @raise OSError: if no daemon is running for the user
+    @raise Error: if the daemon could not run the command or stopped
+        answering after receiving it
+    """
+    if not available():
+        raise OSError("sockets are not supported on this platform")
+    data = json.dumps(dict(arguments, command=command)) + '\n'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(TIMEOUT)
+        client.connect(address(userpath))
+        # Commands may take as long as copying a song once received
+        client.settimeout(None)
+        try:
+            client.sendall(data.encode('utf-8'))
+            with client.makefile('rb') as infile:
+                line = infile.readline()
+        except OSError as error:
+            raise Error("no answer from the daemon: {}".format(
+                error)) from error
+    try:
+        response = json.loads(line.decode('utf-8'))
+    except ValueError as error:
+        raise Error("invalid answer from the daemon: {!r}".format(
+            line)) from error
+    if 'error' in response:
+        raise Error(response['error'])
+    return response.get('result')
+
+
+def incoming(this, songs):
+    """Get the rows to display for incoming songs.
+
+    @param this: current User
+    @param songs: incoming Songs
+
+    @return: list of dictionaries with the song's path and, if the song
+        is no longer retried, the number of attempts and the last error
+    """
+    rows = []
+    for song in songs:
+        failure = this.library.failure(song.path)
+        quarantined = None
+        if failure and failure[3] is None:
+            quarantined = [failure[0], failure[1]]
+        rows.append({'path': str(song), 'quarantined': quarantined})
+    return rows
+
+
+def outgoing(songs):
+    """Get the rows to display for outgoing songs."""
+    return [{'path': str(song)} for song in songs]
+
+
+class Model(object):
+    """Songs of a user kept up to date between commands.
+
+    Each list is only scanned again when the folders it comes from have
+    changed, which takes a few calls to stat, or after it is invalidated.
+    """
+
+    def __init__(self, this, lock=None):
+        self.this = this
+        # Commands are answered in threads and the library may also be used
+        # by the daemon's loop
+        self._lock = lock or threading.RLock()
+        self._lists = {}  # name -> (fingerprint, songs, rows)
+        self._indexes = {'incoming': search.Index(),
+                         'outgoing': search.Index()}
+
+    def invalidate(self, name=None):
+        """Scan a list again, or all lists, on the next command."""
+        with self._lock:
+            if name:
+                self._lists.pop(name, None)
+            else:
+                self._lists.clear()
+
+    def incoming(self, query=None):
+        """Get the rows for the incoming songs matching a query."""
+        return self._get('incoming', query)
+
+    def outgoing(self, query=None):
+        """Get the rows for the outgoing songs matching a query."""
+        return self._get('outgoing', query)
+
+    def _get(self, name, query):
+        """Get the rows of a list, scanning it again if needed."""
+        index = self._indexes[name]
+        with self._lock:
+            current = self._fingerprint(name)
+            cached = self._lists.get(name)
+            if cached is None or cached[0] != current:
+                logging.debug("scanning {} songs...".format(name))
+                songs = list(getattr(self.this, name))
+                if name == 'incoming':
+                    rows = incoming(self.this, songs)
+                else:
+                    rows = outgoing(songs)
+                index.update(songs)
+                cached = self._lists[name] = current, songs, rows
+            _, songs, rows = cached
+            paths = index.search(query) if query else None
+        if paths is None:
+            return rows
+        return [row for song, row in zip(songs, rows) if song.path in paths]
+
+    def _fingerprint(self, name):
+        """Get a value that changes when the songs in a list change."""
+        this = self.this
+        if name == 'incoming':
+            # Failures are kept in the library, e.g. cleared by `dtb --retry`
+            return (poll.fingerprint(this.path, ignore=(this.PRIVATE,),
+                                     files=this.segments),
+                    this.library.failures())
+        # Outgoing songs are in each friend's folder for this user
+        files = []
+        for friendname in CACHE.listdir(this.root):
+            dirpath = os.path.join(this.root, friendname, this.name)
+            if friendname == this.name or not os.path.isdir(dirpath):
+                continue
+            files.append(dirpath)
+            files.extend(os.path.join(dirpath, filename)
+                         for filename in CACHE.listdir(dirpath)
+                         if manifest.is_segment(filename))
+        return poll.fingerprint(this.root, files=files)
+
+
+class Server(object):
+    """Answers commands for a user over a local socket in the background.
+
+    The daemon keeps running its own loop and only needs to invalidate the
+    model after downloading songs. Commands hold the lock while using the
+    user's library, so the loop must hold it too.
+    """
+
+    def __init__(self, this, model=None, lock=None):
+        self.this = this
+        self.lock = lock or threading.RLock()
+        self.model = model or Model(this, self.lock)
+        self.path = address(this.path)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start answering commands.
+
+        @return: indication that the socket is being served
+        """
+        if not available():
+            logging.debug("sockets are not supported on this platform")
+            return False
+        if os.path.exists(self.path):
+            try:
+                request(self.this.path, 'ping')
+            except (OSError, Error):
+                logging.debug("removing stale socket {}...".format(self.path))
+                os.remove(self.path)
+            else:
+                logging.warning("daemon already running: {}".format(
+                    self.path))
+                return False
+        handler = type('Handler', (_Handler,), {'server_': self})
+        umask = os.umask(0o177)  # only this user may send commands
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path,
+                                                                  handler)
+        finally:
+            os.umask(umask)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        logging.info("answering commands on {}...".format(self.path))
+        return True
+
+    def close(self):
+        """Stop answering commands and remove the socket."""
+        if self._server is None:
+            return
+        logging.debug("closing {}...".format(self.path))
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def run(self, command, arguments):
+        """Run a command from a client.
+
+        @param command: name of the command
+        @param arguments: dictionary of arguments for the command
+
+        @return: JSON-compatible result of the command
+        """
+        logging.debug("running command: {}".format(command))
+        if command == 'ping':
+            return self.this.name
+        if command == 'incoming':
+            return self.model.incoming(arguments.get('query'))
+        if command == 'outgoing':
+            return self.model.outgoing(arguments.get('query'))
+        if command == 'share':
+            path = arguments.get('path')
+            if not path or not os.path.isfile(path):
+                raise Error("not a file: {}".format(path))
+            with self.lock:
+                song = self.this.recommend(path, arguments.get('users'))
+            self.model.invalidate('outgoing')
+            return song.path
+        raise Error("unknown command: {}".format(command))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers a single command sent as a line of JSON."""
+
+    server_ = None  # Server the handler belongs to
+
+    def handle(self):
+        line = self.rfile.readline(LIMIT)
+        try:
+            data = json.loads(line.decode('utf-8'))
+            command = data.pop('command')
+        except (ValueError, AttributeError, KeyError, TypeError):
+            response = {'error': "invalid request: {!r}".format(line)}
+        else:
+            try:
+                response = {'result': self.server_.run(command, data)}
+            except (Error, transfer.SpaceError) as error:
+                response = {'error': str(error)}
+            except Exception as error:  # pylint: disable=W0703
+                logging.exception(error)
+                response = {'error': str(error)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
@@ -4,19 +4,117 @@
 
 import os
 import sys
+import time
+import queue
 import argparse
+import threading
 from tkinter import *  # pylint: disable=wildcard-import,unused-wildcard-import
-from tkinter import messagebox, simpledialog, filedialog
+from tkinter import messagebox, simpledialog, filedialog, font
 from tkinter.ttk import *  # pylint: disable=wildcard-import,unused-wildcard-import
 from itertools import chain
+from operator import itemgetter
 import logging
 
 from . import GUI, __version__
-from . import share, user
+from . import share, user, config, tracing, snapshot, listing, search
 from . import settings
 from .common import SHARED, WarningFormatter
 
 _LAUNCH = True
+REFRESH_DELAY = 100  # milliseconds between checks for a background refresh
+
+
+class SongList(Frame):  # pylint: disable=too-many-ancestors
+    """Scrollable list that only creates rows for the visible songs."""
+
+    def __init__(self, master, label, selectmode=MULTIPLE):
+        Frame.__init__(self, master)
+        self.listing = listing.Listing(label)
+        self.rows = 1  # number of rows that fit in the listbox
+
+        # Configure grid
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        # Place widgets
+        self.listbox = Listbox(self, selectmode=selectmode,
+                               activestyle='none', exportselection=False)
+        self.listbox.grid(row=0, column=0, sticky=NSEW)
+        self.scrollbar = Scrollbar(self, orient=VERTICAL, command=self.yview)
+        self.scrollbar.grid(row=0, column=1, sticky=(N, S))
+
+        # Handle events
+        self.listbox.bind('<Configure>', self._on_resize)
+        self.listbox.bind('<<ListboxSelect>>', self._on_select)
+        self.listbox.bind('<MouseWheel>', self._on_wheel)
+        self.listbox.bind('<Button-4>', lambda _: self.yview('scroll', -1,
+                                                             'units'))
+        self.listbox.bind('<Button-5>', lambda _: self.yview('scroll', 1,
+                                                             'units'))
+        self.listbox.bind('<Prior>', lambda _: self.yview('scroll', -1,
+                                                          'pages'))
+        self.listbox.bind('<Next>', lambda _: self.yview('scroll', 1,
+                                                         'pages'))
+
+    @property
+    def selection(self):
+        """Get the selected songs."""
+        return self.listing.selection
+
+    def set(self, rows, stale=False):
+        """Replace the displayed songs.
+
+        @param rows: list of (Song, display text or None)
+        @param stale: indication that the songs were not just scanned
+        """
+        self.listing.set(rows, stale=stale)
+        self.listing.scroll(self.listing.top, self.rows)
+        self.render()
+
+    def render(self):
+        """Display the visible rows."""
+        self.listbox.delete(0, END)
+        color = 'gray' if self.listing.stale else ''
+        for row, index in enumerate(self.listing.visible(self.rows)):
+            self.listbox.insert(END, self.listing.text(index))
+            if color:
+                self.listbox.itemconfig(row, foreground=color)
+            if self.listing.is_selected(index):
+                self.listbox.selection_set(row)
+        self.scrollbar.set(*self.listing.fractions(self.rows))
+
+    def yview(self, *args):
+        """Scroll the list in response to the scrollbar or keys."""
+        if args[0] == MOVETO:
+            top = int(float(args[1]) * len(self.listing))
+        else:
+            step = self.rows if args[2] == PAGES else 1
+            top = self.listing.top + int(args[1]) * step
+        self.listing.scroll(top, self.rows)
+        self.render()
+        return 'break'
+
+    def _on_resize(self, event):
+        """Display as many rows as fit in the new height."""
+        border = sum(self.listbox.winfo_pixels(self.listbox.cget(name))
+                     for name in ('borderwidth', 'highlightthickness'))
+        line = font.Font(font=self.listbox.cget('font')).metrics('linespace')
+        rows = max(1, (event.height - 2 * border) // (line + 1))
+        if rows != self.rows:
+            self.rows = rows
+            self.listing.scroll(self.listing.top, self.rows)
+            self.render()
+
+    def _on_select(self, _):
+        """Remember the selection of the visible rows."""
+        selected = set(int(s) for s in self.listbox.curselection())
+        for row, index in enumerate(self.listing.visible(self.rows)):
+            self.listing.select(index, row in selected)
+
+    def _on_wheel(self, event):
+        """Scroll the list with the mouse wheel."""
+        units = -1 if event.delta > 0 else 1
+        return self.yview(SCROLL, units, UNITS)
 
 
 class Application(Frame):  # pylint: disable=too-many-instance-attributes
@@ -25,6 +123,10 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
     def __init__(self, master=None, root=None, home=None, name=None):
         Frame.__init__(self, master)
 
+        # Load settings from the environment to find the share
+        self.config = config.Config()
+        self.config.apply()
+
         # Load the root sharing directory
         self.root = root or share.find(home)
 
@@ -56,21 +158,38 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
                 else:
                     break
 
+        # Load settings
+        self.config.path = self.user.path_settings
+        self.config.reload()
+        self.config.apply()
+
         # Create variables
         self.path_root = StringVar(value=self.root)
         self.path_downloads = StringVar(value=self.user.path_downloads)
-        self.outgoing = []
-        self.incoming = []
+        self.status = StringVar()
+        self.query = StringVar()
+        self.query.trace_add('write', lambda *_: self.apply_filter())
+        self.index = search.Index()  # songs from the last scan
+        self.songs = [], []  # all incoming and outgoing (Song, text) rows
+        # The user and its library are used from one thread at a time
+        self._user = threading.Lock()
+        self._results = queue.Queue()  # results from background refreshes
+        self._refresh = None
 
         # Initialize the GUI
-        self.listbox_outgoing = None
-        self.listbox_incoming = None
+        self.list_outgoing = None
+        self.list_incoming = None
         frame = self.init(master)
         frame.pack(fill=BOTH, expand=1)
 
-        # Show the GUI
+        # Show the GUI with the last songs while they are refreshed
         master.deiconify()
-        self.update()
+        when, incoming, outgoing = snapshot.load(
+            self.user.path_snapshot, self.root, self.path_downloads.get(),
+            self.user.library)
+        if when:
+            self.show(incoming, outgoing, stale=when)
+        self.refresh()
 
     def init(self, root):
         """Initialize frames and widgets."""
@@ -78,6 +197,7 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
         # pylint: disable=line-too-long
 
         mac = sys.platform == 'darwin'
+        mode = EXTENDED if mac else MULTIPLE
 
         # Shared keyword arguments
         kw_f = {'padding': 5}  # constructor arguments for frames
@@ -100,6 +220,8 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
             # Configure grid
             frame.rowconfigure(0, weight=1)
             frame.rowconfigure(1, weight=1)
+            frame.rowconfigure(2, weight=1)
+            frame.rowconfigure(3, weight=1)
             frame.columnconfigure(0, weight=0)
             frame.columnconfigure(1, weight=1)
             frame.columnconfigure(2, weight=0)
@@ -110,6 +232,9 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
             Label(frame, text="Downloads:").grid(row=1, column=0, sticky=W, **kw_gp)
             Entry(frame, state='readonly', textvariable=self.path_downloads).grid(row=1, column=1, **kw_gsp)
             Button(frame, text="...", width=0, command=self.browse_downloads).grid(row=1, column=2, ipadx=5, **kw_gp)
+            Label(frame, text="Filter:").grid(row=2, column=0, sticky=W, **kw_gp)
+            Entry(frame, textvariable=self.query).grid(row=2, column=1, columnspan=2, **kw_gsp)
+            Label(frame, textvariable=self.status).grid(row=3, column=0, columnspan=3, sticky=W, **kw_gp)
 
             return frame
 
@@ -125,12 +250,9 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
             frame.columnconfigure(2, weight=1)
 
             # Place widgets
-            self.listbox_incoming = Listbox(frame, selectmode=EXTENDED if mac else MULTIPLE)
-            self.listbox_incoming.grid(row=0, column=0, columnspan=3, **kw_gsp)
-            scroll_incoming = Scrollbar(frame, orient=VERTICAL, command=self.listbox_incoming.yview)
-            self.listbox_incoming.configure(yscrollcommand=scroll_incoming.set)
-            scroll_incoming.grid(row=0, column=2, sticky=(N, E, S))
-            Button(frame, text="\u21BB", width=0, command=self.update).grid(row=1, column=0, sticky=SW, ipadx=5, **kw_gp)
+            self.list_incoming = SongList(frame, lambda song: song.in_string, selectmode=mode)
+            self.list_incoming.grid(row=0, column=0, columnspan=3, **kw_gsp)
+            Button(frame, text="\u21BB", width=0, command=self.refresh).grid(row=1, column=0, sticky=SW, ipadx=5, **kw_gp)
             Button(frame, text="Ignore Selected", command=self.do_ignore).grid(row=1, column=1, sticky=SW, ipadx=5, **kw_gp)
             Button(frame, text="Download Selected", command=self.do_download).grid(row=1, column=2, sticky=SE, ipadx=5, **kw_gp)
             return frame
@@ -147,12 +269,9 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
             frame.columnconfigure(2, weight=1)
 
             # Place widgets
-            self.listbox_outgoing = Listbox(frame, selectmode=EXTENDED if mac else MULTIPLE)
-            self.listbox_outgoing.grid(row=0, column=0, columnspan=3, **kw_gsp)
-            scroll_outgoing = Scrollbar(frame, orient=VERTICAL, command=self.listbox_outgoing.yview)
-            self.listbox_outgoing.configure(yscrollcommand=scroll_outgoing.set)
-            scroll_outgoing.grid(row=0, column=2, sticky=(N, E, S))
-            Button(frame, text="\u21BB", width=0, command=self.update).grid(row=1, column=0, sticky=SW, ipadx=5, **kw_gp)
+            self.list_outgoing = SongList(frame, lambda song: song.out_string, selectmode=mode)
+            self.list_outgoing.grid(row=0, column=0, columnspan=3, **kw_gsp)
+            Button(frame, text="\u21BB", width=0, command=self.refresh).grid(row=1, column=0, sticky=SW, ipadx=5, **kw_gp)
             Button(frame, text="Remove Selected", command=self.do_remove).grid(row=1, column=1, sticky=SW, ipadx=5, **kw_gp)
             Button(frame, text="Share Songs...", command=self.do_share).grid(row=1, column=2, sticky=SE, ipadx=5, **kw_gp)
 
@@ -176,13 +295,16 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
         path = filedialog.askdirectory()
         logging.debug("path: {}".format(path))
         if path:
-            self.user.path_downloads = path
+            with self._user:
+                self.user.path_downloads = path
             self.path_downloads.set(self.user.path_downloads)
 
     def do_remove(self):
         """Remove selected songs."""
-        for index in (int(s) for s in self.listbox_outgoing.curselection()):
-            self.outgoing[index].ignore()
+        with self._user:
+            for song in self.list_outgoing.selection:
+                song.ignore()
+        self.list_outgoing.listing.clear()
         self.update()
 
     def do_share(self):
@@ -191,47 +313,133 @@ class Application(Frame):  # pylint: disable=too-many-instance-attributes
         if isinstance(paths, str):  # http://bugs.python.org/issue5712
             paths = self.master.splitlist(paths)
         logging.debug("paths: {}".format(paths))
-        for path in paths:
-            self.user.recommend(path)
+        with self._user:
+            for path in paths:
+                self.user.recommend(path)
         self.update()
 
     def do_ignore(self):
         """Ignore selected songs."""
-        for index in (int(s) for s in self.listbox_incoming.curselection()):
-            song = self.incoming[index]
-            song.ignore()
+        with self._user:
+            for song in self.list_incoming.selection:
+                song.ignore()
+        self.list_incoming.listing.clear()
         self.update()
 
     def do_download(self):
         """Download selected songs."""
-        indicies = (int(s) for s in self.listbox_incoming.curselection())
         try:
-            for index in indicies:
-                song = self.incoming[index]
-                song.download(catch=False)
+            with self._user:
+                for song in self.list_incoming.selection:
+                    song.download(catch=False)
         except IOError as exc:
             self.show_error_from_exception(exc, "Download Error")
+        self.list_incoming.listing.clear()
         self.update()
 
     def update(self):
         """Update the list of outgoing and incoming songs."""
 
-        # Cleanup outgoing songs
-        self.user.cleanup()
-
-        # Update outgoing songs list
-        logging.info("updating outgoing songs...")
-        self.outgoing = list(self.user.outgoing)
-        self.listbox_outgoing.delete(0, END)
-        for song in self.outgoing:
-            self.listbox_outgoing.insert(END, song.out_string)
-        # Update incoming songs list
+        # Reload settings
+        if self.config.reload():
+            self.config.apply()
+
+        # Scan and display the songs
+        incoming, outgoing = self.scan()
+        self.show(incoming, outgoing)
+
+    def refresh(self):
+        """Update the list of songs without blocking the GUI."""
+        if self._refresh and self._refresh.is_alive():
+            return
+        if self.config.reload():
+            self.config.apply()
+        if not self.status.get():
+            self.status.set("Refreshing...")
+        self._refresh = threading.Thread(target=self._scan_background,
+                                         daemon=True)
+        self._refresh.start()
+        self.after(REFRESH_DELAY, self._check_refresh)
+
+    def _scan_background(self):
+        """Scan for songs in a background thread."""
+        try:
+            self._results.put(self.scan())
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error(exc)
+            self._results.put(exc)
 
-        logging.info("updating incoming songs...")
-        self.incoming = list(self.user.incoming)
-        self.listbox_incoming.delete(0, END)
-        for song in self.incoming:
-            self.listbox_incoming.insert(END, song.in_string)
+    def _check_refresh(self):
+        """Display the results of a background refresh when available."""
+        try:
+            result = self._results.get_nowait()
+        except queue.Empty:
+            self.after(REFRESH_DELAY, self._check_refresh)
+            return
+        if isinstance(result, Exception):
+            self.status.set("Refresh failed: {}".format(result))
+        else:
+            self.show(*result)
+
+    def scan(self):
+        """Clean up and find the outgoing and incoming songs.
+
+        Display texts are only included for songs already displayed so
+        the scan does not read every link.
+
+        @return: incoming and outgoing lists of (Song, display text or None)
+        """
+        with self._user:
+
+            # Cleanup outgoing songs a little at a time
+            self.user.cleanup(self.config.cleanup_time,
+                              self.config.cleanup_items)
+
+            # Find outgoing songs
+            logging.info("updating outgoing songs...")
+            cached = self.list_outgoing.listing.cached
+            outgoing = [(song, cached(song)) for song in self.user.outgoing]
+
+            # Find incoming songs
+            logging.info("updating incoming songs...")
+            cached = self.list_incoming.listing.cached
+            incoming = [(song, cached(song)) for song in self.user.incoming]
+
+            # Index the songs for filtering
+            self.index.update(song for song, _ in chain(incoming, outgoing))
+
+        snapshot.save(self.user.path_snapshot, self.root, incoming, outgoing)
+        return incoming, outgoing
+
+    def show(self, incoming, outgoing, stale=None):
+        """Display lists of songs.
+
+        @param incoming: list of (Song, display text or None) for incoming
+        @param outgoing: list of (Song, display text or None) for outgoing
+        @param stale: time the songs were found if not just scanned
+        """
+        self.songs = incoming, outgoing
+        self.apply_filter(stale=bool(stale))
+        if stale:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(stale))
+            self.status.set("Showing songs from {}, refreshing...".format(
+                when))
+        else:
+            self.status.set("")
+
+    def apply_filter(self, stale=None):
+        """Display the songs matching the filter.
+
+        @param stale: indication that the songs were not just scanned
+        """
+        query = self.query.get()
+        incoming, outgoing = self.songs
+        for songlist, rows in ((self.list_outgoing, outgoing),
+                               (self.list_incoming, incoming)):
+            if stale is None:
+                stale = songlist.listing.stale
+            rows = self.index.filter(rows, query, itemgetter(0))
+            songlist.set(rows, stale=stale)
 
     @staticmethod
     def show_error_from_exception(exception, title="Error"):
@@ -265,7 +473,8 @@ def main(args=None):
 
     # Run the program
     try:
-        success = run(args)
+        with tracing.session(args.profile, args.trace):
+            success = run(args)
     except KeyboardInterrupt:
         logging.debug("program manually closed")
     else:
@@ -0,0 +1,170 @@
+"""Classes and functions to record and summarize downloaded songs."""
+
+import os
+import time
+import json
+import logging
+
+from dtb import CLI
+
+
+FILENAME = CLI + '.log'
+BUFFER_SIZE = 50  # number of entries to collect before writing
+FLUSH_DELAY = 10.0  # maximum seconds to keep an entry in the buffer
+MAX_BYTES = 1024 * 1024  # size of the log before it is rotated
+BACKUPS = 3  # number of rotated logs to keep
+UNKNOWN = 'unknown'  # friend name for entries without one
+
+
+class DownloadLog(object):
+    """Buffered JSON lines log of downloaded songs with size rotation."""
+
+    def __init__(self, path, buffer_size=BUFFER_SIZE, delay=FLUSH_DELAY,
+                 max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.delay = delay
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._buffer = []
+        self._oldest = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, path, friendname, size=None, duration=None):
+        """Add a downloaded song to the log.
+
+        @param path: path to the downloaded file
+        @param friendname: name of the friend who shared the song
+        @param size: number of bytes transferred
+        @param duration: number of seconds the transfer took
+        """
+        entry = {'time': round(time.time(), 3),
+                 'filename': os.path.basename(path),
+                 'friend': friendname,
+                 'bytes': size,
+                 'seconds': None if duration is None else round(duration, 3)}
+        self._buffer.append(json.dumps(entry, sort_keys=True) + '\n')
+        if self._oldest is None:
+            self._oldest = time.time()
+        if len(self._buffer) >= self.buffer_size or \
+                time.time() - self._oldest >= self.delay:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered entries to the log."""
+        if not self._buffer:
+            return
+        if self._file is None:
+            logging.debug("opening {}...".format(self.path))
+            self._file = open(self.path, 'a')
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+        logging.debug("logging {} download(s)...".format(len(self._buffer)))
+        self._file.write(''.join(self._buffer))
+        self._file.flush()
+        self._buffer = []
+        self._oldest = None
+
+    def close(self):
+        """Write all buffered entries and close the log."""
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self):
+        """Rename the current log and start a new one."""
+        logging.info("rotating {}...".format(self.path))
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, index)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self.path, index + 1))
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a')
+
+
+def summarize(path):
+    """Aggregate download statistics per friend from a log.
+
+    Totals are saved next to the log with the position read so far, so
+    only entries added since the last summary are read.
+
+    @param path: path to the log
+
+    @return: dictionary of friend name to count, bytes, and seconds
+    """
+    summary_path = path + '.summary'
+    try:
+        with open(summary_path, 'r') as infile:
+            summary = json.load(infile)
+    except (IOError, ValueError):
+        summary = {}
+    totals = summary.get('totals', {})
+    inode = summary.get('inode')
+    offset = summary.get('offset', 0)
+
+    try:
+        current = os.stat(path).st_ino
+    except FileNotFoundError:
+        return totals
+    if inode != current:
+        # The log was rotated, so finish reading the previous one first
+        previous = path + '.1'
+        if inode and os.path.exists(previous) and \
+                os.stat(previous).st_ino == inode:
+            _aggregate(previous, offset, totals)
+        else:
+            logging.debug("rebuilding summary of {}...".format(path))
+            totals = {}
+            for index in range(BACKUPS, 0, -1):
+                _aggregate("{}.{}".format(path, index), 0, totals)
+        offset = 0
+    offset = _aggregate(path, offset, totals)
+
+    summary = {'inode': current, 'offset': offset, 'totals': totals}
+    with open(summary_path, 'w') as outfile:
+        json.dump(summary, outfile)
+    return totals
+
+
+def _aggregate(path, offset, totals):
+    """Add the entries in a log after an offset to the totals.
+
+    @return: offset after the last complete entry
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as infile:
+        infile.seek(offset)
+        for line in infile:
+            if not line.endswith(b'\n'):
+                break  # partially written entry
+            offset += len(line)
+            text = line.decode('utf-8', 'replace').strip()
+            if not text:
+                continue
+            try:
+                entry = json.loads(text)
+            except ValueError:
+                # Entries before version 1.1 were "<filename> from <friend>"
+                entry = {'friend': text.rsplit(' from ', 1)[-1]}
+            if not isinstance(entry, dict):
+                logging.debug("invalid entry in {}: {}".format(path, text))
+                continue
+            friend = str(entry.get('friend') or UNKNOWN)
+            total = totals.setdefault(friend,
+                                      {'count': 0, 'bytes': 0, 'seconds': 0})
+            total['count'] += 1
+            total['bytes'] += entry.get('bytes') or 0
+            total['seconds'] += entry.get('seconds') or 0
+    return offset
@@ -0,0 +1,201 @@
+"""Classes and functions to claim songs before downloading them."""
+
+import os
+import re
+import json
+import time
+import socket
+import logging
+
+
+SUFFIX = '.lease'  # extension added to a link's path for its lease
+DURATION = 15 * 60  # seconds until an abandoned lease can be taken over
+SETTLE = 30.0  # seconds a new lease must stand for other computers to sync
+OWNER = "{}:{}".format(socket.gethostname(), os.getpid())  # this process
+
+# Leases, conflicting copies from sync clients, and leases being taken over
+RE_LEASE = re.compile(r'\.lease(\.\d+)?$')
+
+
+class Lease(object):
+    """Exclusive claim on a file shared by several computers.
+
+    The lease is a file next to the claimed file created with O_EXCL so
+    only one process can hold it. Expired leases are renamed away before
+    being replaced, which also only succeeds for one process.
+
+    Creating the file is only exclusive on this computer, so a new lease
+    is not held until it has stood for the settle time. Another computer
+    creating the same lease meanwhile replaces it or leaves a conflicting
+    copy once synced, and the owner that sorts first keeps its claim.
+    """
+
+    def __init__(self, path, owner=OWNER, duration=DURATION, settle=None):
+        self.path = path + SUFFIX
+        self.owner = owner
+        self.duration = duration
+        self.settle = SETTLE if settle is None else settle
+        self.held = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def acquire(self, wait=False):
+        """Try to claim the file.
+
+        New leases are created but not held until they have settled, so
+        either wait for the settle time or call again after it to finish
+        claiming the file.
+
+        @param wait: sleep until a new lease has settled
+
+        @return: indication that this process holds the lease
+        """
+        if self.held:
+            return True
+        for _ in range(2):
+            if self._create():
+                return self._verify(self.read(), wait)
+            data = self.read()
+            if data.get('owner') == self.owner:
+                return self._verify(data, wait)
+            if data.get('expires', 0) > time.time():
+                logging.info("claimed by {}: {}".format(data.get('owner'),
+                                                        self.path))
+                return False
+            # Take over the expired lease
+            stale = "{}.{}".format(self.path, os.getpid())
+            try:
+                os.rename(self.path, stale)
+            except FileNotFoundError:
+                continue  # released or taken over by another process
+            if self._read(stale).get('expires', 0) > time.time():
+                # Another process took over first so restore its lease
+                try:
+                    os.link(stale, self.path)
+                except OSError:
+                    pass  # a new lease was already created
+                os.remove(stale)
+                return False
+            logging.debug("taking over expired lease: {}".format(self.path))
+            os.remove(stale)
+        return False
+
+    def release(self):
+        """Give up the claim on the file."""
+        if not self.held:
+            return
+        self.held = False
+        if self.read().get('owner') == self.owner:
+            logging.debug("releasing lease: {}".format(self.path))
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def read(self):
+        """Get the lease's owner and expiration time or an empty dict."""
+        return self._read(self.path)
+
+    def _verify(self, data, wait=False):
+        """Hold this process's lease once it settled without rivals."""
+        remaining = data.get('claimed', 0) + self.settle - time.time()
+        if remaining > 0:
+            logging.debug("waiting for lease to settle: {}".format(self.path))
+            if not wait:
+                return False
+            time.sleep(remaining)
+        dirpath, filename = os.path.split(self.path)
+        prefix = filename[:-len(SUFFIX)] + ' '  # e.g. "a.yml (copy).lease"
+        now = time.time()
+        try:
+            filenames = os.listdir(dirpath)
+        except FileNotFoundError:
+            filenames = []
+        for name in sorted(filenames):
+            if not (name.startswith(prefix) and name.endswith(SUFFIX)):
+                continue
+            rival = self._read(os.path.join(dirpath, name))
+            owner = rival.get('owner')
+            if rival.get('expires', 0) > now and owner != self.owner and \
+                    str(owner) < self.owner:
+                logging.info("claimed by {}: {}".format(owner, self.path))
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                return False
+        self.held = True
+        return True
+
+    def _read(self, path):
+        """Get the owner and expiration time from a lease file."""
+        try:
+            with open(path, 'r') as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            return data
+        # An unreadable lease may be partially written so use its age
+        try:
+            return {'expires': os.path.getmtime(path) + self.duration}
+        except FileNotFoundError:
+            return {}
+
+    def _create(self):
+        """Atomically create the lease file if it does not exist."""
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        now = time.time()
+        with os.fdopen(fd, 'w') as outfile:
+            json.dump({'owner': self.owner, 'claimed': now,
+                       'expires': now + self.duration}, outfile)
+        logging.debug("created lease: {}".format(self.path))
+        return True
+
+
+def is_lease(filename):
+    """Determine if a filename is a lease rather than a link."""
+    return bool(RE_LEASE.search(filename))
+
+
+def clean(dirpath, filenames, duration=DURATION):
+    """Delete leases left behind by stopped processes.
+
+    Leases are deleted once they expired and the file they claim is gone,
+    as are leases interrupted while being taken over.
+
+    @param dirpath: path to a folder of links
+    @param filenames: names of the files in the folder
+    @param duration: seconds until an abandoned lease expires
+
+    @return: number of leases deleted
+    """
+    count = 0
+    names = set(filenames)
+    now = time.time()
+    for filename in filenames:
+        match = RE_LEASE.search(filename)
+        if not match:
+            continue
+        path = os.path.join(dirpath, filename)
+        claimed = filename[:match.start()]
+        if claimed in names and not match.group(1):
+            continue  # the file is still claimed or can be taken over
+        try:
+            expired = os.path.getmtime(path) + duration < now
+            if expired:
+                logging.info("deleting orphaned lease: {}".format(path))
+                os.remove(path)
+                count += 1
+        except FileNotFoundError:
+            pass
+    return count
@@ -0,0 +1,528 @@
+"""Classes and functions to catalog songs in a user's library."""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from itertools import chain
+from urllib.request import pathname2url
+
+from dtb import cache, match, tags, transfer, storage
+
+
+RETRY_DELAY = 60.0  # seconds before retrying a failed download
+RETRY_BACKOFF = 2.0  # multiplier for the delay after each failure
+RETRY_MAX_DELAY = 6 * 60 * 60.0  # maximum seconds between retries
+QUARANTINE = 8  # number of failures before a download is no longer retried
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    checksum TEXT,
+    artist TEXT,
+    title TEXT,
+    shared INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS drops (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    checksum TEXT,
+    artist TEXT,
+    title TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drops_checksum ON drops (checksum);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    friend TEXT NOT NULL,
+    name TEXT,
+    incoming INTEGER NOT NULL,
+    created REAL NOT NULL,
+    removed REAL
+);
+CREATE INDEX IF NOT EXISTS links_friend ON links (friend, incoming);
+CREATE INDEX IF NOT EXISTS links_name ON links (name);
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    friend TEXT,
+    path TEXT,
+    size INTEGER,
+    checksum TEXT,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_friend ON downloads (friend, time);
+CREATE INDEX IF NOT EXISTS downloads_time ON downloads (time);
+CREATE INDEX IF NOT EXISTS downloads_checksum ON downloads (checksum);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (token, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tokens_name ON tokens (name);
+CREATE TABLE IF NOT EXISTS matches (
+    request TEXT NOT NULL,
+    friend TEXT NOT NULL,
+    name TEXT NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (request, friend)
+);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS failures (
+    path TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    time REAL NOT NULL,
+    retry REAL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class Library(object):
+    """SQLite catalog of a user's songs."""
+
+    def __init__(self, path, root=None, readonly=False):
+        self.path = path
+        self.root = root
+        self.readonly = readonly  # another user's library
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def connection(self):
+        """Get the open database connection."""
+        if self._connection is None and self.readonly:
+            logging.debug("reading {}...".format(self.path))
+            # Synced libraries of other users are never changed: SQLite
+            # creates journal files for readers of WAL databases unless the
+            # file is opened as immutable, which is only complete when the
+            # owner has no changes left in a journal
+            uri = 'file:{}?mode=ro'.format(
+                pathname2url(os.path.abspath(self.path)))
+            if not os.path.exists(self.path + '-wal'):
+                uri += '&immutable=1'
+            self._connection = sqlite3.connect(uri, uri=True,
+                                               check_same_thread=False)
+        elif self._connection is None:
+            logging.debug("opening {}...".format(self.path))
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        """Save all changes and close the database."""
+        if self._connection:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+    def commit(self):
+        """Save all changes."""
+        self.connection.commit()
+
+    def _write(self, query, params, many=False):
+        """Execute and save a change, logging errors to not interrupt callers.
+
+        @param query: SQL statement to execute
+        @param params: values for the statement or a list of them if many
+
+        @return: indication that the change was saved
+        """
+        try:
+            if many:
+                self.connection.executemany(query, params)
+            else:
+                self.connection.execute(query, params)
+            self.commit()
+        except sqlite3.Error as error:
+            logging.warning("library not updated: {}".format(error))
+            return False
+        return True
+
+    def _key(self, path):
+        """Get a path relative to the sharing directory in *nix format."""
+        if self.root:
+            path = os.path.relpath(path, self.root)
+        return path.replace('\\', '/')
+
+    def unchanged(self, path, size, mtime, shared=False):
+        """Determine if a file is already cataloged with the same stats.
+
+        @param path: path to the file
+        @param size: current size of the file
+        @param mtime: current modification time of the file (nanoseconds)
+        @param shared: also require the file to have been shared
+
+        @return: indication that the file does not need to be indexed
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime, shared FROM songs WHERE path = ?",
+            (path,)).fetchone()
+        return bool(row) and row[:2] == (size, mtime) and \
+            (row[2] or not shared)
+
+    def add_song(self, path, size, mtime, checksum, artist, title,
+                 shared=False):
+        """Add or update a file in the catalog."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, checksum, artist, title, int(shared)))
+
+    def songs(self):
+        """Iterate through the cataloged files."""
+        query = "SELECT path, checksum, artist, title FROM songs ORDER BY path"
+        for row in self.connection.execute(query):
+            yield row
+
+    # drops ####################################################################
+
+    def add_drop(self, name, path, checksum=None):
+        """Add or update a file in the user's drops.
+
+        @param name: path to the file relative to the drops folder
+        @param path: path to the file
+        @param checksum: checksum of the file if known
+
+        @return: set of words indexed for the file
+        """
+        stat = os.stat(path)
+        artist, title = tags.read(path)
+        self._write(
+            "INSERT OR REPLACE INTO drops VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, stat.st_size, stat.st_mtime_ns, checksum, artist, title,
+             time.time()))
+        tokens = match.tokenize(artist, title)
+        self._write("DELETE FROM tokens WHERE name = ?", (name,))
+        self._write("INSERT OR IGNORE INTO tokens VALUES (?, ?)",
+                    [(token, name) for token in tokens], many=True)
+        return tokens
+
+    def remove_drop(self, name):
+        """Remove a file from the user's drops."""
+        self._write("DELETE FROM drops WHERE name = ?", (name,))
+        self._write("DELETE FROM tokens WHERE name = ?", (name,))
+
+    def rename_drop(self, old, new):
+        """Update the name of a file moved within the user's drops."""
+        for table in ('drops', 'tokens', 'matches'):
+            self._write("UPDATE {} SET name = ? WHERE name = ?".format(table),
+                        (new, old))
+
+    def expired(self, age=0, size=0, count=0):
+        """Get the drops beyond retention limits, keeping the newest.
+
+        Drops shared again count from when they were last shared.
+
+        @param age: maximum seconds since a drop was shared or 0 for no limit
+        @param size: maximum total bytes of drops or 0 for no limit
+        @param count: maximum number of drops or 0 for no limit
+
+        @return: list of (name, size), oldest first
+        """
+        cutoff = time.time() - age if age else None
+        rows = self.connection.execute(
+            "SELECT name, size, created FROM drops "
+            "ORDER BY created DESC, name DESC")
+        total = 0
+        expired = []
+        for index, (name, nbytes, created) in enumerate(rows):
+            total += nbytes
+            if (count and index >= count) or (size and total > size) or \
+                    (cutoff is not None and created < cutoff):
+                expired.append((name, nbytes))
+        expired.reverse()
+        return expired
+
+    def drops(self):
+        """Get the names of all cataloged drops."""
+        query = "SELECT name FROM drops"
+        return set(row[0] for row in self.connection.execute(query))
+
+    def find_drop(self, checksum):
+        """Get the name of a drop with a checksum or None."""
+        row = self.connection.execute(
+            "SELECT name FROM drops WHERE checksum = ?",
+            (checksum,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, tokens):
+        """Get the names of drops containing all of the words."""
+        tokens = sorted(tokens)
+        if not tokens:
+            return []
+        query = "SELECT name FROM tokens WHERE token IN ({}) " \
+            "GROUP BY name HAVING COUNT(*) = ? ORDER BY name".format(
+                ', '.join('?' * len(tokens)))
+        try:
+            rows = self.connection.execute(query, tokens + [len(tokens)])
+            return [row[0] for row in rows]
+        except sqlite3.Error as error:  # e.g. a library from an old version
+            logging.warning("cannot search {}: {}".format(self.path, error))
+            return []
+
+    def add_match(self, request, friend, name):
+        """Record that a request from a friend was matched to a drop.
+
+        @return: indication the request had not been matched before
+        """
+        row = self.connection.execute(
+            "SELECT 1 FROM matches WHERE request = ? AND friend = ?",
+            (request, friend)).fetchone()
+        if row:
+            return False
+        self._write("INSERT INTO matches VALUES (?, ?, ?, ?)",
+                    (request, friend, name, time.time()))
+        return True
+
+    # links ####################################################################
+
+    def add_link(self, path, friend, name, incoming=False):
+        """Add a link to or from a friend.
+
+        @param path: path to the link file
+        @param friend: name of the friend sending or receiving the song
+        @param name: filename of the linked song
+        @param incoming: indicates the link was received by the user
+        """
+        self._write(
+            "INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?, ?, NULL)",
+            (self._key(path), friend, name, int(incoming), time.time()))
+
+    def remove_link(self, path):
+        """Mark a link as removed, keeping it in the history."""
+        self._write(
+            "UPDATE links SET removed = ? WHERE path = ? AND removed IS NULL",
+            (time.time(), self._key(path)))
+
+    def links(self, incoming=None, friend=None, current=True, name=None):
+        """Get links sorted by creation time.
+
+        @param incoming: True for received links, False for sent, else both
+        @param friend: name of a friend to filter by
+        @param current: only include links that have not been removed
+        @param name: filename of a linked song to filter by
+
+        @return: list of (path, friend, name, incoming, created, removed)
+            with paths relative to the sharing directory
+        """
+        query = "SELECT * FROM links WHERE 1"
+        params = []
+        if incoming is not None:
+            query += " AND incoming = ?"
+            params.append(int(incoming))
+        if friend:
+            query += " AND friend = ?"
+            params.append(friend)
+        if name:
+            query += " AND name = ?"
+            params.append(name)
+        if current:
+            query += " AND removed IS NULL"
+        query += " ORDER BY created"
+        return self.connection.execute(query, params).fetchall()
+
+    def link_names(self, dirpath):
+        """Get the filenames of current links in a folder."""
+        key = self._key(dirpath) + '/'
+        rows = self.connection.execute(
+            "SELECT path FROM links WHERE path > ? AND path < ? "
+            "AND removed IS NULL", (key, key[:-1] + '0'))
+        return set(row[0][len(key):] for row in rows
+                   if '/' not in row[0][len(key):])
+
+    # downloads ################################################################
+
+    def add_download(self, path, friend, checksum=None):
+        """Record a downloaded song.
+
+        @param path: path to the downloaded file
+        @param friend: name of the friend who shared the song
+        @param checksum: checksum of the file if known
+        """
+        self._write(
+            "INSERT INTO downloads (name, friend, path, size, checksum, time) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (os.path.basename(path), friend, path, os.path.getsize(path),
+             checksum, time.time()))
+
+    def find_download(self, checksum):
+        """Get the path of the latest download with a checksum or None."""
+        row = self.connection.execute(
+            "SELECT path FROM downloads WHERE checksum = ? "
+            "ORDER BY time DESC LIMIT 1", (checksum,)).fetchone()
+        return row[0] if row else None
+
+    def downloads(self, friend=None, limit=None):
+        """Get the most recently downloaded songs.
+
+        @param friend: name of a friend to filter by
+        @param limit: maximum number of downloads to get
+
+        @return: list of (name, friend, path, size, checksum, time)
+        """
+        query = "SELECT name, friend, path, size, checksum, time FROM downloads"
+        params = []
+        if friend:
+            query += " WHERE friend = ?"
+            params.append(friend)
+        query += " ORDER BY time DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.connection.execute(query, params).fetchall()
+
+    # failures #################################################################
+
+    def add_failure(self, path, error):
+        """Record a failed download and schedule its next attempt.
+
+        @param path: path to the incoming song
+        @param error: description of the failure
+
+        @return: number of failed attempts
+        """
+        row = self.failure(path)
+        attempts = row[0] + 1 if row else 1
+        now = time.time()
+        if attempts >= QUARANTINE:
+            logging.warning("quarantined after {} attempts: {}".format(
+                attempts, path))
+            retry = None
+        else:
+            retry = now + min(RETRY_DELAY * RETRY_BACKOFF ** (attempts - 1),
+                              RETRY_MAX_DELAY)
+        self._write("INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?)",
+                    (self._key(path), attempts, error, now, retry))
+        return attempts
+
+    def remove_failure(self, path):
+        """Forget the failures of a download."""
+        self._write("DELETE FROM failures WHERE path = ?", (self._key(path),))
+
+    def failure(self, path):
+        """Get the failures of a download.
+
+        @return: attempts, last error, last time, next retry (None when
+            quarantined) or None if the download has not failed
+        """
+        return self.connection.execute(
+            "SELECT attempts, error, time, retry FROM failures "
+            "WHERE path = ?", (self._key(path),)).fetchone()
+
+    def can_retry(self, path):
+        """Determine if a download can be attempted now."""
+        row = self.failure(path)
+        return not row or (row[3] is not None and row[3] <= time.time())
+
+    def next_retry(self):
+        """Get the time of the next scheduled retry or None."""
+        row = self.connection.execute(
+            "SELECT MIN(retry) FROM failures").fetchone()
+        return row[0]
+
+    def failures(self):
+        """Get a summary that changes when failures are added or forgotten.
+
+        @return: number of failures, total attempts, and latest time
+        """
+        return tuple(self.connection.execute(
+            "SELECT COUNT(*), SUM(attempts), MAX(time) "
+            "FROM failures").fetchone())
+
+    def clear_failures(self):
+        """Forget all failures so quarantined downloads are retried.
+
+        @return: number of failures forgotten
+        """
+        rows = self.connection.execute("SELECT path FROM failures").fetchall()
+        self._write("DELETE FROM failures", ())
+        return len(rows)
+
+    def prune_failures(self):
+        """Forget the failures of songs that no longer exist."""
+        rows = self.connection.execute("SELECT path FROM failures").fetchall()
+        missing = [row for row in rows if not os.path.exists(
+            os.path.join(self.root or '', row[0]))]
+        if missing:
+            self._write("DELETE FROM failures WHERE path = ?", missing,
+                        many=True)
+
+    # reconciliation ###########################################################
+
+    def changed(self, path, files=()):
+        """Determine if a folder has changed since it was last reconciled.
+
+        @param path: path to a folder
+        @param files: paths to files in the folder whose changes also count
+
+        @return: current modification time if changed, otherwise None
+        """
+        mtime = 0
+        for filepath in chain([path], files):
+            try:
+                mtime = max(mtime, storage.stat(filepath).st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        row = self.connection.execute(
+            "SELECT mtime FROM folders WHERE path = ?",
+            (self._key(path),)).fetchone()
+        return None if row and row[0] == mtime else mtime
+
+    def reconciled(self, path, mtime):
+        """Remember the modification time of a reconciled folder."""
+        # Changes within the file system's mtime resolution could be missed
+        if time.time() - mtime / 1e9 < cache.RACY:
+            return
+        self._write("INSERT OR REPLACE INTO folders VALUES (?, ?)",
+                    (self._key(path), mtime))
+
+    # state ####################################################################
+
+    def get_state(self, key):
+        """Get a value saved between runs or None."""
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key, value):
+        """Save a value between runs, deleting it when None."""
+        if value is None:
+            self._write("DELETE FROM state WHERE key = ?", (key,))
+        else:
+            self._write("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                        (key, json.dumps(value)))
+
+
+def index(path, checksum=True):
+    """Compute the catalog information for a file.
+
+    This function runs in worker processes during bulk imports.
+
+    @param path: path to the file
+    @param checksum: also read the whole file to compute its checksum
+
+    @return: path, size, mtime, checksum or None, artist, title
+    """
+    stat = os.stat(path)
+    checksum = transfer.digest(path) if checksum else None
+    artist, title = tags.read(path)
+    return path, stat.st_size, stat.st_mtime_ns, checksum, artist, title
@@ -0,0 +1,101 @@
+"""Classes to display long lists of songs a screenful at a time."""
+
+import logging
+
+
+CACHE_SIZE = 10000  # display texts to keep before starting over
+
+
+class Listing(object):
+    """Songs displayed in a list of which only some rows are visible.
+
+    Rows are (Song, display text) pairs in a fixed order. Missing texts
+    are formatted when their rows are first displayed and remembered by
+    the song's path so they are not formatted again after a refresh.
+    Selections are also kept by path so they survive refreshes.
+    """
+
+    def __init__(self, label):
+        self.label = label  # function to format a song's display text
+        self.top = 0  # index of the first visible row
+        self.stale = False  # rows are from a previous scan
+        self._rows = []
+        self._texts = {}  # song path -> display text
+        self._selected = set()  # paths of selected songs
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        return self._rows[index][0]
+
+    def set(self, rows, stale=False):
+        """Replace the displayed songs.
+
+        @param rows: list of (Song, display text or None)
+        @param stale: indication that the songs were not just scanned
+        """
+        self._rows = rows
+        self.stale = stale
+        if len(self._texts) > CACHE_SIZE:
+            logging.debug("clearing cached display texts...")
+            self._texts = {}
+
+    def text(self, index):
+        """Get the display text for a row, formatting it if needed."""
+        song, text = self._rows[index]
+        if text is None:
+            text = self._texts.get(song.path)
+            if text is None:
+                text = self._texts[song.path] = self.label(song)
+        return text
+
+    def cached(self, song):
+        """Get a song's display text if it was already formatted."""
+        return self._texts.get(song.path)
+
+    def scroll(self, top, rows):
+        """Move the first visible row.
+
+        @param top: index of the desired first row
+        @param rows: number of visible rows
+
+        @return: range of row indices to display
+        """
+        self.top = max(0, min(top, len(self._rows) - rows))
+        return self.visible(rows)
+
+    def visible(self, rows):
+        """Get the range of row indices to display."""
+        return range(self.top, min(self.top + rows, len(self._rows)))
+
+    def fractions(self, rows):
+        """Get the visible portion of the list for a scrollbar."""
+        if not self._rows:
+            return 0.0, 1.0
+        count = len(self._rows)
+        return self.top / count, min(self.top + rows, count) / count
+
+    def select(self, index, selected=True):
+        """Add or remove a row from the selection."""
+        path = self._rows[index][0].path
+        if selected:
+            self._selected.add(path)
+        else:
+            self._selected.discard(path)
+
+    def is_selected(self, index):
+        """Determine if a row is selected."""
+        return self._rows[index][0].path in self._selected
+
+    def clear(self):
+        """Deselect all rows."""
+        self._selected = set()
+
+    @property
+    def selection(self):
+        """Get the selected songs in display order."""
+        if not self._selected:
+            return []
+        return [song for song, _ in self._rows
+                if song.path in self._selected]
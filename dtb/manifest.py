@@ -0,0 +1,257 @@
+"""Classes and functions to store many links in a few files."""
+
+import os
+import re
+import json
+import uuid
+import socket
+import logging
+
+from dtb import common
+
+
+FILES = 'files'  # one link file per song
+MANIFEST = 'manifest'  # links appended to a segment file per computer
+LAYOUTS = (FILES, MANIFEST)
+LAYOUT = FILES  # how new links are stored
+
+SUFFIX = '.manifest'  # extension of segment files
+LINK = '.link'  # extension of the paths of links stored in segments
+WRITER = None  # this installation's segment name, loaded on first use
+
+_CACHE = {}  # folder -> (segment signature, live links)
+
+
+def is_segment(filename):
+    """Determine if a filename is a segment of links.
+
+    Copies created by sync conflicts keep the extension so they are read
+    like any other segment.
+    """
+    return filename.endswith(SUFFIX)
+
+
+def is_entry(path):
+    """Determine if a path refers to a link stored in a segment."""
+    return path.endswith(LINK)
+
+
+def segment(dirpath):
+    """Get the path to this computer's segment in a folder."""
+    return os.path.join(dirpath, writer() + SUFFIX)
+
+
+def writer(create=True):
+    """Get the name of this installation's segments.
+
+    Host names can be shared by several computers, so each installation
+    creates a random ID once, kept on this computer only, and prefixes it
+    with the host name to keep segments recognizable.
+
+    @param create: create the ID if this installation has none yet
+
+    @return: name of the segments or None if not created
+    """
+    global WRITER  # pylint: disable=W0603
+    if WRITER is None:
+        path = os.path.join(common.LOCAL, 'writer')
+        try:
+            with open(path, 'r') as infile:
+                WRITER = infile.read().strip() or None
+        except FileNotFoundError:
+            pass
+        if WRITER is None and create:
+            hostname = re.sub(r'[^\w.-]', '_', socket.gethostname())
+            WRITER = "{}-{}".format(hostname, uuid.uuid4().hex[:8])
+            logging.debug("saving {}...".format(path))
+            os.makedirs(common.LOCAL, exist_ok=True)
+            with open(path, 'w') as outfile:
+                outfile.write(WRITER + '\n')
+    return WRITER
+
+
+def names(dirpath, filenames):
+    """Replace the segments in a folder listing with the links they hold.
+
+    @param dirpath: path to the folder
+    @param filenames: names of the files in the folder
+
+    @return: list of link filenames, with those from segments last
+    """
+    segments = [name for name in filenames if is_segment(name)]
+    if not segments:
+        return list(filenames)
+    links = load(dirpath, segments)
+    return [name for name in filenames if not is_segment(name)] + \
+        sorted(key + LINK for key in links)
+
+
+def load(dirpath, segments=None):
+    """Get the links stored in a folder's segments.
+
+    Segments are only parsed again when their size or time changes.
+
+    @param dirpath: path to the folder
+    @param segments: names of the segments or None to use the last seen
+
+    @return: dictionary of link ID -> link data
+    """
+    if segments is None:
+        cached = _CACHE.get(dirpath)
+        segments = [name for name, _ in cached[0]] if cached else \
+            [name for name in _listdir(dirpath) if is_segment(name)]
+    signature = []
+    for name in sorted(segments):
+        try:
+            stat = os.stat(os.path.join(dirpath, name))
+        except FileNotFoundError:
+            continue
+        signature.append((name, (stat.st_ino, stat.st_size,
+                                 stat.st_mtime_ns)))
+    signature = tuple(signature)
+    cached = _CACHE.get(dirpath)
+    if cached and cached[0] == signature:
+        return cached[1]
+    added, removed = {}, set()
+    for name, _ in signature:
+        for record in _read(os.path.join(dirpath, name)):
+            if record.get('removed'):
+                removed.add(record['id'])
+            else:
+                added[record['id']] = record
+    links = {key: data for key, data in added.items() if key not in removed}
+    _CACHE[dirpath] = signature, links
+    return links
+
+
+def lookup(path):
+    """Get the data of a link stored in a segment or None if removed."""
+    key = os.path.basename(path)[:-len(LINK)]
+    return load(os.path.dirname(path)).get(key)
+
+
+def exists(path):
+    """Determine if a link stored in a segment has not been removed."""
+    return lookup(path) is not None
+
+
+def add(dirpath, data):
+    """Store a new link in this computer's segment.
+
+    @param dirpath: path to the folder
+    @param data: link data to store
+
+    @return: path to the new link
+    """
+    key = uuid.uuid4().hex
+    record = dict(data, id=key)
+    _append(dirpath, record)
+    return os.path.join(dirpath, key + LINK)
+
+
+def remove(path):
+    """Record that a link stored in a segment was removed."""
+    if not exists(path):
+        raise FileNotFoundError("no such link: {}".format(path))
+    key = os.path.basename(path)[:-len(LINK)]
+    _append(os.path.dirname(path), {'id': key, 'removed': True})
+
+
+def compact(dirpath):
+    """Rewrite this computer's segment without records no longer needed.
+
+    Only this computer writes its segment so rewriting it cannot conflict
+    with other computers. Links removed anywhere are dropped, as are
+    removals of links no longer stored in any segment.
+
+    @param dirpath: path to the folder
+
+    @return: number of records dropped
+    """
+    current = writer(create=False)
+    if current is None:
+        return 0  # no segments were written from this computer
+    path = os.path.join(dirpath, current + SUFFIX)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    records = _read(path)
+    added, removed = set(), set()
+    for name in _listdir(dirpath):
+        if is_segment(name):
+            own = name == os.path.basename(path)
+            for record in records if own else \
+                    _read(os.path.join(dirpath, name)):
+                if record.get('removed'):
+                    removed.add(record['id'])
+                elif not own:
+                    added.add(record['id'])
+    # Keep links not removed anywhere and removals of links still stored
+    links = set(record['id'] for record in records
+                if not record.get('removed')) - removed
+    added |= links
+    kept = [record for record in records
+            if record['id'] in (added if record.get('removed') else links)]
+    dropped = len(records) - len(kept)
+    if not dropped:
+        return 0
+    logging.info("compacting {}...".format(path))
+    temp = path + '.tmp'
+    with open(temp, 'w') as outfile:
+        outfile.write(''.join(_dump(record) for record in kept))
+    # Give up if a link was added while the segment was being read
+    if os.path.getsize(path) != size:
+        logging.debug("segment changed while compacting: {}".format(path))
+        os.remove(temp)
+        return 0
+    os.replace(temp, path)
+    _CACHE.pop(dirpath, None)
+    return dropped
+
+
+def _listdir(dirpath):
+    """Get the names of the files in a folder or none if it is missing."""
+    try:
+        return os.listdir(dirpath)
+    except FileNotFoundError:
+        return []
+
+
+def _read(path):
+    """Get the records from a segment, skipping incomplete lines."""
+    records = []
+    try:
+        with open(path, 'r') as infile:
+            lines = infile.readlines()
+    except FileNotFoundError:
+        return records
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logging.debug("incomplete record in {}".format(path))
+            continue
+        if isinstance(record, dict) and record.get('id'):
+            records.append(record)
+    return records
+
+
+def _dump(record):
+    """Format a record as a line of a segment."""
+    return json.dumps(record, sort_keys=True) + '\n'
+
+
+def _append(dirpath, record):
+    """Add a record to this computer's segment in a single write."""
+    path = segment(dirpath)
+    logging.debug("appending to {}...".format(path))
+    data = _dump(record).encode('utf-8')
+    with open(path, 'ab+') as outfile:
+        # Start a new line after a record interrupted while being written
+        if outfile.tell():
+            outfile.seek(-1, os.SEEK_END)
+            if outfile.read(1) != b'\n':
+                data = b'\n' + data
+        outfile.write(data)
+    _CACHE.pop(dirpath, None)
@@ -0,0 +1,170 @@
+"""Classes and functions to match song requests to shared songs."""
+
+import os
+import re
+import time
+import uuid
+import logging
+import unicodedata
+
+import yaml
+
+
+STOPWORDS = {'a', 'an', 'and', 'the', 'of', 'feat', 'featuring', 'ft', 'vs'}
+
+
+def tokenize(*texts):
+    """Normalize text into a set of searchable words.
+
+    @param texts: strings (or None) to tokenize
+
+    @return: set of lowercase words without accents and punctuation
+    """
+    tokens = set()
+    for text in texts:
+        if not text:
+            continue
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        for word in re.split(r'\W+', text.lower()):
+            if word and word not in STOPWORDS:
+                tokens.add(word)
+    return tokens
+
+
+class Index(object):
+    """Inverted index from words to the keys of the items containing them."""
+
+    def __init__(self):
+        self._postings = {}  # token -> set of keys
+        self._tokens = {}  # key -> set of tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, key):
+        return key in self._tokens
+
+    def add(self, key, tokens):
+        """Add or replace an item's words."""
+        self.remove(key)
+        self._tokens[key] = set(tokens)
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(key)
+
+    def remove(self, key):
+        """Remove an item's words."""
+        for token in self._tokens.pop(key, ()):
+            keys = self._postings[token]
+            keys.discard(key)
+            if not keys:
+                del self._postings[token]
+
+    def search(self, tokens):
+        """Get the keys of items containing all of the words."""
+        if not tokens:
+            return set()
+        postings = sorted((self._postings.get(t, set()) for t in tokens),
+                          key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    def match(self, tokens):
+        """Get the keys of items whose words are all in the words."""
+        hits = {}
+        for token in tokens:
+            for key in self._postings.get(token, ()):
+                hits[key] = hits.get(key, 0) + 1
+        return set(key for key, count in hits.items()
+                   if count == len(self._tokens[key]))
+
+
+class Requests(object):
+    """Song requests stored in a YAML file with an index of open requests."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = Index()
+        self._requests = []
+        self._mtime = None
+
+    def __iter__(self):
+        self.load()
+        return iter(list(self._requests))
+
+    def load(self):
+        """Read the requests if the file changed since it was last read."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        logging.debug("loading {}...".format(self.path))
+        data = None
+        if mtime is not None:
+            with open(self.path, 'r') as infile:
+                data = yaml.safe_load(infile.read())
+        self._requests = data if isinstance(data, list) else []
+        self._mtime = mtime
+        self.index = Index()
+        for request in self._requests:
+            if request.get('status') == 'open':
+                self.index.add(request['id'], tokenize(request.get('title'),
+                                                       request.get('artist')))
+
+    def save(self):
+        """Write the requests to the file."""
+        text = yaml.dump(self._requests, default_flow_style=False)
+        logging.debug("saving {}...".format(self.path))
+        with open(self.path, 'w') as outfile:
+            outfile.write(text)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def add(self, title, artist=None):
+        """Add an open request.
+
+        @return: new request
+        """
+        self.load()
+        request = {'id': uuid.uuid4().hex, 'title': title, 'artist': artist,
+                   'time': round(time.time(), 3), 'status': 'open'}
+        self._requests.append(request)
+        self.index.add(request['id'], tokenize(title, artist))
+        self.save()
+        return request
+
+    def close(self, key, friendname, filename):
+        """Mark an open request as matched to a song.
+
+        @param key: ID of the request
+        @param friendname: name of the friend who shared the song
+        @param filename: name of the matching song file
+        """
+        self.load()
+        for request in self._requests:
+            if request['id'] == key:
+                request.update({'status': 'matched', 'friend': friendname,
+                                'song': filename})
+                self.index.remove(key)
+                self.save()
+                return request
+        raise ValueError("unknown request: {}".format(key))
+
+    def match(self, tokens):
+        """Get the open requests satisfied by a song's words."""
+        self.load()
+        keys = self.index.match(tokens)
+        return [r for r in self._requests if r['id'] in keys]
+
+
+# Requests files are only read again after they change
+_CACHE = {}
+
+
+def load(path):
+    """Get the requests stored in a file."""
+    if path not in _CACHE:
+        _CACHE[path] = Requests(path)
+    requests = _CACHE[path]
+    requests.load()
+    return requests
@@ -0,0 +1,69 @@
+"""Classes and functions to schedule scans of the sharing directory."""
+
+import os
+import random
+import logging
+
+
+MIN_DELAY = 1.0  # seconds to wait between scans while active
+MAX_DELAY = 60.0  # seconds to wait between scans while idle
+BACKOFF = 2.0  # factor to increase the delay by after each idle scan
+JITTER = 0.1  # fraction of the delay to randomize to spread out clients
+
+
+class Poller(object):
+    """Computes delays between scans with exponential backoff and jitter."""
+
+    def __init__(self, minimum=MIN_DELAY, maximum=MAX_DELAY,
+                 factor=BACKOFF, jitter=JITTER):
+        if minimum <= 0 or maximum < minimum:
+            raise ValueError("invalid delays: {}, {}".format(minimum, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.delay = minimum
+
+    def update(self, active):
+        """Reset the delay after activity, otherwise back off.
+
+        @param active: indicates the last scan found changes
+
+        @return: number of seconds to wait before the next scan
+        """
+        if active:
+            self.delay = self.minimum
+        else:
+            self.delay = min(self.delay * self.factor, self.maximum)
+        spread = self.delay * self.jitter
+        return max(0.0, self.delay + random.uniform(-spread, spread))
+
+
+def fingerprint(path, ignore=(), files=()):
+    """Get the modification times of a directory and its subdirectories.
+
+    @param path: path to the directory to fingerprint
+    @param ignore: names of entries to exclude
+    @param files: paths to files whose changes also count
+
+    @return: hashable value that changes when the directory's content changes
+    """
+    items = [('', os.stat(path).st_mtime_ns)]
+    for name in sorted(os.listdir(path)):
+        if name in ignore:
+            continue
+        subpath = os.path.join(path, name)
+        try:
+            stat = os.stat(subpath)
+        except OSError as error:  # deleted while scanning
+            logging.debug(error)
+        else:
+            items.append((name, stat.st_mtime_ns))
+    for filepath in files:
+        try:
+            stat = os.stat(filepath)
+        except OSError as error:  # deleted while scanning
+            logging.debug(error)
+        else:
+            items.append((filepath, stat.st_mtime_ns, stat.st_size))
+    return tuple(items)
@@ -0,0 +1,72 @@
+"""Classes and functions to detect files that are still being synced."""
+
+import os
+import time
+import logging
+
+
+SETTLE = 2.0  # seconds a file must be unchanged before it is copied
+
+# Names of files written by sync clients and downloads in progress
+TEMPORARY_PREFIXES = ('.dropbox', '.~', '~$')
+TEMPORARY_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download')
+
+
+def is_temporary(filename):
+    """Determine if a filename belongs to a file still being written."""
+    name = filename.lower()
+    return name.startswith(TEMPORARY_PREFIXES) or \
+        name.endswith(TEMPORARY_SUFFIXES)
+
+
+class Readiness(object):
+    """Tracks the size and times of files across scans.
+
+    A file is ready once it has not changed for SETTLE seconds, either
+    according to its modification and status change times or, when those
+    cannot be trusted, across observations by this process.
+    """
+
+    def __init__(self):
+        self._seen = {}  # path -> (size, mtime, ctime), time first seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    def ready(self, path):
+        """Determine if a file can be copied.
+
+        @param path: path to a file
+
+        @return: indication that the file is complete
+        """
+        if is_temporary(os.path.basename(path)):
+            return False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._seen.pop(path, None)
+            return False
+        now = time.time()
+        if now - max(stat.st_mtime, stat.st_ctime) >= SETTLE:
+            self._seen.pop(path, None)
+            return True
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+        seen = self._seen.get(path)
+        if seen and seen[0] == key:
+            if now - seen[1] >= SETTLE:
+                del self._seen[path]
+                return True
+        else:
+            self._seen[path] = (key, now)
+        logging.debug("still changing: {}".format(path))
+        return False
+
+
+# Observations are shared by all songs in this process
+TRACKER = Readiness()
+
+
+def ready(path):
+    """Determine if a file has finished syncing."""
+    return TRACKER.ready(path)
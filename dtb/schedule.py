@@ -0,0 +1,86 @@
+"""Classes and functions to order incoming song downloads."""
+
+import os
+import heapq
+import logging
+import itertools
+
+
+FIFO = 'fifo'  # oldest links first
+SMALL = 'small'  # smallest songs first
+FAIR = 'fair'  # alternate between friends, oldest links first
+POLICIES = (FIFO, SMALL, FAIR)
+
+
+def _mtime(path):
+    """Get the modification time of a file or 0 if it is missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _size(path):
+    """Get the size of a file or 0 if it is missing."""
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+class Scheduler(object):
+    """Heap of incoming songs ordered by a download policy.
+
+    Missing sources sort as empty files so broken links are cleared
+    quickly by the "small" policy.
+    """
+
+    def __init__(self, policy=FIFO):
+        if policy not in POLICIES:
+            raise ValueError("unknown order: {}".format(policy))
+        self.policy = policy
+        self._heap = []
+        self._order = itertools.count()  # keeps equal priorities stable
+        self._queued = {}  # friend name -> number of songs queued
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        while self._heap:
+            yield self.pop()
+
+    def _priority(self, song):
+        """Get the sort key for a song under the current policy."""
+        if self.policy == SMALL:
+            return (_size(song.located),)
+        mtime = _mtime(song.path)
+        if self.policy == FAIR:
+            rank = self._queued.get(song.friendname, 0)
+            self._queued[song.friendname] = rank + 1
+            return (rank, mtime)
+        return (mtime,)
+
+    def push(self, song):
+        """Add a song to the queue."""
+        priority = self._priority(song)
+        heapq.heappush(self._heap, (priority, next(self._order), song))
+
+    def extend(self, songs):
+        """Add songs to the queue.
+
+        @return: number of songs added
+        """
+        count = 0
+        for song in songs:
+            self.push(song)
+            count += 1
+        logging.debug("scheduled {} song(s) ({})".format(count, self.policy))
+        return count
+
+    def pop(self):
+        """Remove and return the next song to download."""
+        song = heapq.heappop(self._heap)[-1]
+        if self.policy == FAIR:
+            self._queued[song.friendname] -= 1
+        return song
@@ -0,0 +1,146 @@
+"""Classes and functions to find songs by filename and friend name."""
+
+import os
+import re
+import bisect
+import logging
+import threading
+from itertools import chain
+
+
+LAST = '\U0010ffff'  # sorts after every word with the same beginning
+
+
+def tokenize(text):
+    """Split text into lowercase words for searching.
+
+    >>> tokenize("Artist - Song (Live).mp3")
+    ['artist', 'song', 'live', 'mp3']
+    """
+    return re.findall(r'[^\W_]+', text.lower())
+
+
+def _tokens(song):
+    """Get the words to find a song by."""
+    filename = os.path.basename(song.source)
+    return set(tokenize(filename)) | set(tokenize(song.friendname or ''))
+
+
+class Index(object):
+    """In-memory inverted index of songs keyed by their paths.
+
+    Each word of a query matches the beginning of any word in a song's
+    filename or friend name, and songs must match every word. Links are
+    only read when the index is first searched after their song is added,
+    so scans that are never searched do not read links and later scans
+    only read new links.
+    """
+
+    def __init__(self):
+        self._songs = {}  # song path -> set of words
+        self._postings = {}  # word -> set of song paths
+        self._words = []  # sorted words for prefix lookups
+        self._pending = {}  # song path -> song added but not yet read
+        self._lock = threading.Lock()  # updated by scans in the background
+
+    def __len__(self):
+        return len(self._songs) + len(self._pending)
+
+    def __contains__(self, path):
+        return path in self._songs or path in self._pending
+
+    def add(self, song):
+        """Add a song to the index if it is not already present."""
+        with self._lock:
+            if song.path not in self._songs:
+                self._pending.setdefault(song.path, song)
+
+    def remove(self, path):
+        """Remove a song from the index by its path."""
+        with self._lock:
+            if self._pending.pop(path, None) is not None:
+                return
+            for word in self._songs.pop(path, ()):
+                paths = self._postings[word]
+                paths.discard(path)
+                if not paths:
+                    del self._postings[word]
+                    del self._words[bisect.bisect_left(self._words, word)]
+
+    def update(self, songs):
+        """Make the index contain exactly the scanned songs.
+
+        @param songs: all songs from a scan
+
+        @return: number of songs added and removed
+        """
+        paths = set()
+        added = 0
+        for song in songs:
+            paths.add(song.path)
+            if song.path not in self:
+                self.add(song)
+                added += 1
+        with self._lock:
+            removed = [path for path in chain(self._songs, self._pending)
+                       if path not in paths]
+        for path in removed:
+            self.remove(path)
+        if added or removed:
+            logging.debug("indexed {} new song(s), removed {}".format(
+                added, len(removed)))
+        return added, len(removed)
+
+    def search(self, query):
+        """Find the songs matching every word of a query.
+
+        @param query: words to search for
+
+        @return: set of song paths or None for an empty query
+        """
+        words = tokenize(query)
+        if not words:
+            return None
+        with self._lock:
+            self._read()
+            result = None
+            for word in sorted(words, key=len, reverse=True):
+                start = bisect.bisect_left(self._words, word)
+                end = bisect.bisect_left(self._words, word + LAST, start)
+                if result is not None and len(result) * 10 < end - start:
+                    # Checking the remaining songs is faster than merging
+                    result = {path for path in result
+                              if any(other.startswith(word)
+                                     for other in self._songs[path])}
+                else:
+                    paths = set().union(*(self._postings[other] for other
+                                          in self._words[start:end]))
+                    result = paths if result is None else result & paths
+                if not result:
+                    break
+        return result
+
+    def _read(self):
+        """Index the words of songs added since the last search."""
+        for path, song in self._pending.items():
+            words = self._songs[path] = _tokens(song)
+            for word in words:
+                paths = self._postings.get(word)
+                if paths is None:
+                    paths = self._postings[word] = set()
+                    bisect.insort(self._words, word)
+                paths.add(path)
+        self._pending.clear()
+
+    def filter(self, items, query, key=None):
+        """Get the items that match a query in their original order.
+
+        @param items: list of songs or items containing songs
+        @param query: words to search for
+        @param key: function to get the song from an item
+        """
+        paths = self.search(query)
+        if paths is None:
+            return list(items)
+        key = key or (lambda item: item)
+        return [item for item in items if key(item).path in paths]
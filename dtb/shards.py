@@ -0,0 +1,172 @@
+"""Classes and functions to spread drops across subfolders."""
+
+import os
+import hashlib
+import logging
+
+from dtb import storage
+
+
+FLAT = 'flat'  # all drops in one folder
+SHARDED = 'sharded'  # drops in subfolders named by a hash of the filename
+LAYOUTS = (FLAT, SHARDED)
+LAYOUT = FLAT  # where new drops are stored
+
+FOLDER = 'drops'  # name of the folder holding a user's drops
+WIDTH = 2  # hex digits in the names of subfolders
+
+
+def shard(filename):
+    """Get the name of the subfolder for a filename.
+
+    >>> shard('FakeSong.mp3')
+    'd7'
+    """
+    return hashlib.md5(filename.encode('utf-8')).hexdigest()[:WIDTH]
+
+
+def is_shard(name):
+    """Determine if a name in the drops folder is a subfolder of drops."""
+    return len(name) == WIDTH and \
+        all(char in '0123456789abcdef' for char in name)
+
+
+def folder(dirpath, filename, layout=None):
+    """Get the folder for a new drop, creating it if needed.
+
+    @param dirpath: path to the drops folder
+    @param filename: name of the dropped file
+    @param layout: layout to use or None for the current setting
+
+    @return: path to the folder to copy the file into
+    """
+    if (layout or LAYOUT) == FLAT:
+        return dirpath
+    path = os.path.join(dirpath, shard(filename))
+    if not storage.isdir(path):
+        logging.debug("creating {}...".format(path))
+        storage.makedirs(path)
+    return path
+
+
+def relative(dirpath, path):
+    """Get the name of a drop relative to the drops folder.
+
+    @param dirpath: path to the drops folder
+    @param path: path to a file
+
+    @return: name using '/' separators or None if not a drop
+    """
+    relpath = os.path.relpath(path, dirpath)
+    if relpath.startswith(os.pardir) or os.path.isabs(relpath):
+        return None
+    return relpath.replace(os.sep, '/')
+
+
+def names(dirpath):
+    """Get the names of all drops in either layout.
+
+    @param dirpath: path to the drops folder
+
+    @return: list of names relative to the drops folder
+    """
+    found = []
+    for entry in storage.listdir(dirpath):
+        path = os.path.join(dirpath, entry)
+        if is_shard(entry) and storage.isdir(path):
+            found.extend(entry + '/' + filename
+                         for filename in storage.listdir(path))
+        else:
+            found.append(entry)
+    return found
+
+
+def folders(dirpath, entries=None):
+    """Get the paths to the subfolders of drops.
+
+    @param dirpath: path to the drops folder
+    @param entries: names in the drops folder or None to list them
+    """
+    if entries is None:
+        entries = storage.listdir(dirpath)
+    paths = (os.path.join(dirpath, entry) for entry in entries
+             if is_shard(entry))
+    return [path for path in paths if storage.isdir(path)]
+
+
+def alternate(path):
+    """Get the path a drop would have in the other layout.
+
+    @param path: path to a file from a link
+
+    @return: path in the other layout or None if not a drop
+    """
+    dirpath, filename = os.path.split(path)
+    parent, entry = os.path.split(dirpath)
+    if entry == FOLDER:
+        return os.path.join(dirpath, shard(filename), filename)
+    if is_shard(entry) and os.path.basename(parent) == FOLDER:
+        return os.path.join(parent, filename)
+    return None
+
+
+def locate(path):
+    """Find a drop that was moved to the other layout.
+
+    Links created before drops were migrated point to the old location.
+
+    @param path: path to a file from a link
+
+    @return: path to the drop if it was moved, otherwise the given path
+    """
+    if storage.exists(path):
+        return path
+    other = alternate(path)
+    return other if other and storage.exists(other) else path
+
+
+def migrate(dirpath, layout=None):
+    """Move drops into the folders of a layout.
+
+    @param dirpath: path to the drops folder
+    @param layout: layout to move to or None for the current setting
+
+    @return: list of (old name, new name) for each moved drop
+    """
+    moved = []
+    for old in sorted(names(dirpath)):
+        filename = old.split('/')[-1]
+        if not storage.isfile(os.path.join(dirpath, old)):
+            continue
+        dst = os.path.join(folder(dirpath, filename, layout), filename)
+        new = relative(dirpath, dst)
+        if new == old:
+            continue
+        if storage.exists(dst):
+            logging.warning("not moving {}, already exists: {}".format(old,
+                                                                       dst))
+            continue
+        logging.info("moving {} to {}...".format(old, new))
+        storage.rename(os.path.join(dirpath, old), dst)
+        moved.append((old, new))
+    # Remove subfolders left empty by moving to the flat layout
+    prune(dirpath)
+    return moved
+
+
+def prune(dirpath):
+    """Remove subfolders of drops that are empty.
+
+    @param dirpath: path to the drops folder
+
+    @return: number of subfolders removed
+    """
+    count = 0
+    for path in folders(dirpath):
+        try:
+            storage.rmdir(path)
+        except OSError:
+            continue  # not empty
+        logging.debug("removed empty {}".format(path))
+        count += 1
+    return count
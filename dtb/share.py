@@ -3,6 +3,8 @@
 import os
 import logging
 
+from dtb import tracing, storage
+
 
 SERVICES = (
     'Dropbox',
@@ -12,26 +14,43 @@ SHARE = 'DropTheBeat'
 SHARE_DEPTH = 3  # number of levels to search for share directory
 
 
+@tracing.traced('share.find')
 def find(home=None):
     """Return the path to a sharing location."""
 
     home = home or os.path.expanduser("~")
 
     logging.debug("looking for service in {}...".format(home))
-    for directory in os.listdir(home):
+    for directory in storage.listdir(home):
         if directory in SERVICES:
             service = os.path.join(home, directory)
             logging.debug("found service: {}".format(service))
             logging.debug("looking for '{}' in {}...".format(SHARE, service))
-            for dirpath, dirnames, _, in os.walk(service):
-                depth = dirpath.count(os.path.sep) - service.count(os.path.sep)
-                if depth >= SHARE_DEPTH:
-                    del dirnames[:]
-                    continue
+            for dirpath in _walk(service, SHARE_DEPTH):
                 path = os.path.join(dirpath, SHARE)
-                if os.path.isdir(path) and \
-                        not os.path.isfile(os.path.join(path, 'setup.py')):
+                if storage.isdir(path) and \
+                        not storage.isfile(os.path.join(path, 'setup.py')):
                     logging.info("found share: {}".format(path))
                     return path
 
     raise EnvironmentError("no '{}' folder found".format(SHARE))
+
+
+def _walk(dirpath, depth):
+    """Iterate through a folder and its subfolders, parents first.
+
+    @param dirpath: path to the folder to start from
+    @param depth: number of levels of folders to include
+    """
+    if depth <= 0:
+        return
+    yield dirpath
+    try:
+        names = storage.listdir(dirpath)
+    except OSError as error:
+        logging.debug(error)
+        return
+    for name in names:
+        path = os.path.join(dirpath, name)
+        if storage.isdir(path):
+            yield from _walk(path, depth - 1)
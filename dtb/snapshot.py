@@ -0,0 +1,88 @@
+"""Functions to save and restore the last displayed songs."""
+
+import os
+import json
+import time
+import logging
+
+from dtb.song import Song
+
+
+VERSION = 1  # format of the snapshot file
+
+
+def _entries(root, songs):
+    """Convert (song, text) pairs to portable entries."""
+    return [[os.path.relpath(song.path, root).replace('\\', '/'),
+             song.friendname, text] for song, text in songs]
+
+
+def save(path, root, incoming, outgoing):
+    """Save the songs displayed after a scan.
+
+    Paths are stored relative to the sharing directory so the snapshot
+    still applies after the sharing directory moves. The file is only
+    written when the songs changed.
+
+    @param path: path to the snapshot file
+    @param root: path to root of sharing directory
+    @param incoming: list of (Song, display text or None) for incoming
+    @param outgoing: list of (Song, display text or None) for outgoing
+
+    @return: indication that the file was written
+    """
+    data = {'version': VERSION,
+            'incoming': _entries(root, incoming),
+            'outgoing': _entries(root, outgoing)}
+    previous = _read(path)
+    if previous and all(previous.get(k) == v for k, v in data.items()):
+        logging.debug("unchanged snapshot: {}".format(path))
+        return False
+    data['time'] = time.time()
+    logging.debug("saving {}...".format(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = path + '.tmp'
+    with open(temp, 'w') as outfile:
+        json.dump(data, outfile)
+    os.replace(temp, path)
+    return True
+
+
+def load(path, root, downloads=None, library=None):
+    """Load the songs displayed after the last scan.
+
+    @param path: path to the snapshot file
+    @param root: path to root of sharing directory
+    @param downloads: downloads directory for incoming songs
+    @param library: user's library for incoming songs
+
+    @return: time of the scan (or None), incoming and outgoing lists of
+        (Song, display text or None)
+    """
+    data = _read(path)
+    if not data or data.get('version') != VERSION:
+        return None, [], []
+    try:
+        incoming = [(Song(os.path.join(root, relpath), downloads, friendname,
+                          library=library), text)
+                    for relpath, friendname, text in data['incoming']]
+        outgoing = [(Song(os.path.join(root, relpath), friendname=friendname,
+                          library=library), text)
+                    for relpath, friendname, text in data['outgoing']]
+    except (KeyError, TypeError, ValueError):
+        logging.warning("invalid snapshot: {}".format(path))
+        return None, [], []
+    return data.get('time'), incoming, outgoing
+
+
+def _read(path):
+    """Read the snapshot file's data or None if unavailable."""
+    try:
+        with open(path, 'r') as infile:
+            data = json.load(infile)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logging.warning("invalid snapshot: {}".format(path))
+        return None
+    return data if isinstance(data, dict) else None
@@ -1,58 +1,142 @@
 """Classes and functions to interact with songs."""
 
 import os
-import shutil
 import uuid
 import logging
 
 import yaml
 
+from dtb import transfer, tracing, lease, readiness, manifest, shards
+from dtb import storage
+
 
 class Song(object):
     """Represents a song file or link."""
 
-    def __init__(self, path, downloads=None, friendname=None):
+    def __init__(self, path, downloads=None, friendname=None, checksum=None,
+                 library=None):
         self.path = path
         self.downloads = downloads
         self.friendname = friendname
+        self.library = library
+        self.duplicates = []  # other songs with the same source
+        self.deferred = False  # the last download did not fit
+        self._checksum = checksum
+        self._data = None  # link data once loaded
+        self._loaded = False
+        self._source = None
+        self._located = None
 
     def __str__(self):
         return str(self.path)
 
     def link(self, dirpath):
-        """Create a link to the song in the specified directory."""
-        if not os.path.isdir(dirpath):
+        """Create a link to the song in the specified directory.
+
+        Links are stored in their own files or in this computer's segment
+        of the folder depending on the manifest layout setting.
+
+        @return: path to the new link
+        """
+        if not storage.isdir(dirpath):
             logging.warning("creating missing folder: {}".format(dirpath))
-            os.makedirs(dirpath)
+            storage.makedirs(dirpath)
         relpath = os.path.relpath(self.path, dirpath)
+        data = {'link': relpath.replace('\\', '/')}  # always *nix format
+        if self.checksum:
+            data[transfer.ALGORITHM] = self.checksum
+        if manifest.LAYOUT == manifest.MANIFEST:
+            path = manifest.add(dirpath, data)
+            logging.info("added link {}...".format(path))
+            return path
         filename = "{}.yml".format(uuid.uuid4().hex)
         path = os.path.join(dirpath, filename)
         logging.info("creating link {}...".format(path))
-        with open(path, 'w') as link:
-            data = {'link': relpath.replace('\\', '/')}  # always *nix format
-            link.write(yaml.dump(data, default_flow_style=False))
+        storage.write(path, yaml.dump(data, default_flow_style=False))
+        return path
+
+    def _load(self):
+        """Load the song's link data or None if the song is not a link.
+
+        Links are only read once for each song.
+        """
+        if self._loaded:
+            return self._data
+        data = None
+        if manifest.is_entry(self.path):
+            data = manifest.lookup(self.path)
+            if not isinstance(data, dict) or not data.get('link', None):
+                logging.debug("removed link: {}".format(self.path))
+                data = None
+        elif self.path.endswith('.yml'):
+            text = storage.read(self.path)
+            try:
+                data = yaml.load(text)
+            except yaml.parser.ParserError:  # pylint: disable=E1101
+                logging.warning("invalid YAML: {}".format(self.path))
+                data = None
+            if not isinstance(data, dict) or not data.get('link', None):
+                logging.debug("non-link YAML: {}".format(self.path))
+                data = None
+        self._data, self._loaded = data, True
+        return data
 
     @property
     def source(self):
         """If the song is a link, return its source. Otherwise its path."""
-        src = self.path
-        if self.path.endswith('.yml'):
-            with open(self.path, 'r') as yml:
-                text = yml.read()
-                try:
-                    data = yaml.load(text)
-                except yaml.parser.ParserError:  # pylint: disable=E1101
-                    logging.warning("invalid YAML: {}".format(self.path))
-                    data = None
-                if data:
-                    relpath = data.get('link', None)
-                    if relpath:
-                        dirpath = os.path.dirname(self.path)
-                        path = os.path.join(dirpath, relpath)
-                        src = os.path.normpath(path)
-                    else:
-                        logging.debug("non-link YAML: {}".format(self.path))
-        return src
+        if self._source is None:
+            src = self.path
+            data = self._load()
+            if data:
+                dirpath = os.path.dirname(self.path)
+                src = os.path.normpath(os.path.join(dirpath, data['link']))
+            self._source = src
+        return self._source
+
+    @property
+    def located(self):
+        """Get the song's source, following drops moved to another layout.
+
+        Unlike the source, this checks that the file exists.
+        """
+        if self._located is None:
+            src = self.source
+            self._located = src if src == self.path else shards.locate(src)
+        return self._located
+
+    def retarget(self, moves):
+        """Point the song's link file at a source that was moved.
+
+        @param moves: dictionary of old source path -> new source path
+
+        @return: indication that the link was rewritten
+        """
+        if not self.path.endswith('.yml'):
+            return False  # links in manifests resolve moved drops when read
+        data = self._load()
+        if not data:
+            return False
+        dirpath = os.path.dirname(self.path)
+        src = os.path.normpath(os.path.join(dirpath, data['link']))
+        if src not in moves:
+            return False
+        relpath = os.path.relpath(moves[src], dirpath)
+        data['link'] = relpath.replace('\\', '/')  # always *nix format
+        logging.info("updating link {}...".format(self.path))
+        temp = self.path + '.tmp'
+        storage.write(temp, yaml.dump(data, default_flow_style=False))
+        storage.rename(temp, self.path)
+        self._source = self._located = None
+        return True
+
+    @property
+    def checksum(self):
+        """Get the checksum of the song's source or None if unknown."""
+        if self._checksum is None:
+            data = self._load()
+            if data:
+                self._checksum = data.get(transfer.ALGORITHM, None)
+        return self._checksum
 
     @property
     def in_string(self):
@@ -66,43 +150,173 @@ class Song(object):
         filename = os.path.basename(self.source)
         return "{} (to {})".format(filename, self.friendname)
 
+    @tracing.traced('Song.download')
     def download(self, catch=True):
         """Move the song to the user's download directory.
 
-        @return: path to downloaded file or None on broken links
+        Links to a song that was already downloaded are removed without
+        copying it again, as are the song's duplicates after a download.
+
+        Songs that failed to download are retried with increasing delays
+        unless errors are raised to the caller, and never retried once
+        they are quarantined.
+
+        @return: path to downloaded file or None on broken links, songs
+            already downloaded, songs still syncing, songs waiting to be
+            retried, songs that do not fit, or songs claimed by another
+            computer
         """
         assert self.downloads  # only called in cases where downloads is set
-        # Determine if the song file is actually a link
-        src = self.source
         dst = None
+        self.deferred = False
+        claim = lease.Lease(self.path)
+        # Back off from songs that keep failing
+        if catch and self.library and not self.library.can_retry(self.path):
+            logging.debug("waiting to retry: {}".format(self.path))
+            return None
+        # A missing downloads folder is not a failure of the song itself
+        if not os.path.isdir(self.downloads):
+            msg = "invalid download location: {}".format(self.downloads)
+            if not catch:
+                raise IOError(msg)
+            logging.error(msg)
+            return None
         # Move the file or copy from the link
         try:
-            if not os.path.isdir(self.downloads):
-                msg = "invalid download location: {}".format(self.downloads)
-                raise IOError(msg)
+            # Wait for partially synced links and songs to finish
+            if not self.ready():
+                logging.info("still syncing: {}".format(self.path))
+                return None
+            # Only one computer downloads songs for users with several, and
+            # callers handling errors themselves wait for the claim
+            if not claim.acquire(wait=not catch):
+                return None
+            if not self._exists():
+                logging.info("already downloaded: {}".format(self.path))
+                return None
+            # Determine if the song file is actually a link
+            src = self.located
             if src == self.path:
                 logging.info("moving {}...".format(src))
                 # Copy then delete in case the operation is canceled
-                shutil.copy(src, self.downloads)
-                dst = os.path.join(self.downloads, os.path.basename(src))
-                os.remove(src)
+                dst, checksum = transfer.copy(src, self.downloads)
+                storage.delete(src)
+                self._record(dst, checksum)
+                self._resolve(dst, checksum)
             else:
-                if os.path.exists(src):
+                previous = self._find_download()
+                if previous:
+                    logging.info("already downloaded: {}".format(previous))
+                    self._remove()
+                    self._record(previous, self.checksum)
+                    self._resolve(previous, self.checksum)
+                elif storage.exists(src):
                     logging.info("copying {}...".format(src))
-                    shutil.copy(src, self.downloads)
-                    dst = os.path.join(self.downloads, os.path.basename(src))
-                    os.remove(self.path)
+                    # Keep the link unless the copy matches the source
+                    dst, checksum = transfer.copy(src, self.downloads,
+                                                  self.checksum)
+                    self._remove()
+                    self._record(dst, checksum)
+                    self._resolve(dst, checksum)
                 else:
                     logging.debug("unknown link target: {}".format(src))
                     logging.warning("broken link: {}".format(self.path))
-                    os.remove(self.path)
+                    self._remove()
+                    self._record()
+        except transfer.SpaceError as error:
+            # Smaller songs may still fit so only this song is postponed
+            logging.warning("deferred: {}".format(error))
+            self.deferred = True
+            if not catch:
+                raise
         except IOError as error:
             logging.error(error)
+            if self.library:
+                self.library.add_failure(self.path, str(error))
             if not catch:
                 raise
+        finally:
+            claim.release()
         return dst
 
+    def ready(self):
+        """Determine if the song and its source have finished syncing."""
+        # Links in segments are only read once their record is complete
+        if not manifest.is_entry(self.path) and \
+                not readiness.ready(self.path):
+            return False
+        src = self.located
+        return src == self.path or not storage.exists(src) or \
+            readiness.ready(src)
+
     def ignore(self):
         """Delete the song."""
         logging.info("deleting {}...".format(self.path))
-        os.remove(self.path)
+        self._remove()
+        self._record()
+
+    def _exists(self):
+        """Determine if the song or its link has not been removed."""
+        if manifest.is_entry(self.path):
+            return manifest.exists(self.path)
+        return storage.exists(self.path)
+
+    def _remove(self):
+        """Delete the song or its link."""
+        if manifest.is_entry(self.path):
+            manifest.remove(self.path)
+        else:
+            storage.delete(self.path)
+
+    def _find_download(self):
+        """Get the path to an existing download of the song or None."""
+        if self.library and self.checksum:
+            path = self.library.find_download(self.checksum)
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    def _resolve(self, dst, checksum):
+        """Remove the song's duplicate links after it was downloaded."""
+        for song in self.duplicates:
+            # Duplicates are only removed, so other computers do not need
+            # time to see the claim, just to not be downloading them
+            with lease.Lease(song.path, settle=0) as claim:
+                if claim.acquire() and song._exists():  # pylint: disable=W0212
+                    logging.info("removing duplicate {}...".format(song.path))
+                    song._remove()  # pylint: disable=W0212
+                    song._record(dst, checksum)  # pylint: disable=W0212
+        self.duplicates = []
+
+    def _record(self, dst=None, checksum=None):
+        """Update the library after the song was downloaded or removed."""
+        if self.library:
+            if dst:
+                self.library.add_download(dst, self.friendname, checksum)
+            self.library.remove_link(self.path)
+            self.library.remove_failure(self.path)
+
+
+def group(songs):
+    """Combine songs that link to the same source or the same content.
+
+    @param songs: iterable of songs
+
+    @return: list of songs with the others attached as their duplicates
+    """
+    unique = []
+    found = {}  # source path or checksum -> first song
+    for song in songs:
+        keys = [song.source]
+        if song.checksum:
+            keys.append(song.checksum)
+        first = next((found[key] for key in keys if key in found), None)
+        if first:
+            logging.debug("duplicate of {}: {}".format(first, song))
+            first.duplicates.append(song)
+        else:
+            first = song
+            unique.append(song)
+        for key in keys:
+            found.setdefault(key, first)
+    return unique
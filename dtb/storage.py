@@ -0,0 +1,329 @@
+"""Classes and functions to access the files in the sharing folder."""
+
+import os
+import time
+import shutil
+import logging
+
+
+class Local(object):
+    """Files on the local file system."""
+
+    @staticmethod
+    def listdir(path):
+        """Get the names of the entries in a folder."""
+        return os.listdir(path)
+
+    @staticmethod
+    def stat(path):
+        """Get the size and modification time of a file or folder."""
+        return os.stat(path)
+
+    @staticmethod
+    def isdir(path):
+        """Determine if a path is a folder."""
+        return os.path.isdir(path)
+
+    @staticmethod
+    def isfile(path):
+        """Determine if a path is a file."""
+        return os.path.isfile(path)
+
+    @staticmethod
+    def exists(path):
+        """Determine if a path is a file or folder."""
+        return os.path.exists(path)
+
+    @staticmethod
+    def read(path):
+        """Get the text of a file."""
+        with open(path, 'r') as infile:
+            return infile.read()
+
+    @staticmethod
+    def write(path, text):
+        """Replace the text of a file, creating it if needed."""
+        with open(path, 'w') as outfile:
+            outfile.write(text)
+
+    @staticmethod
+    def rename(src, dst):
+        """Move a file, replacing the destination if it exists."""
+        os.replace(src, dst)
+
+    @staticmethod
+    def delete(path):
+        """Delete a file."""
+        os.remove(path)
+
+    @staticmethod
+    def makedirs(path):
+        """Create a folder and its missing parents."""
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def rmdir(path):
+        """Delete an empty folder."""
+        os.rmdir(path)
+
+    @staticmethod
+    def rmtree(path):
+        """Delete a folder and everything in it."""
+        shutil.rmtree(path)
+
+
+class Stat(object):
+    """Size and modification time of a file or folder in memory."""
+
+    def __init__(self, size, mtime_ns):
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+    @property
+    def st_mtime(self):
+        """Get the modification time in seconds."""
+        return self.st_mtime_ns / 1e9
+
+
+class Memory(object):
+    """Files kept in memory to run tests and benchmarks without a disk.
+
+    Every call is recorded as (operation, path) and can be delayed to
+    simulate slow mounts. Latency is a number of seconds for every
+    operation or a dictionary of operation name -> seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []  # (operation, path) of each call
+        self._files = {}  # path -> text
+        self._folders = {}  # path -> set of entry names
+        self._mtimes = {}  # path -> modification time in nanoseconds
+        self._clock = 0
+
+    def count(self, operation=None):
+        """Get the number of calls, optionally of a single operation."""
+        if operation is None:
+            return len(self.calls)
+        return sum(1 for name, _ in self.calls if name == operation)
+
+    def listdir(self, path):
+        """Get the names of the entries in a folder."""
+        path = self._call('listdir', path)
+        return sorted(self._folder(path))
+
+    def stat(self, path):
+        """Get the size and modification time of a file or folder."""
+        path = self._call('stat', path)
+        if path in self._files:
+            size = len(self._files[path].encode('utf-8'))
+        elif path in self._folders:
+            size = len(self._folders[path])
+        else:
+            raise FileNotFoundError("no such file: {}".format(path))
+        return Stat(size, self._mtimes[path])
+
+    def isdir(self, path):
+        """Determine if a path is a folder."""
+        return self._call('isdir', path) in self._folders
+
+    def isfile(self, path):
+        """Determine if a path is a file."""
+        return self._call('isfile', path) in self._files
+
+    def exists(self, path):
+        """Determine if a path is a file or folder."""
+        path = self._call('exists', path)
+        return path in self._files or path in self._folders
+
+    def read(self, path):
+        """Get the text of a file."""
+        path = self._call('read', path)
+        if path in self._folders:
+            raise IsADirectoryError("is a folder: {}".format(path))
+        try:
+            return self._files[path]
+        except KeyError:
+            raise FileNotFoundError("no such file: {}".format(path)) from None
+
+    def write(self, path, text):
+        """Replace the text of a file, creating it if needed."""
+        path = self._call('write', path)
+        if path in self._folders:
+            raise IsADirectoryError("is a folder: {}".format(path))
+        self._add(path)
+        self._files[path] = text
+        self._touch(path)
+
+    def rename(self, src, dst):
+        """Move a file, replacing the destination if it exists."""
+        src = self._call('rename', src)
+        dst = os.path.normpath(dst)
+        if src not in self._files:
+            raise FileNotFoundError("no such file: {}".format(src))
+        if dst in self._folders:
+            raise IsADirectoryError("is a folder: {}".format(dst))
+        self._add(dst)
+        self._files[dst] = self._files.pop(src)
+        self._mtimes[dst] = self._mtimes.pop(src)
+        self._discard(src)
+
+    def delete(self, path):
+        """Delete a file."""
+        path = self._call('delete', path)
+        if path in self._folders:
+            raise IsADirectoryError("is a folder: {}".format(path))
+        if path not in self._files:
+            raise FileNotFoundError("no such file: {}".format(path))
+        del self._files[path]
+        del self._mtimes[path]
+        self._discard(path)
+
+    def makedirs(self, path):
+        """Create a folder and its missing parents."""
+        self._makedirs(self._call('makedirs', path))
+
+    def rmdir(self, path):
+        """Delete an empty folder."""
+        path = self._call('rmdir', path)
+        if self._folder(path):
+            raise OSError("folder not empty: {}".format(path))
+        del self._folders[path]
+        del self._mtimes[path]
+        self._discard(path)
+
+    def rmtree(self, path):
+        """Delete a folder and everything in it."""
+        path = self._call('rmtree', path)
+        self._folder(path)
+        prefix = os.path.join(path, '')
+        for entries in (self._files, self._folders):
+            for key in [key for key in entries if key.startswith(prefix)]:
+                del entries[key]
+                del self._mtimes[key]
+        del self._folders[path]
+        del self._mtimes[path]
+        self._discard(path)
+
+    def _call(self, operation, path):
+        """Record a call, wait for its latency, and normalize its path."""
+        self.calls.append((operation, path))
+        if isinstance(self.latency, dict):
+            delay = self.latency.get(operation, 0.0)
+        else:
+            delay = self.latency
+        if delay:
+            logging.debug("delaying {} by {} seconds...".format(operation,
+                                                                delay))
+            time.sleep(delay)
+        return os.path.normpath(path)
+
+    def _folder(self, path):
+        """Get the entries of a folder that must exist."""
+        if path in self._files:
+            raise NotADirectoryError("not a folder: {}".format(path))
+        try:
+            return self._folders[path]
+        except KeyError:
+            raise FileNotFoundError("no such folder: {}".format(
+                path)) from None
+
+    def _touch(self, path):
+        """Update the modification time of a file or folder.
+
+        Times follow the wall clock like a real file system but always
+        increase so that every change can be detected.
+        """
+        self._clock = max(self._clock + 1, time.time_ns())
+        self._mtimes[path] = self._clock
+
+    def _add(self, path):
+        """Add an entry to its parent folder, which must exist."""
+        entries = self._folder(os.path.dirname(path))
+        name = os.path.basename(path)
+        if name not in entries:
+            entries.add(name)
+            self._touch(os.path.dirname(path))
+
+    def _discard(self, path):
+        """Remove an entry from its parent folder."""
+        self._folders[os.path.dirname(path)].discard(os.path.basename(path))
+        self._touch(os.path.dirname(path))
+
+    def _makedirs(self, path):
+        """Create a folder and its missing parents from a normalized path."""
+        if path in self._folders:
+            return
+        if path in self._files:
+            raise FileExistsError("is a file: {}".format(path))
+        parent = os.path.dirname(path)
+        if parent and parent != path:
+            self._makedirs(parent)
+        self._folders[path] = set()
+        self._touch(path)
+        if parent and parent != path:
+            self._add(path)
+
+
+# Files are accessed through this backend by all users in this process
+BACKEND = Local()
+
+
+def listdir(path):
+    """Get the names of the entries in a folder."""
+    return BACKEND.listdir(path)
+
+
+def stat(path):
+    """Get the size and modification time of a file or folder."""
+    return BACKEND.stat(path)
+
+
+def isdir(path):
+    """Determine if a path is a folder."""
+    return BACKEND.isdir(path)
+
+
+def isfile(path):
+    """Determine if a path is a file."""
+    return BACKEND.isfile(path)
+
+
+def exists(path):
+    """Determine if a path is a file or folder."""
+    return BACKEND.exists(path)
+
+
+def read(path):
+    """Get the text of a file."""
+    return BACKEND.read(path)
+
+
+def write(path, text):
+    """Replace the text of a file, creating it if needed."""
+    BACKEND.write(path, text)
+
+
+def rename(src, dst):
+    """Move a file, replacing the destination if it exists."""
+    BACKEND.rename(src, dst)
+
+
+def delete(path):
+    """Delete a file."""
+    BACKEND.delete(path)
+
+
+def makedirs(path):
+    """Create a folder and its missing parents."""
+    BACKEND.makedirs(path)
+
+
+def rmdir(path):
+    """Delete an empty folder."""
+    BACKEND.rmdir(path)
+
+
+def rmtree(path):
+    """Delete a folder and everything in it."""
+    BACKEND.rmtree(path)
@@ -0,0 +1,87 @@
+"""Functions to read song metadata."""
+
+import os
+import logging
+
+
+ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+FRAMES = {b'TPE1': 'artist', b'TIT2': 'title',  # ID3v2.3 and ID3v2.4
+          b'TP1': 'artist', b'TT2': 'title'}  # ID3v2.2
+
+
+def read(path):
+    """Get the artist and title of a song.
+
+    Tags are read from ID3v2 and ID3v1 headers when present, otherwise
+    they are parsed from a filename in the form "Artist - Title.ext".
+
+    @param path: path to a song file
+
+    @return: artist (or None), title
+    """
+    tags = {}
+    try:
+        with open(path, 'rb') as infile:
+            tags = _read_id3v2(infile) or _read_id3v1(infile)
+    except (IOError, ValueError) as error:
+        logging.debug("unreadable tags: {}: {}".format(path, error))
+    artist = tags.get('artist')
+    title = tags.get('title')
+    if not title:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if ' - ' in name:
+            artist, title = (part.strip() for part in name.split(' - ', 1))
+        else:
+            title = name
+    return artist or None, title
+
+
+def _read_id3v2(infile):
+    """Read text frames from an ID3v2 header."""
+    header = infile.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return {}
+    version, flags = header[3], header[5]
+    size = _syncsafe(header[6:10])
+    data = infile.read(size)
+    if flags & 0x40 and version >= 3:  # skip the extended header
+        if version == 4:
+            data = data[_syncsafe(data[:4]):]
+        else:
+            data = data[4 + int.from_bytes(data[:4], 'big'):]
+    tags = {}
+    id_size, header_size = (3, 6) if version == 2 else (4, 10)
+    while len(data) >= header_size and data[0]:
+        frame = data[:id_size]
+        raw = data[id_size:id_size * 2]
+        length = _syncsafe(raw) if version == 4 else \
+            int.from_bytes(raw, 'big')
+        text = data[header_size:header_size + length]
+        data = data[header_size + length:]
+        if frame in FRAMES and text:
+            encoding = ENCODINGS.get(text[0], 'latin-1')
+            value = text[1:].decode(encoding, 'replace').strip('\x00 ')
+            tags[FRAMES[frame]] = value.split('\x00')[0]
+    return tags
+
+
+def _read_id3v1(infile):
+    """Read the fields from an ID3v1 footer."""
+    infile.seek(0, os.SEEK_END)
+    if infile.tell() < 128:
+        return {}
+    infile.seek(-128, os.SEEK_END)
+    footer = infile.read(128)
+    if footer[:3] != b'TAG':
+        return {}
+    title = footer[3:33].split(b'\x00')[0].decode('latin-1').strip()
+    artist = footer[33:63].split(b'\x00')[0].decode('latin-1').strip()
+    return {'artist': artist, 'title': title}
+
+
+def _syncsafe(data):
+    """Decode an integer stored with 7 bits per byte."""
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7F)
+    return value
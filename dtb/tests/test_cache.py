@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.cache module."""
+
+import unittest
+from unittest.mock import patch
+
+import os
+import tempfile
+import shutil
+
+from dtb.cache import DirectoryCache
+
+
+class TestDirectoryCache(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the DirectoryCache class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        open(os.path.join(self.temp, 'a'), 'w').close()  # touch the file
+        os.utime(self.temp, (0, 0))
+        self.cache = DirectoryCache(size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_listdir_unchanged(self):
+        """Verify unchanged directories are not listed again."""
+        self.assertEqual(['a'], self.cache.listdir(self.temp))
+        with patch('os.listdir') as mock_listdir:
+            self.assertEqual(['a'], self.cache.listdir(self.temp))
+        self.assertFalse(mock_listdir.called)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual(1, self.cache.count(self.temp))
+
+    def test_listdir_changed(self):
+        """Verify changed directories are listed again."""
+        self.cache.listdir(self.temp)
+        open(os.path.join(self.temp, 'b'), 'w').close()  # touch the file
+        self.assertEqual(['a', 'b'], sorted(self.cache.listdir(self.temp)))
+
+    def test_listdir_recent(self):
+        """Verify recently changed directories are not cached."""
+        os.utime(self.temp)
+        self.cache.listdir(self.temp)
+        self.assertEqual(0, len(self.cache))
+        self.assertIs(None, self.cache.count(self.temp))
+
+    def test_listdir_file(self):
+        """Verify files cannot be listed."""
+        path = os.path.join(self.temp, 'a')
+        self.assertRaises(NotADirectoryError, self.cache.listdir, path)
+
+    def test_size(self):
+        """Verify the least recently used listings are discarded."""
+        for name in ('x', 'y', 'z'):
+            path = os.path.join(self.temp, name)
+            os.mkdir(path)
+            os.utime(path, (0, 0))
+            self.cache.listdir(path)
+        self.assertEqual(2, len(self.cache))
+        self.assertIs(None, self.cache.count(os.path.join(self.temp, 'x')))
+
+    def test_clear(self):
+        """Verify the cache can be cleared."""
+        self.cache.listdir(self.temp)
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,16 +3,19 @@
 """Tests for the dtb.cli module."""
 
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, MagicMock
 
 import os
 import tempfile
 import shutil
+import json
 import logging
 
 import yaml
 
-from dtb.cli import main
+from dtb import config, control, user, lease
+from dtb import cli
+from dtb.cli import main, _loop
 
 from dtb.tests import ENV, REASON, FAKESONG
 
@@ -29,8 +32,13 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         self.root = tempfile.mkdtemp()
         self.downloads = tempfile.mkdtemp()
         os.chdir(self.root)
+        # Songs are shared and downloaded faster than they can settle
+        self.environ = patch.dict(os.environ, {'DTB_SETTLE_TIME': '0'})
+        self.environ.start()
 
     def tearDown(self):
+        self.environ.stop()
+        config.Config().apply()
         os.chdir(self.cwd)
         shutil.rmtree(self.downloads)
         shutil.rmtree(self.root)
@@ -93,6 +101,19 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         self.dtb('--share', FAKESONG, '--test', 'JaceBrowning')
         # Show the shared song
         self.dtb('--outgoing', '--test', 'JaceBrowning')
+        with patch('builtins.print') as mock_print:
+            self.dtb('--outgoing', '--filter', 'fake jane',
+                     '--test', 'JaceBrowning')
+            self.dtb('--outgoing', '--filter', 'other',
+                     '--test', 'JaceBrowning')
+        self.assertEqual(1, mock_print.call_count)
+        # Move the shared song to a subfolder and back
+        drops = os.path.join(self.root, 'JaceBrowning', '.dtb', 'drops')
+        with patch.dict(os.environ, {'DTB_DROPS': 'sharded'}):
+            self.dtb('--migrate', '--test', 'JaceBrowning')
+        self.ls(drops, 'FakeSong.mp3', expected=False)
+        self.dtb('--migrate', '--test', 'JaceBrowning')
+        self.ls(drops, 'FakeSong.mp3')
         # Download the shared song (1)
         self.dtb('--incoming', '--test', 'JaneDoe')
         self.dtb('--test', 'JaneDoe')
@@ -104,11 +125,32 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         self.ls(self.downloads, 'FakeSong.mp3')
         # Show that no more songs are shared
         self.dtb('--outgoing', '--test', 'JaceBrowning')
+        # Delete the song that is no longer shared
+        drops = os.path.join(self.root, 'JaceBrowning', '.dtb', 'drops')
+        self.ls(drops, 'FakeSong.mp3')
+        self.dtb('--cleanup', '--test', 'JaceBrowning')
+        self.ls(drops, 'FakeSong.mp3', expected=False)
         # Check the log
         self.ls(self.downloads, 'dtb.log')
-        self.cat(os.path.join(self.downloads, 'dtb.log'),
-                 "FakeSong.mp3 from JaceBrowning\n"
-                 "FakeSong.mp3 from JaceBrowning\n")
+        with open(os.path.join(self.downloads, 'dtb.log'), 'r') as infile:
+            entries = [json.loads(line) for line in infile]
+        self.assertEqual(2, len(entries))
+        for entry in entries:
+            self.assertEqual('FakeSong.mp3', entry['filename'])
+            self.assertEqual('JaceBrowning', entry['friend'])
+            self.assertEqual(os.path.getsize(FAKESONG), entry['bytes'])
+        # Profile and trace a command
+        self.dtb('--outgoing', '--test', 'JaceBrowning',
+                 '--profile', 'dtb.prof', '--trace', 'dtb.json')
+        self.ls(self.root, 'dtb.prof')
+        with open(os.path.join(self.root, 'dtb.json'), 'r') as infile:
+            names = set(e['name'] for e in json.load(infile)['traceEvents'])
+        self.assertIn('User.outgoing', names)
+        # Display the statistics and history
+        self.dtb('--stats', '--test', 'JohnDoe')
+        self.dtb('--history', '--test', 'JohnDoe')
+        self.dtb('--history', '--test', 'JaceBrowning', '--users', 'JaneDoe')
+        self.ls(self.downloads, 'dtb.log.summary')
 
     def test_recommend_download_no_log(self):
         """Verify a song can be shared and downloaded."""
@@ -122,10 +164,73 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         # Share a song
         self.dtb('--share', FAKESONG, '--test', 'JaneDoe')
         # Download the shared song
-        self.dtb('--no-log', '--test', 'JohnDoe')
+        self.dtb('--no-log', '--order', 'small', '--test', 'JohnDoe')
+        self.ls(self.downloads, 'FakeSong.mp3')
         # Check for no long
         self.ls(self.downloads, 'dtb.log', expected=False)
 
+    def test_share_folder(self):
+        """Verify a folder of songs can be shared."""
+        self.log("sharing a folder of songs")
+        # Create users
+        self.dtb('--new', 'JaneDoe')
+        self.dtb('--new', 'JohnDoe')
+        self.set_downloads('JohnDoe')
+        # Import and share a folder
+        folder = tempfile.mkdtemp()
+        try:
+            for name in ('a.mp3', 'b.mp3'):
+                with open(os.path.join(folder, name), 'w') as outfile:
+                    outfile.write(name)  # identical songs are downloaded once
+            self.dtb('--import', folder, '--test', 'JaneDoe')
+            self.dtb('--share', folder, '--test', 'JaneDoe', '--workers', '1')
+        finally:
+            shutil.rmtree(folder)
+        # Download the shared songs
+        self.dtb('--test', 'JohnDoe')
+        self.ls(self.downloads, 'a.mp3')
+        self.ls(self.downloads, 'b.mp3')
+
+    @patch('dtb.library.QUARANTINE', 2)
+    def test_download_retry(self):
+        """Verify failed downloads are retried later and quarantined."""
+        self.log("retrying failed downloads")
+        # Create users
+        self.dtb('--new', 'JaneDoe')
+        self.dtb('--new', 'JohnDoe')
+        self.set_downloads('JohnDoe')
+        # Share a song
+        self.dtb('--share', FAKESONG, '--test', 'JaneDoe')
+        # Fail to download the song
+        with patch('dtb.transfer.copy', Mock(side_effect=IOError("failed"))):
+            with patch('dtb.library.RETRY_DELAY', 0):
+                self.dtb('--test', 'JohnDoe')
+                self.dtb('--test', 'JohnDoe')
+        # Display the quarantined song
+        with patch('builtins.print') as mock_print:
+            self.dtb('--incoming', '--test', 'JohnDoe')
+        text = mock_print.call_args[0][0]
+        self.assertTrue(text.startswith("quarantined: "), text)
+        # Retry the song
+        self.dtb('--test', 'JohnDoe')
+        self.ls(self.downloads, 'FakeSong.mp3', expected=False)
+        self.dtb('--retry', '--test', 'JohnDoe')
+        self.ls(self.downloads, 'FakeSong.mp3')
+
+    def test_request(self):
+        """Verify a song can be requested."""
+        self.log("requesting a song")
+        # Create users
+        self.dtb('--new', 'JaneDoe')
+        self.dtb('--new', 'JohnDoe')
+        # Request a song
+        self.dtb('--request', 'FakeSong', '--test', 'JaneDoe')
+        self.dtb('--request', 'Other', '--artist', 'Nobody',
+                 '--test', 'JaneDoe')
+        # Share the song and display the requests
+        self.dtb('--share', FAKESONG, '--test', 'JohnDoe', '--users', 'x')
+        self.dtb('--requests', '--test', 'JaneDoe')
+
     @patch('time.sleep', Mock(side_effect=KeyboardInterrupt))
     def test_interrupt_daemon(self):
         """Verify the daemon can be interrupted."""
@@ -135,6 +240,38 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         # Run the daemon
         self.assertIs(None, self.dtb('--daemon'))
 
+    @unittest.skipUnless(control.available(), "no Unix sockets")
+    def test_daemon_commands(self):
+        """Verify commands are answered by a running daemon."""
+        self.log("sending commands to the daemon")
+        # Create users
+        self.dtb('--new', 'JaneDoe')
+        self.dtb('--new', 'JaceBrowning')
+        # Start the daemon
+        server = control.Server(user.User(os.path.join(self.root,
+                                                       'JaceBrowning')))
+        self.assertTrue(server.start())
+        try:
+            with patch.object(server, 'run', wraps=server.run) as mock_run, \
+                    patch('builtins.print') as mock_print:
+                self.dtb('--share', FAKESONG, '--test', 'JaceBrowning')
+                self.dtb('--outgoing', '--test', 'JaceBrowning')
+                self.dtb('--incoming', '--test', 'JaceBrowning')
+            commands = [args[0] for args, _ in mock_run.call_args_list]
+            self.assertEqual(['share', 'outgoing', 'incoming'], commands)
+            self.assertEqual(2, mock_print.call_count)
+        finally:
+            server.close()
+
+    def test_daemon_invalid_delays(self):
+        """Verify the daemon delays are checked."""
+        self.log("running the daemon with invalid delays")
+        # Create user
+        self.dtb('--new', 'JaceBrowning')
+        # Run the daemon
+        self.assertRaises(SystemExit, self.dtb, '--daemon',
+                          '--min-delay', '10', '--max-delay', '1')
+
     def test_duplicate_users(self):
         """Verify duplicate users cannot be created."""
         self.log("creating a duplicate user")
@@ -161,6 +298,67 @@ class TestCLI(unittest.TestCase):  # pylint: disable=R0904
         self.dtb('--gui')
 
 
+class TestLoop(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the daemon loop."""  # pylint: disable=W0212
+
+    @patch('time.sleep', Mock(side_effect=[None, None, KeyboardInterrupt]))
+    @patch('dtb.cli._download', Mock(return_value=(False, False)))
+    @patch('dtb.control.Server', MagicMock())
+    def test_link_added_during_scan(self):
+        """Verify links added while downloading are found by the next scan."""
+        this = Mock()
+        this.library.next_retry.return_value = None
+        cfg = Mock(min_delay=1, max_delay=2)
+        cfg.reload.return_value = False
+        with patch('dtb.cli._fingerprint', Mock(side_effect=['a', 'b', 'b'])):
+            self.assertRaises(KeyboardInterrupt, _loop, this, True, False,
+                              cfg)
+        self.assertEqual(2, cli._download.call_count)
+
+    @patch('time.sleep', Mock(side_effect=[None, None, KeyboardInterrupt]))
+    @patch('dtb.cli._download', Mock(return_value=(False, True)))
+    @patch('dtb.control.Server', MagicMock())
+    def test_deferred(self):
+        """Verify songs that did not fit are not downloaded every scan."""
+        this = Mock()
+        this.library.next_retry.return_value = None
+        cfg = Mock(min_delay=1, max_delay=60)
+        cfg.reload.return_value = False
+        with patch('dtb.cli._fingerprint', Mock(return_value='a')):
+            self.assertRaises(KeyboardInterrupt, _loop, this, True, False,
+                              cfg)
+        self.assertEqual(1, cli._download.call_count)
+
+
+class TestDownload(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for downloading incoming songs."""  # pylint: disable=W0212
+
+    @patch('time.sleep')
+    @patch('dtb.lease.Lease.read', Mock(return_value={'owner': lease.OWNER}))
+    def test_claimed(self, mock_sleep):
+        """Verify songs are downloaded once their new leases settle."""
+        song = Mock(path='a.yml', downloads=tempfile.gettempdir(),
+                    download=Mock(side_effect=[None, 'a.mp3']))
+        with patch('dtb.cli.group', Mock(return_value=[song])):
+            self.assertEqual((False, False), cli._download(Mock()))
+        self.assertEqual(2, song.download.call_count)
+        mock_sleep.assert_called_once_with(lease.SETTLE)
+
+    def test_deferred(self):
+        """Verify songs that did not fit are not rescanned right away."""
+        song = Mock(path=FAKESONG, downloads=tempfile.gettempdir(),
+                    deferred=True, download=Mock(return_value=None))
+        with patch('dtb.cli.group', Mock(return_value=[song])):
+            self.assertEqual((False, True), cli._download(Mock()))
+
+    def test_missing_downloads(self):
+        """Verify no songs are downloaded without a downloads folder."""
+        song = Mock(path='a.yml', downloads='missing')
+        with patch('dtb.cli.group', Mock(return_value=[song, song])):
+            self.assertEqual((False, False), cli._download(Mock()))
+        self.assertFalse(song.download.called)
+
+
 @patch('dtb.cli._run', Mock(return_value=True))  # pylint: disable=R0904
 class TestLogging(unittest.TestCase):  # pylint: disable=R0904
     """Integration tests for logging levels."""
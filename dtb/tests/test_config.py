@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.config module."""
+
+import unittest
+from unittest.mock import patch
+
+import os
+import tempfile
+import shutil
+
+from dtb import config, poll
+
+
+class TestConfig(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Config class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'settings.yml')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def write(self, text):
+        """Replace the settings file and mark it as changed."""
+        with open(self.path, 'w') as outfile:
+            outfile.write(text)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    def test_defaults(self):
+        """Verify defaults are used without other settings."""
+        cfg = config.Config(self.path, environ={})
+        self.assertEqual(poll.MIN_DELAY, cfg.min_delay)
+        self.assertIs(None, cfg.workers)
+
+    def test_unknown(self):
+        """Verify unknown settings cannot be accessed."""
+        cfg = config.Config(environ={})
+        self.assertRaises(AttributeError, getattr, cfg, 'foo')
+
+    def test_precedence(self):
+        """Verify arguments override the environment and the file."""
+        self.write("min_delay: 3\nmax_delay: 30\nworkers: 2\n")
+        environ = {'DTB_MAX_DELAY': '20', 'DTB_WORKERS': '4'}
+        cfg = config.Config(self.path, {'workers': 8, 'min_delay': None},
+                            environ)
+        self.assertEqual(3.0, cfg.min_delay)
+        self.assertEqual(20.0, cfg.max_delay)
+        self.assertEqual(8, cfg.workers)
+
+    def test_invalid(self):
+        """Verify invalid and unknown settings are ignored."""
+        self.write("min_delay: -1\nworkers: many\nfoo: bar\n")
+        cfg = config.Config(self.path, environ={})
+        self.assertEqual(poll.MIN_DELAY, cfg.min_delay)
+        self.assertIs(None, cfg.workers)
+
+    def test_invalid_choice(self):
+        """Verify settings with allowed values reject other values."""
+        self.write("order: random\n")
+        cfg = config.Config(self.path, {'order': 'small'}, environ={})
+        self.assertEqual('small', cfg.order)
+        cfg = config.Config(self.path, environ={})
+        self.assertEqual('fifo', cfg.order)
+
+    def test_invalid_yaml(self):
+        """Verify invalid settings files are ignored."""
+        self.write("min_delay: [\n")
+        cfg = config.Config(self.path, environ={})
+        self.assertEqual(poll.MIN_DELAY, cfg.min_delay)
+
+    def test_reload(self):
+        """Verify the file is only parsed again after it changes."""
+        self.write("min_delay: 2\n")
+        cfg = config.Config(self.path, environ={})
+        self.assertFalse(cfg.reload())
+        self.write("min_delay: 4\n")
+        self.assertTrue(cfg.reload())
+        self.assertEqual(4.0, cfg.min_delay)
+
+    @patch('dtb.transfer.CHUNK_SIZE', 1024)
+    @patch('dtb.share.SHARE_DEPTH', 3)
+    @patch('dtb.user.CACHE.size', 0)
+    def test_apply(self):
+        """Verify settings update the package's defaults once applied."""
+        self.write("chunk_size: 4096\ncache_size: 10\n")
+        cfg = config.Config(self.path, environ={'DTB_SHARE_DEPTH': '5'})
+        self.assertEqual(1024, config.transfer.CHUNK_SIZE)
+        with patch('dtb.transfer.READ'), patch('dtb.transfer.WRITE'):
+            cfg.apply()
+        self.assertEqual(5, config.share.SHARE_DEPTH)
+        self.assertEqual(4096, config.transfer.CHUNK_SIZE)
+        self.assertEqual(10, config.user.CACHE.size)
+
+    def test_check(self):
+        """Verify the delays between scans are checked together."""
+        cfg = config.Config(self.path, {'min_delay': 10, 'max_delay': 5},
+                            {})
+        self.assertRaises(ValueError, cfg.check)
+        cfg = config.Config(self.path, {'min_delay': 10, 'max_delay': 10},
+                            {})
+        cfg.check()
+
+    def test_environment_only(self):
+        """Verify settings needed to find the file are not read from it."""
+        self.write("share_depth: 5\n")
+        cfg = config.Config(self.path, environ={})
+        self.assertEqual(config.share.SHARE_DEPTH, cfg.share_depth)
+        cfg = config.Config(self.path, environ={'DTB_SHARE_DEPTH': '5'})
+        self.assertEqual(5, cfg.share_depth)
+
+
+if __name__ == '__main__':
+    unittest.main()
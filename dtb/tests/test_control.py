@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.control module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+import os
+import socket
+import tempfile
+import shutil
+import threading
+
+from dtb import control, library
+from dtb.user import User
+
+from dtb.tests import FAKESONG
+
+
+class _Base(unittest.TestCase):  # pylint: disable=R0904
+    """Shared setup for tests with a sharing folder."""
+
+    INFOS = [('PC', 'Me'), ('PC', 'Friend')]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with patch('dtb.user.get_info', Mock(side_effect=self.INFOS)):
+            self.user = User.new(self.root, 'Me')
+            self.friend = User.new(self.root, 'Friend')
+        self.temp = tempfile.mkdtemp()
+        self.song = os.path.join(self.temp, 'Artist - Title.mp3')
+        shutil.copy(FAKESONG, self.song)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.temp)
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the control functions."""
+
+    def test_address(self):
+        """Verify each user has a socket in the temporary folder."""
+        path = control.address(os.path.join('root', 'Me'))
+        self.assertEqual(tempfile.gettempdir(), os.path.dirname(path))
+        self.assertEqual(path, control.address(os.path.join('root', 'Me')))
+        self.assertNotEqual(path, control.address(os.path.join('root', 'X')))
+
+    def test_request_no_daemon(self):
+        """Verify a request fails when no daemon is running."""
+        self.assertRaises(OSError, control.request, 'missing', 'ping')
+
+    @patch('dtb.control.available', Mock(return_value=False))
+    def test_request_unsupported(self):
+        """Verify a request fails when sockets are not supported."""
+        self.assertRaises(OSError, control.request, 'path', 'ping')
+
+
+class TestModel(_Base):  # pylint: disable=R0904
+    """Unit tests for the Model class."""  # pylint: disable=W0212
+
+    def test_incoming(self):
+        """Verify incoming songs are scanned again after changes."""
+        model = control.Model(self.user)
+        self.assertEqual([], model.incoming())
+        self.friend.recommend(self.song)
+        rows = model.incoming()
+        self.assertEqual(1, len(rows))
+        self.assertIsNone(rows[0]['quarantined'])
+        self.assertEqual(rows, model.incoming('artist friend'))
+        self.assertEqual([], model.incoming('other'))
+
+    def test_incoming_cached(self):
+        """Verify unchanged songs are not scanned again."""
+        model = control.Model(self.user)
+        self.friend.recommend(self.song)
+        rows = model.incoming()
+        with patch.object(User, 'incoming', []):
+            self.assertIs(rows, model.incoming())
+            model.invalidate('incoming')
+            self.assertEqual([], model.incoming())
+
+    def test_incoming_quarantined(self):
+        """Verify songs no longer retried are reported."""
+        model = control.Model(self.user)
+        self.friend.recommend(self.song)
+        model.incoming()
+        with patch.object(self.user.library, 'failure',
+                          Mock(return_value=(8, 'error', 0, None))):
+            model.invalidate()
+            self.assertEqual([8, 'error'], model.incoming()[0]['quarantined'])
+
+    @patch('dtb.library.QUARANTINE', 1)
+    def test_incoming_retried(self):
+        """Verify songs retried by another process are no longer reported."""
+        model = control.Model(self.user)
+        self.friend.recommend(self.song)
+        path = list(self.user.incoming)[0].path
+        self.user.library.add_failure(path, 'error')
+        self.assertEqual([1, 'error'], model.incoming()[0]['quarantined'])
+        library.Library(self.user.path_library).clear_failures()
+        self.assertIsNone(model.incoming()[0]['quarantined'])
+
+    def test_outgoing(self):
+        """Verify outgoing songs are scanned again after changes."""
+        model = control.Model(self.user)
+        self.assertEqual([], model.outgoing())
+        self.user.recommend(self.song)
+        rows = model.outgoing()
+        self.assertEqual(1, len(rows))
+        self.assertEqual(rows, model.outgoing('title friend'))
+        with patch.object(User, 'outgoing', []):
+            self.assertIs(rows, model.outgoing())
+        os.remove(rows[0]['path'])
+        self.assertEqual([], model.outgoing())
+
+
+@unittest.skipUnless(control.available(), "no Unix sockets")
+class TestServer(_Base):  # pylint: disable=R0904
+    """Unit tests for the Server class."""  # pylint: disable=W0212
+
+    def setUp(self):
+        super().setUp()
+        self.server = control.Server(self.user)
+        self.assertTrue(self.server.start())
+
+    def tearDown(self):
+        self.server.close()
+        super().tearDown()
+
+    def request(self, command, **arguments):
+        """Send a command to the server."""
+        return control.request(self.user.path, command, **arguments)
+
+    def test_ping(self):
+        """Verify the server answers for its user."""
+        self.assertEqual('Me', self.request('ping'))
+
+    def test_queries(self):
+        """Verify the server answers queries from its model."""
+        self.friend.recommend(self.song)
+        self.assertEqual(1, len(self.request('incoming')))
+        self.assertEqual([], self.request('incoming', query='other'))
+        self.assertEqual([], self.request('outgoing'))
+
+    def test_share(self):
+        """Verify the server can share a song."""
+        self.assertEqual([], self.request('outgoing'))
+        path = self.request('share', path=self.song, users=['Friend'])
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(1, len(self.request('outgoing')))
+
+    def test_share_missing(self):
+        """Verify sharing a missing song is reported."""
+        self.assertRaises(control.Error, self.request, 'share',
+                          path=os.path.join(self.temp, 'missing.mp3'))
+
+    @patch('dtb.user.User.recommend', Mock(side_effect=RuntimeError))
+    def test_share_error(self):
+        """Verify unexpected errors are reported."""
+        self.assertRaises(control.Error, self.request, 'share',
+                          path=self.song)
+
+    def test_lock(self):
+        """Verify commands wait while the daemon uses the library."""
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self.request('incoming')))
+        with self.server.lock:
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+        thread.join(control.TIMEOUT)
+        self.assertEqual([[]], results)
+
+    def test_unknown(self):
+        """Verify unknown commands are reported."""
+        self.assertRaises(control.Error, self.request, 'unknown')
+
+    def test_invalid(self):
+        """Verify invalid requests are reported."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.server.path)
+            client.sendall(b'[]\n')
+            with client.makefile('rb') as infile:
+                self.assertIn(b'invalid request', infile.readline())
+
+    def test_already_running(self):
+        """Verify only one server runs for a user."""
+        self.assertFalse(control.Server(self.user).start())
+
+    def test_stale(self):
+        """Verify a socket left by a stopped server is replaced."""
+        self.server.close()
+        self.assertFalse(os.path.exists(self.server.path))
+        open(self.server.path, 'w').close()  # leave a stale file
+        self.assertTrue(self.server.start())
+        self.assertEqual('Me', self.request('ping'))
+
+    def test_close_twice(self):
+        """Verify a server can be closed more than once."""
+        self.server.close()
+        self.server.close()
+        self.assertRaises(OSError, self.request, 'ping')
+
+    @patch('dtb.control.available', Mock(return_value=False))
+    def test_unsupported(self):
+        """Verify a server does not start without Unix sockets."""
+        self.assertFalse(control.Server(self.friend).start())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.history module."""
+
+import unittest
+
+import os
+import json
+import tempfile
+import shutil
+
+from dtb import history
+
+
+class TestDownloadLog(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the DownloadLog class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'dtb.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def read(self, path=None):
+        """Get the entries in a log."""
+        with open(path or self.path, 'r') as infile:
+            return [json.loads(line) for line in infile]
+
+    def test_write(self):
+        """Verify entries contain the transfer details."""
+        with history.DownloadLog(self.path) as log:
+            log.write('/a/b.mp3', 'Jace', 42, 0.5)
+        entry = self.read()[0]
+        self.assertEqual('b.mp3', entry['filename'])
+        self.assertEqual('Jace', entry['friend'])
+        self.assertEqual(42, entry['bytes'])
+        self.assertEqual(0.5, entry['seconds'])
+        self.assertIn('time', entry)
+
+    def test_buffer(self):
+        """Verify entries are written in batches."""
+        log = history.DownloadLog(self.path, buffer_size=2)
+        log.write('a.mp3', 'Jace')
+        self.assertFalse(os.path.exists(self.path))
+        log.write('b.mp3', 'Jace')
+        self.assertEqual(2, len(self.read()))
+        log.close()
+
+    def test_delay(self):
+        """Verify old entries are written without filling the buffer."""
+        log = history.DownloadLog(self.path, delay=0)
+        log.write('a.mp3', 'Jace')
+        self.assertEqual(1, len(self.read()))
+        log.close()
+
+    def test_rotate(self):
+        """Verify the log is rotated when it gets too large."""
+        log = history.DownloadLog(self.path, buffer_size=1, max_bytes=1,
+                                  backups=2)
+        for name in ('a', 'b', 'c', 'd'):
+            log.write(name, 'Jace')
+        log.close()
+        self.assertEqual('d', self.read()[0]['filename'])
+        self.assertEqual('c', self.read(self.path + '.1')[0]['filename'])
+        self.assertEqual('b', self.read(self.path + '.2')[0]['filename'])
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the history functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'dtb.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_summarize_missing(self):
+        """Verify a missing log has no statistics."""
+        self.assertEqual({}, history.summarize(self.path))
+
+    def test_summarize(self):
+        """Verify statistics are aggregated per friend."""
+        with history.DownloadLog(self.path) as log:
+            log.write('a.mp3', 'Jace', 10, 1)
+            log.write('b.mp3', 'Jace', 20, 2)
+            log.write('c.mp3', 'Jane', 5, 1)
+        totals = history.summarize(self.path)
+        self.assertEqual({'count': 2, 'bytes': 30, 'seconds': 3},
+                         totals['Jace'])
+        self.assertEqual(1, totals['Jane']['count'])
+
+    def test_summarize_incremental(self):
+        """Verify only new entries are read for later summaries."""
+        with history.DownloadLog(self.path) as log:
+            log.write('a.mp3', 'Jace', 10, 1)
+        history.summarize(self.path)
+        with open(self.path, 'r+') as outfile:  # corrupt the summarized entry
+            size = len(outfile.readline())
+            outfile.seek(0)
+            outfile.write('x' * (size - 1))
+        with history.DownloadLog(self.path) as log:
+            log.write('b.mp3', 'Jace', 20, 2)
+        totals = history.summarize(self.path)
+        self.assertEqual(['Jace'], list(totals))
+        self.assertEqual(2, totals['Jace']['count'])
+
+    def test_summarize_rotated(self):
+        """Verify entries are not lost when the log is rotated."""
+        with history.DownloadLog(self.path, buffer_size=1) as log:
+            log.write('a.mp3', 'Jace', 10, 1)
+            history.summarize(self.path)
+            log.write('b.mp3', 'Jace', 20, 2)
+            log.max_bytes = 1
+            log.write('c.mp3', 'Jace', 30, 3)
+        totals = history.summarize(self.path)
+        self.assertEqual(3, totals['Jace']['count'])
+        self.assertEqual(60, totals['Jace']['bytes'])
+
+    def test_summarize_legacy(self):
+        """Verify unstructured entries are counted."""
+        with open(self.path, 'w') as outfile:
+            outfile.write("FakeSong.mp3 from Jace Browning\n")
+        totals = history.summarize(self.path)
+        self.assertEqual(1, totals['Jace Browning']['count'])
+
+    def test_summarize_invalid(self):
+        """Verify blank, non-object, and anonymous entries are handled."""
+        with open(self.path, 'w') as outfile:
+            outfile.write('\n42\n["a"]\n{"filename": "a.mp3"}\n'
+                          '{"friend": null, "bytes": 5}\n')
+        totals = history.summarize(self.path)
+        self.assertEqual(['unknown'], sorted(totals))
+        self.assertEqual(2, totals['unknown']['count'])
+        self.assertEqual(5, totals['unknown']['bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.lease module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+import os
+import json
+import time
+import tempfile
+import shutil
+
+from dtb.lease import Lease, is_lease, clean
+
+
+@patch('dtb.lease.SETTLE', 0)
+class TestLease(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Lease class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'a.yml')
+        open(self.path, 'w').close()  # touch the file
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_acquire_release(self):
+        """Verify a lease can be held by one owner at a time."""
+        lease = Lease(self.path, owner='a')
+        other = Lease(self.path, owner='b')
+        self.assertTrue(lease.acquire())
+        self.assertTrue(lease.acquire())
+        self.assertTrue(os.path.isfile(self.path + '.lease'))
+        self.assertFalse(other.acquire())
+        self.assertEqual('a', other.read()['owner'])
+        lease.release()
+        self.assertFalse(os.path.exists(self.path + '.lease'))
+        self.assertTrue(other.acquire())
+
+    def test_acquire_same_owner(self):
+        """Verify an owner can claim its own lease again after restarting."""
+        self.assertTrue(Lease(self.path, owner='a').acquire())
+        self.assertTrue(Lease(self.path, owner='a').acquire())
+
+    def test_acquire_expired(self):
+        """Verify expired leases can be taken over."""
+        self.assertTrue(Lease(self.path, owner='a', duration=-1).acquire())
+        lease = Lease(self.path, owner='b')
+        self.assertTrue(lease.acquire())
+        self.assertEqual('b', lease.read()['owner'])
+        self.assertEqual(['a.yml', 'a.yml.lease'],
+                         sorted(os.listdir(self.temp)))
+
+    def test_acquire_expired_race(self):
+        """Verify only one owner takes over an expired lease."""
+        self.assertTrue(Lease(self.path, owner='a', duration=-1).acquire())
+        winner = Lease(self.path, owner='b')
+        loser = Lease(self.path, owner='c')
+        original = loser.read
+
+        def read():
+            """Read the expired lease then let another owner take it over."""
+            data = original()
+            if not winner.held:
+                self.assertTrue(winner.acquire())
+            return data
+
+        with patch.object(loser, 'read', read):
+            self.assertFalse(loser.acquire())
+        self.assertEqual('b', winner.read()['owner'])
+        self.assertEqual(['a.yml', 'a.yml.lease'],
+                         sorted(os.listdir(self.temp)))
+
+    def test_acquire_unreadable(self):
+        """Verify unreadable leases expire based on their age."""
+        with open(self.path + '.lease', 'w') as outfile:
+            outfile.write("{")
+        self.assertFalse(Lease(self.path, owner='a').acquire())
+        os.utime(self.path + '.lease', (0, 0))
+        self.assertTrue(Lease(self.path, owner='a').acquire())
+
+    def test_release_taken_over(self):
+        """Verify a lease taken over by another owner is not deleted."""
+        lease = Lease(self.path, owner='a', duration=-1)
+        self.assertTrue(lease.acquire())
+        self.assertTrue(Lease(self.path, owner='b').acquire())
+        lease.release()
+        self.assertTrue(os.path.exists(self.path + '.lease'))
+
+    def test_acquire_settle(self):
+        """Verify new leases are only held after they settle."""
+        lease = Lease(self.path, owner='a', settle=60)
+        self.assertFalse(lease.acquire())
+        self.assertEqual('a', lease.read()['owner'])
+        self.assertFalse(Lease(self.path, owner='b').acquire())
+        with patch('time.time', Mock(return_value=time.time() + 61)):
+            self.assertTrue(lease.acquire())
+
+    def test_acquire_conflict(self):
+        """Verify the first owner keeps leases created on two computers."""
+        copy = os.path.join(self.temp, "a.yml (conflicted copy).lease")
+        with open(copy, 'w') as outfile:
+            json.dump({'owner': 'a', 'expires': time.time() + 60}, outfile)
+        lease = Lease(self.path, owner='b')
+        self.assertFalse(lease.acquire())
+        self.assertFalse(os.path.exists(self.path + '.lease'))
+        self.assertTrue(Lease(self.path, owner='0').acquire())
+
+    def test_context_manager(self):
+        """Verify a lease is released when leaving a block."""
+        with Lease(self.path) as lease:
+            self.assertTrue(lease.acquire())
+        self.assertFalse(os.path.exists(self.path + '.lease'))
+
+    def test_is_lease(self):
+        """Verify lease files can be identified."""
+        self.assertTrue(is_lease('abc.yml.lease'))
+        self.assertTrue(is_lease('abc.yml.lease.1234'))
+        self.assertFalse(is_lease('abc.yml'))
+        self.assertFalse(is_lease('abc.lease.yml'))
+
+    def test_clean(self):
+        """Verify only orphaned leases are deleted."""
+        names = ['a.yml.lease', 'b.yml.lease', 'a.yml.lease.123',
+                 'a.yml (conflicted copy).lease', 'c.yml.lease']
+        for name in names:
+            open(os.path.join(self.temp, name), 'w').close()
+            if name != 'c.yml.lease':
+                os.utime(os.path.join(self.temp, name), (0, 0))
+        self.assertEqual(3, clean(self.temp, os.listdir(self.temp)))
+        self.assertEqual(['a.yml', 'a.yml.lease', 'c.yml.lease'],
+                         sorted(os.listdir(self.temp)))
+
+
+if __name__ == '__main__':
+    unittest.main()
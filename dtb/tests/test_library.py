@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.library module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+import os
+import time
+import tempfile
+import shutil
+
+from dtb import library
+
+from dtb.tests import FAKESONG
+
+
+class TestLibrary(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Library class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.library = library.Library(os.path.join(self.temp, 'lib.sqlite3'),
+                                       root=self.temp)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.temp)
+
+    def test_unchanged(self):
+        """Verify cataloged files with the same stats are unchanged."""
+        self.library.add_song('a.mp3', 1, 2, 'abc', None, 'a')
+        self.assertTrue(self.library.unchanged('a.mp3', 1, 2))
+        self.assertFalse(self.library.unchanged('a.mp3', 1, 3))
+        self.assertFalse(self.library.unchanged('b.mp3', 1, 2))
+
+    def test_unchanged_shared(self):
+        """Verify unshared files are changed when sharing."""
+        self.library.add_song('a.mp3', 1, 2, 'abc', None, 'a')
+        self.assertFalse(self.library.unchanged('a.mp3', 1, 2, shared=True))
+        self.library.add_song('a.mp3', 1, 2, 'abc', None, 'a', shared=True)
+        self.assertTrue(self.library.unchanged('a.mp3', 1, 2, shared=True))
+
+    def test_songs(self):
+        """Verify cataloged files are saved."""
+        self.library.add_song('a.mp3', 1, 2, 'abc', 'Artist', 'Title')
+        self.library.close()
+        songs = list(self.library.songs())
+        self.assertEqual([('a.mp3', 'abc', 'Artist', 'Title')], songs)
+
+    def test_wal(self):
+        """Verify the library uses write-ahead logging."""
+        mode = self.library.connection.execute("PRAGMA journal_mode")
+        self.assertEqual('wal', mode.fetchone()[0])
+
+    def test_drops(self):
+        """Verify drops can be added and removed."""
+        self.library.add_drop('FakeSong.mp3', FAKESONG, 'abc')
+        self.assertEqual({'FakeSong.mp3'}, self.library.drops())
+        self.assertEqual('FakeSong.mp3', self.library.find_drop('abc'))
+        self.library.remove_drop('FakeSong.mp3')
+        self.assertEqual(set(), self.library.drops())
+        self.assertIs(None, self.library.find_drop('abc'))
+
+    def test_search(self):
+        """Verify drops can be found by their words."""
+        song = os.path.join(self.temp, 'Daft Punk - One More Time.mp3')
+        shutil.copy(FAKESONG, song)
+        tokens = self.library.add_drop('a.mp3', song)
+        self.assertEqual({'daft', 'punk', 'one', 'more', 'time'}, tokens)
+        self.assertEqual(['a.mp3'], self.library.search({'one', 'punk'}))
+        self.assertEqual([], self.library.search({'one', 'two'}))
+        self.assertEqual([], self.library.search(set()))
+        self.library.remove_drop('a.mp3')
+        self.assertEqual([], self.library.search({'one'}))
+
+    def test_search_readonly(self):
+        """Verify another user's library is searched without changes."""
+        song = os.path.join(self.temp, 'Daft Punk - One More Time.mp3')
+        shutil.copy(FAKESONG, song)
+        self.library.add_drop('a.mp3', song)
+        self.library.close()
+        before = sorted(os.listdir(os.path.dirname(self.library.path)))
+        friend = library.Library(self.library.path, readonly=True)
+        try:
+            self.assertEqual(['a.mp3'], friend.search({'one', 'punk'}))
+        finally:
+            friend.close()
+        after = sorted(os.listdir(os.path.dirname(self.library.path)))
+        self.assertEqual(before, after)
+
+    def test_search_readonly_journal(self):
+        """Verify changes still in the owner's journal are searched."""
+        song = os.path.join(self.temp, 'Daft Punk - One More Time.mp3')
+        shutil.copy(FAKESONG, song)
+        self.library.add_drop('a.mp3', song)
+        friend = library.Library(self.library.path, readonly=True)
+        try:
+            self.assertEqual(['a.mp3'], friend.search({'one', 'punk'}))
+        finally:
+            friend.close()
+
+    def test_search_readonly_missing(self):
+        """Verify a library without drops cannot be searched."""
+        path = os.path.join(self.temp, 'missing.sqlite3')
+        friend = library.Library(path, readonly=True)
+        self.assertEqual([], friend.search({'one'}))
+        self.assertFalse(os.path.exists(path))
+
+    def test_rename_drop(self):
+        """Verify moved drops keep their checksum and words."""
+        song = os.path.join(self.temp, 'Daft Punk - One More Time.mp3')
+        shutil.copy(FAKESONG, song)
+        self.library.add_drop('a.mp3', song, 'abc')
+        self.library.rename_drop('a.mp3', 'ab/a.mp3')
+        self.assertEqual({'ab/a.mp3'}, self.library.drops())
+        self.assertEqual('ab/a.mp3', self.library.find_drop('abc'))
+        self.assertEqual(['ab/a.mp3'], self.library.search({'daft'}))
+
+    def test_expired(self):
+        """Verify drops beyond retention limits are found oldest first."""
+        path = os.path.join(self.temp, 'a.mp3')
+        with open(path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        for name in ('a.mp3', 'b.mp3', 'c.mp3'):
+            self.library.add_drop(name, path)
+        size = 42
+        self.assertEqual([], self.library.expired())
+        self.assertEqual([('a.mp3', size), ('b.mp3', size)],
+                         self.library.expired(count=1))
+        self.assertEqual([('a.mp3', size)],
+                         self.library.expired(size=size * 2 + 1))
+        self.assertEqual([], self.library.expired(age=60))
+        with patch('time.time', Mock(return_value=time.time() + 120)):
+            self.assertEqual(3, len(self.library.expired(age=60)))
+
+    def test_add_match(self):
+        """Verify requests are only matched once per friend."""
+        self.assertTrue(self.library.add_match('abc', 'a', 'a.mp3'))
+        self.assertFalse(self.library.add_match('abc', 'a', 'b.mp3'))
+        self.assertTrue(self.library.add_match('abc', 'b', 'a.mp3'))
+
+    def test_links(self):
+        """Verify links are stored relative to the root."""
+        path = os.path.join(self.temp, 'a', 'b', 'c.yml')
+        self.library.add_link(path, 'a', 'c.mp3', incoming=True)
+        self.library.add_link(os.path.join(self.temp, 'x.yml'), 'x', 'x.mp3')
+        links = self.library.links(incoming=True)
+        self.assertEqual(('a/b/c.yml', 'a', 'c.mp3', 1), links[0][:4])
+        self.assertEqual(1, len(self.library.links(friend='x')))
+        self.assertEqual({'c.yml'}, self.library.link_names(
+            os.path.join(self.temp, 'a', 'b')))
+        self.assertEqual(set(), self.library.link_names(
+            os.path.join(self.temp, 'a')))
+
+    def test_remove_link(self):
+        """Verify removed links are kept in the history."""
+        path = os.path.join(self.temp, 'a.yml')
+        self.library.add_link(path, 'a', 'a.mp3')
+        self.library.remove_link(path)
+        self.assertEqual([], self.library.links())
+        self.assertIsNotNone(self.library.links(current=False)[0][-1])
+
+    def test_downloads(self):
+        """Verify downloads are listed with the newest first."""
+        self.library.add_download(FAKESONG, 'a')
+        self.library.add_download(FAKESONG, 'b', 'abc')
+        downloads = self.library.downloads()
+        self.assertEqual(['b', 'a'], [row[1] for row in downloads])
+        self.assertEqual(1, len(self.library.downloads(friend='a')))
+        self.assertEqual(1, len(self.library.downloads(limit=1)))
+
+    def test_find_download(self):
+        """Verify downloads can be found by checksum."""
+        self.assertIs(None, self.library.find_download('abc'))
+        self.library.add_download(FAKESONG, 'a', 'abc')
+        self.assertEqual(FAKESONG, self.library.find_download('abc'))
+
+    def test_changed(self):
+        """Verify folders are changed until they are reconciled."""
+        path = os.path.join(self.temp, 'a')
+        os.mkdir(path)
+        os.utime(path, (0, 0))
+        mtime = self.library.changed(path)
+        self.assertIsNotNone(mtime)
+        self.library.reconciled(path, mtime)
+        self.assertIs(None, self.library.changed(path))
+        missing = os.path.join(self.temp, 'missing')
+        self.assertEqual(0, self.library.changed(missing))
+
+    def test_changed_recent(self):
+        """Verify recently changed folders are not remembered."""
+        path = os.path.join(self.temp, 'a')
+        os.mkdir(path)
+        self.library.reconciled(path, self.library.changed(path))
+        self.assertIsNotNone(self.library.changed(path))
+
+    def test_failures(self):
+        """Verify failed downloads are retried with increasing delays."""
+        path = os.path.join(self.temp, 'a.yml')
+        open(path, 'w').close()  # touch the file
+        self.assertTrue(self.library.can_retry(path))
+        self.assertIs(None, self.library.next_retry())
+        self.assertEqual(1, self.library.add_failure(path, "error 1"))
+        self.assertFalse(self.library.can_retry(path))
+        first = self.library.next_retry()
+        self.assertEqual(2, self.library.add_failure(path, "error 2"))
+        self.assertLess(first, self.library.next_retry())
+        attempts, error, _, _ = self.library.failure(path)
+        self.assertEqual((2, "error 2"), (attempts, error))
+        self.library.remove_failure(path)
+        self.assertTrue(self.library.can_retry(path))
+
+    @patch('dtb.library.QUARANTINE', 2)
+    @patch('dtb.library.RETRY_DELAY', 0)
+    def test_failures_quarantine(self):
+        """Verify downloads that keep failing are no longer retried."""
+        path = os.path.join(self.temp, 'a.yml')
+        self.library.add_failure(path, "error")
+        self.assertTrue(self.library.can_retry(path))
+        self.library.add_failure(path, "error")
+        self.assertFalse(self.library.can_retry(path))
+        self.assertIs(None, self.library.failure(path)[3])
+        summary = self.library.failures()
+        self.assertEqual((1, 2), summary[:2])
+        self.assertEqual(1, self.library.clear_failures())
+        self.assertTrue(self.library.can_retry(path))
+        self.assertNotEqual(summary, self.library.failures())
+
+    def test_failures_prune(self):
+        """Verify failures of removed songs are forgotten."""
+        path = os.path.join(self.temp, 'a.yml')
+        open(path, 'w').close()  # touch the file
+        self.library.add_failure(path, "error")
+        self.library.add_failure(os.path.join(self.temp, 'b.yml'), "error")
+        self.library.prune_failures()
+        self.assertIsNotNone(self.library.failure(path))
+        self.assertEqual(1, self.library.clear_failures())
+
+    def test_state(self):
+        """Verify values can be saved between runs."""
+        self.assertIs(None, self.library.get_state('a'))
+        self.library.set_state('a', {'b': [1, 2]})
+        self.assertEqual({'b': [1, 2]}, self.library.get_state('a'))
+        self.library.set_state('a', None)
+        self.assertIs(None, self.library.get_state('a'))
+
+    def test_write_error(self):
+        """Verify errors while saving changes are logged."""
+        self.library.connection.execute("DROP TABLE links")
+        self.library.add_link('a.yml', 'a', 'a.mp3')
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the library functions."""  # pylint: disable=C0103
+
+    def test_index(self):
+        """Verify a file can be indexed."""
+        path, size, _, checksum, artist, title = library.index(FAKESONG)
+        self.assertEqual(FAKESONG, path)
+        self.assertEqual(os.path.getsize(FAKESONG), size)
+        self.assertEqual(40, len(checksum))
+        self.assertEqual((None, 'FakeSong'), (artist, title))
+
+
+if __name__ == '__main__':
+    unittest.main()
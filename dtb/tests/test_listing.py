@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.listing module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+from dtb.listing import Listing
+
+
+class FakeSong(object):  # pylint: disable=R0903
+    """Song with only a path."""
+
+    def __init__(self, path):
+        self.path = path
+
+
+class TestListing(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Listing class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.label = Mock(side_effect=lambda song: song.path.upper())
+        self.listing = Listing(self.label)
+        self.songs = [FakeSong(str(index)) for index in range(100)]
+        self.listing.set([(song, None) for song in self.songs])
+
+    def test_len(self):
+        """Verify rows map to songs in order."""
+        self.assertEqual(100, len(self.listing))
+        self.assertIs(self.songs[42], self.listing[42])
+
+    def test_text_lazy(self):
+        """Verify texts are only formatted for displayed rows."""
+        self.assertEqual(0, self.label.call_count)
+        texts = [self.listing.text(i) for i in self.listing.visible(10)]
+        self.assertEqual([str(i) for i in range(10)], texts)
+        self.assertEqual(10, self.label.call_count)
+
+    def test_text_cached(self):
+        """Verify texts are not formatted again after a refresh."""
+        self.listing.text(5)
+        self.assertEqual('5', self.listing.cached(self.songs[5]))
+        self.assertIs(None, self.listing.cached(self.songs[6]))
+        self.listing.set([(song, None) for song in self.songs[5:]])
+        self.assertEqual('5', self.listing.text(0))
+        self.assertEqual(1, self.label.call_count)
+
+    def test_text_provided(self):
+        """Verify provided texts are displayed without formatting."""
+        self.listing.set([(self.songs[0], "a.mp3 (from Jane)")])
+        self.assertEqual("a.mp3 (from Jane)", self.listing.text(0))
+        self.assertEqual(0, self.label.call_count)
+
+    @patch('dtb.listing.CACHE_SIZE', 5)
+    def test_text_cache_limit(self):
+        """Verify the cache of texts is limited."""
+        for index in range(10):
+            self.listing.text(index)
+        self.listing.set([(song, None) for song in self.songs])
+        self.assertIs(None, self.listing.cached(self.songs[0]))
+
+    def test_scroll(self):
+        """Verify scrolling is limited to the rows available."""
+        self.assertEqual(range(50, 60), self.listing.scroll(50, 10))
+        self.assertEqual((0.5, 0.6), self.listing.fractions(10))
+        self.assertEqual(range(90, 100), self.listing.scroll(95, 10))
+        self.assertEqual(range(0, 10), self.listing.scroll(-5, 10))
+        self.listing.set([(song, None) for song in self.songs[:3]])
+        self.assertEqual(range(0, 3), self.listing.scroll(0, 10))
+        self.assertEqual((0.0, 1.0), self.listing.fractions(10))
+
+    def test_fractions_empty(self):
+        """Verify an empty list fills the scrollbar."""
+        self.listing.set([])
+        self.assertEqual((0.0, 1.0), self.listing.fractions(10))
+        self.assertEqual(range(0, 0), self.listing.scroll(0, 10))
+
+    def test_selection(self):
+        """Verify selections are kept across refreshes."""
+        self.assertEqual([], self.listing.selection)
+        self.listing.select(3)
+        self.listing.select(7)
+        self.listing.select(7, False)
+        self.listing.select(9)
+        self.assertTrue(self.listing.is_selected(3))
+        self.assertFalse(self.listing.is_selected(7))
+        self.listing.set([(song, None) for song in self.songs[3:]])
+        self.assertTrue(self.listing.is_selected(0))
+        self.assertEqual([self.songs[3], self.songs[9]],
+                         self.listing.selection)
+        self.listing.clear()
+        self.assertEqual([], self.listing.selection)
+
+
+if __name__ == '__main__':
+    unittest.main()
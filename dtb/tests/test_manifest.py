@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.manifest module."""
+
+import unittest
+from unittest.mock import patch
+
+import os
+import json
+import tempfile
+import shutil
+
+from dtb import manifest
+
+
+class TestManifest(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for segments of links."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.writer = patch('dtb.manifest.WRITER', 'Computer-1234')
+        self.writer.start()
+        self.segment = manifest.segment(self.temp)
+
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.temp)
+
+    def write(self, name, *records):
+        """Append records to another computer's segment."""
+        with open(os.path.join(self.temp, name), 'a') as outfile:
+            for record in records:
+                outfile.write(json.dumps(record) + '\n')
+
+    def test_add_remove(self):
+        """Verify links can be added and removed."""
+        path = manifest.add(self.temp, {'link': '../a.mp3'})
+        self.assertTrue(manifest.is_entry(path))
+        self.assertEqual('../a.mp3', manifest.lookup(path)['link'])
+        manifest.remove(path)
+        self.assertFalse(manifest.exists(path))
+        self.assertRaises(FileNotFoundError, manifest.remove, path)
+        self.assertEqual([], manifest.names(self.temp,
+                                            os.listdir(self.temp)))
+
+    def test_names(self):
+        """Verify segments are listed as the links they hold."""
+        path = manifest.add(self.temp, {'link': '../a.mp3'})
+        names = ['a.yml', os.path.basename(self.segment)]
+        self.assertEqual(['a.yml', os.path.basename(path)],
+                         manifest.names(self.temp, names))
+        self.assertEqual(['a.yml'], manifest.names(self.temp, ['a.yml']))
+
+    def test_other_computers(self):
+        """Verify segments from other computers and conflicts are read."""
+        self.write('other.manifest', {'id': 'a', 'link': '../a.mp3'},
+                   {'id': 'b', 'link': '../b.mp3'})
+        self.write('other (conflicted copy).manifest',
+                   {'id': 'c', 'link': '../c.mp3'})
+        manifest.remove(os.path.join(self.temp, 'b' + manifest.LINK))
+        self.assertEqual(['a', 'c'], sorted(manifest.load(self.temp)))
+
+    def test_incomplete(self):
+        """Verify records interrupted while syncing are skipped."""
+        self.write('other.manifest', {'id': 'a', 'link': '../a.mp3'})
+        with open(self.segment, 'w') as outfile:
+            outfile.write('{"id": "b", "li')
+        names = os.listdir(self.temp)
+        self.assertEqual(['a'], list(manifest.load(self.temp, names)))
+        manifest.add(self.temp, {'link': '../c.mp3'})
+        self.assertEqual(2, len(manifest.load(self.temp)))
+
+    def test_changed(self):
+        """Verify segments are parsed again when they change."""
+        names = ['other.manifest']
+        self.write(names[0], {'id': 'a', 'link': '../a.mp3'})
+        self.assertEqual(['a'], list(manifest.load(self.temp, names)))
+        self.write(names[0], {'id': 'b', 'link': '../b.mp3'})
+        self.assertEqual(['a', 'b'], sorted(manifest.load(self.temp, names)))
+
+    def test_compact(self):
+        """Verify records no longer needed are dropped."""
+        kept = manifest.add(self.temp, {'link': '../a.mp3'})
+        removed = manifest.add(self.temp, {'link': '../b.mp3'})
+        manifest.remove(removed)
+        self.write('other.manifest', {'id': 'c', 'link': '../c.mp3'})
+        manifest.remove(os.path.join(self.temp, 'c' + manifest.LINK))
+        self.assertEqual(2, manifest.compact(self.temp))
+        self.assertEqual(0, manifest.compact(self.temp))
+        self.assertEqual([os.path.basename(kept)],
+                         manifest.names(self.temp, os.listdir(self.temp)))
+        with open(self.segment, 'r') as infile:
+            self.assertEqual(2, len(infile.readlines()))
+
+    def test_compact_missing(self):
+        """Verify folders without this computer's segment are skipped."""
+        self.write('other.manifest', {'id': 'a', 'link': '../a.mp3'},
+                   {'id': 'a', 'removed': True})
+        self.assertEqual(0, manifest.compact(self.temp))
+
+    def test_compact_changed(self):
+        """Verify links added while compacting are not lost."""
+        path = manifest.add(self.temp, {'link': '../a.mp3'})
+        manifest.remove(path)
+        size = os.path.getsize(self.segment)
+        with patch('os.path.getsize', side_effect=[size, size + 1]):
+            self.assertEqual(0, manifest.compact(self.temp))
+        self.assertEqual([manifest.writer() + manifest.SUFFIX],
+                         os.listdir(self.temp))
+
+
+class TestWriter(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the name of this installation's segments."""
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    @patch('dtb.manifest.WRITER', None)
+    def test_writer(self):
+        """Verify each installation keeps the ID it created."""
+        local = os.path.join(self.temp, '.dtb')
+        with patch('dtb.common.LOCAL', local):
+            self.assertIs(None, manifest.writer(create=False))
+            self.assertFalse(os.path.exists(local))
+            name = manifest.writer()
+            self.assertEqual(name, manifest.writer())
+            with patch('dtb.manifest.WRITER', None):
+                self.assertEqual(name, manifest.writer(create=False))
+            with patch('dtb.manifest.WRITER', None), \
+                    patch('dtb.common.LOCAL', self.temp):
+                self.assertNotEqual(name, manifest.writer())
+
+
+if __name__ == '__main__':
+    unittest.main()
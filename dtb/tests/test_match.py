@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.match module."""
+
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from dtb import match
+
+
+class TestIndex(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Index class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.index = match.Index()
+        self.index.add('a', {'daft', 'punk', 'one', 'more', 'time'})
+        self.index.add('b', {'one', 'time'})
+
+    def test_search(self):
+        """Verify items containing all words can be found."""
+        self.assertEqual({'a', 'b'}, self.index.search({'one', 'time'}))
+        self.assertEqual({'a'}, self.index.search({'daft', 'time'}))
+        self.assertEqual(set(), self.index.search({'daft', 'other'}))
+        self.assertEqual(set(), self.index.search(set()))
+
+    def test_match(self):
+        """Verify items with all their words in a song can be found."""
+        self.assertEqual({'b'}, self.index.match({'one', 'time', 'again'}))
+        self.assertEqual({'a', 'b'}, self.index.match(
+            {'daft', 'punk', 'one', 'more', 'time'}))
+
+    def test_remove(self):
+        """Verify items can be removed."""
+        self.index.remove('a')
+        self.index.remove('c')
+        self.assertEqual(1, len(self.index))
+        self.assertNotIn('a', self.index)
+        self.assertEqual(set(), self.index.search({'daft'}))
+
+
+class TestRequests(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Requests class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'requests.yml')
+        self.requests = match.Requests(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_add(self):
+        """Verify requests are saved."""
+        request = self.requests.add("One More Time", "Daft Punk")
+        self.assertEqual('open', request['status'])
+        requests = list(match.Requests(self.path))
+        self.assertEqual([request], requests)
+
+    def test_match(self):
+        """Verify open requests can be matched to a song's words."""
+        request = self.requests.add("One More Time")
+        tokens = match.tokenize("Daft Punk", "One More Time (Remix)")
+        self.assertEqual([request], self.requests.match(tokens))
+        self.requests.close(request['id'], 'Jace', 'a.mp3')
+        self.assertEqual([], self.requests.match(tokens))
+        self.assertEqual('matched', list(self.requests)[0]['status'])
+
+    def test_close_unknown(self):
+        """Verify unknown requests cannot be closed."""
+        self.assertRaises(ValueError, self.requests.close, 'x', 'a', 'b')
+
+    def test_load_changed(self):
+        """Verify requests are read again after the file changes."""
+        self.requests.add("One")
+        other = match.Requests(self.path)
+        other.add("Two")
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(2, len(list(self.requests)))
+        self.assertEqual(2, len(self.requests.index))
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the matching functions."""  # pylint: disable=C0103
+
+    def test_tokenize(self):
+        """Verify text is normalized into words."""
+        self.assertEqual({'beyonce', 'halo', 'remix'},
+                         match.tokenize("Beyoncé", "Halo (The Remix)"))
+
+    def test_tokenize_none(self):
+        """Verify missing text has no words."""
+        self.assertEqual(set(), match.tokenize(None, ''))
+
+    def test_load_cached(self):
+        """Verify requests files are only loaded once."""
+        self.assertIs(match.load('missing.yml'), match.load('missing.yml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
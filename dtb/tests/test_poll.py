@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.poll module."""
+
+import unittest
+from unittest.mock import patch
+
+import os
+import tempfile
+import shutil
+
+from dtb import poll
+
+
+class TestPoller(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Poller class."""  # pylint: disable=C0103,W0212
+
+    def setUp(self):
+        self.poller = poll.Poller(1, 8, factor=2, jitter=0)
+
+    def test_invalid_delays(self):
+        """Verify the delays are checked."""
+        self.assertRaises(ValueError, poll.Poller, 0, 1)
+        self.assertRaises(ValueError, poll.Poller, 2, 1)
+
+    def test_backoff(self):
+        """Verify the delay increases while idle up to the maximum."""
+        delays = [self.poller.update(False) for _ in range(5)]
+        self.assertEqual([2, 4, 8, 8, 8], delays)
+
+    def test_reset(self):
+        """Verify the delay is reset after activity."""
+        self.poller.update(False)
+        self.poller.update(False)
+        self.assertEqual(1, self.poller.update(True))
+
+    @patch('random.uniform', lambda a, b: b)
+    def test_jitter(self):
+        """Verify the delay is randomized."""
+        poller = poll.Poller(10, 10, jitter=0.5)
+        self.assertEqual(15, poller.update(True))
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the polling functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.temp, 'a'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_fingerprint_unchanged(self):
+        """Verify a fingerprint is stable without changes."""
+        self.assertEqual(poll.fingerprint(self.temp),
+                         poll.fingerprint(self.temp))
+
+    def test_fingerprint_subdirectory(self):
+        """Verify a fingerprint changes when a subdirectory changes."""
+        before = poll.fingerprint(self.temp)
+        path = os.path.join(self.temp, 'a', 'b')
+        open(path, 'w').close()  # touch the file
+        os.utime(os.path.join(self.temp, 'a'), ns=(0, 0))
+        self.assertNotEqual(before, poll.fingerprint(self.temp))
+
+    def test_fingerprint_files(self):
+        """Verify a fingerprint changes when a listed file changes."""
+        path = os.path.join(self.temp, 'a.manifest')
+        open(path, 'w').close()  # touch the file
+        before = poll.fingerprint(self.temp, files=[path])
+        with open(path, 'a') as outfile:
+            outfile.write('{}\n')
+        self.assertNotEqual(before, poll.fingerprint(self.temp, files=[path]))
+        self.assertEqual(poll.fingerprint(self.temp),
+                         poll.fingerprint(self.temp, files=['missing']))
+
+    def test_fingerprint_ignore(self):
+        """Verify ignored subdirectories are excluded from a fingerprint."""
+        before = poll.fingerprint(self.temp, ignore=('a',))
+        os.utime(os.path.join(self.temp, 'a'), ns=(0, 0))
+        self.assertEqual(before, poll.fingerprint(self.temp, ignore=('a',)))
+
+
+if __name__ == '__main__':
+    unittest.main()
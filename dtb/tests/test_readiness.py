@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.readiness module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+import os
+import time
+import tempfile
+import shutil
+
+from dtb import readiness
+
+
+class TestReadiness(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Readiness class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, 'a.mp3')
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        self.readiness = readiness.Readiness()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def later(self, seconds):
+        """Patch the current time to be later."""
+        return patch('time.time', Mock(return_value=time.time() + seconds))
+
+    def test_ready_old(self):
+        """Verify files that changed long ago are ready."""
+        with self.later(readiness.SETTLE):
+            self.assertTrue(self.readiness.ready(self.path))
+        self.assertEqual(0, len(self.readiness))
+
+    def test_ready_new(self):
+        """Verify new files are not ready."""
+        self.assertFalse(self.readiness.ready(self.path))
+        self.assertEqual(1, len(self.readiness))
+
+    def test_ready_skewed(self):
+        """Verify files from the future are ready after they stop changing."""
+        future = time.time() + 3600
+        os.utime(self.path, (future, future))
+        self.assertFalse(self.readiness.ready(self.path))
+        self.assertFalse(self.readiness.ready(self.path))
+        with self.later(readiness.SETTLE):
+            self.assertTrue(self.readiness.ready(self.path))
+        self.assertEqual(0, len(self.readiness))
+
+    def test_ready_changing(self):
+        """Verify files that keep changing are not ready."""
+        self.assertFalse(self.readiness.ready(self.path))
+        with open(self.path, 'ab') as outfile:
+            outfile.write(b'\xff')
+        self.assertFalse(self.readiness.ready(self.path))
+
+    @patch('dtb.readiness.SETTLE', 0)
+    def test_ready_missing(self):
+        """Verify missing files are not ready."""
+        path = os.path.join(self.temp, 'missing.mp3')
+        self.assertFalse(self.readiness.ready(path))
+
+    @patch('dtb.readiness.SETTLE', 0)
+    def test_ready_temporary(self):
+        """Verify temporary files are never ready."""
+        path = os.path.join(self.temp, 'a.mp3.part')
+        open(path, 'w').close()  # touch the file
+        self.assertFalse(self.readiness.ready(path))
+
+    def test_is_temporary(self):
+        """Verify temporary files from sync clients are recognized."""
+        for name in ('.dropbox.cache', '.~a.mp3', '~$a.doc', 'a.mp3.TMP',
+                     'a.mp3.crdownload'):
+            self.assertTrue(readiness.is_temporary(name), name)
+        for name in ('a.mp3', 'abc123.yml', 'a.dropbox.mp3'):
+            self.assertFalse(readiness.is_temporary(name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.schedule module."""
+
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from dtb import schedule
+from dtb.song import Song
+
+
+class TestScheduler(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Scheduler class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def song(self, name, friendname, size, mtime):
+        """Create a song file with a size and modification time."""
+        path = os.path.join(self.temp, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(b'\x00' * size)
+        os.utime(path, (mtime, mtime))
+        return Song(path, friendname=friendname)
+
+    def songs(self):
+        """Create songs from two friends with a large song first."""
+        return [self.song('big', 'a', 100, 1),
+                self.song('a1', 'a', 2, 2),
+                self.song('a2', 'a', 3, 3),
+                self.song('b1', 'b', 4, 4)]
+
+    @staticmethod
+    def names(queue):
+        """Get the filenames of the songs in download order."""
+        return [os.path.basename(song.path) for song in queue]
+
+    def test_fifo(self):
+        """Verify the oldest links are downloaded first."""
+        queue = schedule.Scheduler(schedule.FIFO)
+        self.assertEqual(4, queue.extend(reversed(self.songs())))
+        self.assertEqual(4, len(queue))
+        self.assertEqual(['big', 'a1', 'a2', 'b1'], self.names(queue))
+        self.assertEqual(0, len(queue))
+
+    def test_small(self):
+        """Verify the smallest songs are downloaded first."""
+        queue = schedule.Scheduler(schedule.SMALL)
+        queue.extend(self.songs())
+        queue.push(Song(os.path.join(self.temp, 'missing'), friendname='b'))
+        self.assertEqual(['missing', 'a1', 'a2', 'b1', 'big'],
+                         self.names(queue))
+
+    def test_fair(self):
+        """Verify downloads alternate between friends."""
+        queue = schedule.Scheduler(schedule.FAIR)
+        queue.extend(self.songs())
+        self.assertEqual(['big', 'b1', 'a1', 'a2'], self.names(queue))
+
+    def test_fair_refill(self):
+        """Verify friends added while downloading are not kept waiting."""
+        queue = schedule.Scheduler(schedule.FAIR)
+        queue.extend(self.songs()[:3])
+        self.assertEqual('big', os.path.basename(queue.pop().path))
+        queue.push(self.song('b2', 'b', 1, 5))
+        self.assertEqual(['b2', 'a1', 'a2'], self.names(queue))
+
+    def test_invalid(self):
+        """Verify unknown policies are rejected."""
+        self.assertRaises(ValueError, schedule.Scheduler, 'random')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.search module."""
+
+import unittest
+
+from dtb.search import Index
+
+
+class FakeSong(object):  # pylint: disable=R0903
+    """Song with a path, source, and friend name."""
+
+    def __init__(self, name, friendname):
+        self.path = name + '.yml'
+        self.source = '/songs/' + name
+        self.friendname = friendname
+
+
+class TestIndex(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Index class."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.songs = [FakeSong("Artist - Song.mp3", "Jane Doe"),
+                      FakeSong("Artist - Other Song.mp3", "John Doe"),
+                      FakeSong("Band_Live.mp3", "Jane Doe")]
+        self.index = Index()
+        self.assertEqual((3, 0), self.index.update(self.songs))
+
+    def search(self, query):
+        """Get the names of songs matching a query."""
+        return sorted(path[:-4] for path in self.index.search(query))
+
+    def test_search_words(self):
+        """Verify every word must match a filename or friend name."""
+        self.assertEqual(["Artist - Song.mp3"], self.search("song jane"))
+        self.assertEqual(["Artist - Other Song.mp3"], self.search("JOHN"))
+        self.assertEqual(["Band_Live.mp3"], self.search("live"))
+        self.assertEqual([], self.search("song band"))
+
+    def test_search_prefix(self):
+        """Verify words match the beginning of indexed words."""
+        self.assertEqual(["Artist - Other Song.mp3", "Artist - Song.mp3"],
+                         self.search("art so"))
+        self.assertEqual([], self.search("rtist"))
+        self.assertEqual([], self.search("zzz"))
+
+    def test_search_empty(self):
+        """Verify an empty query matches nothing in particular."""
+        self.assertIs(None, self.index.search(" - "))
+
+    def test_update(self):
+        """Verify the index follows the scanned songs."""
+        song = FakeSong("New.mp3", "Jane Doe")
+        self.assertEqual((1, 2), self.index.update(self.songs[:1] + [song]))
+        self.assertEqual(2, len(self.index))
+        self.assertIn(song.path, self.index)
+        self.assertNotIn(self.songs[1].path, self.index)
+        self.assertEqual([], self.search("john"))
+        self.assertEqual([], self.search("live"))
+        self.assertEqual(["New.mp3"], self.search("new"))
+        self.assertEqual((0, 0), self.index.update(self.songs[:1] + [song]))
+
+    def test_update_unread(self):
+        """Verify songs are only read when the index is searched."""
+        song = FakeSong("New.mp3", "Jane Doe")
+        song.source = None  # fails if read
+        self.assertEqual((1, 0), self.index.update(self.songs + [song]))
+        self.assertIn(song.path, self.index)
+        self.assertEqual((0, 1), self.index.update(self.songs))
+        self.assertEqual(["Band_Live.mp3"], self.search("live"))
+
+    def test_filter(self):
+        """Verify filtering keeps the original order."""
+        rows = [(song, None) for song in reversed(self.songs)]
+        self.assertEqual([rows[0], rows[2]],
+                         self.index.filter(rows, "jane",
+                                           key=lambda row: row[0]))
+        self.assertEqual(self.songs, self.index.filter(self.songs, ""))
+
+
+if __name__ == '__main__':
+    unittest.main()
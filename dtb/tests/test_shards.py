@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.shards module."""
+
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from dtb import shards
+
+
+class TestShards(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for drops in subfolders."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.drops = os.path.join(self.temp, shards.FOLDER)
+        os.mkdir(self.drops)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def touch(self, *parts):
+        """Create an empty file in the drops folder."""
+        path = os.path.join(self.drops, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        return path
+
+    def test_is_shard(self):
+        """Verify only hash prefixes are subfolders of drops."""
+        self.assertTrue(shards.is_shard(shards.shard('a.mp3')))
+        self.assertFalse(shards.is_shard('a.mp3'))
+        self.assertFalse(shards.is_shard('zz'))
+
+    def test_folder(self):
+        """Verify new drops are placed by the layout."""
+        self.assertEqual(self.drops, shards.folder(self.drops, 'a.mp3'))
+        path = shards.folder(self.drops, 'a.mp3', shards.SHARDED)
+        self.assertEqual(os.path.join(self.drops, shards.shard('a.mp3')),
+                         path)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_relative(self):
+        """Verify drops are named relative to the drops folder."""
+        path = os.path.join(self.drops, 'ab', 'a.mp3')
+        self.assertEqual('ab/a.mp3', shards.relative(self.drops, path))
+        self.assertIs(None, shards.relative(self.drops, self.temp))
+
+    def test_names(self):
+        """Verify drops are listed from both layouts."""
+        self.touch('a.mp3')
+        self.touch(shards.shard('b.mp3'), 'b.mp3')
+        self.assertEqual(['a.mp3', shards.shard('b.mp3') + '/b.mp3'],
+                         sorted(shards.names(self.drops)))
+        self.assertEqual([os.path.join(self.drops, shards.shard('b.mp3'))],
+                         shards.folders(self.drops))
+
+    def test_locate(self):
+        """Verify links to moved drops are resolved."""
+        flat = os.path.join(self.drops, 'a.mp3')
+        sharded = os.path.join(self.drops, shards.shard('a.mp3'), 'a.mp3')
+        self.assertEqual(flat, shards.locate(flat))
+        self.touch(shards.shard('a.mp3'), 'a.mp3')
+        self.assertEqual(sharded, shards.locate(flat))
+        os.rename(sharded, flat)
+        self.assertEqual(flat, shards.locate(sharded))
+        other = os.path.join(self.temp, 'b.mp3')
+        self.assertEqual(other, shards.locate(other))
+
+    def test_alternate(self):
+        """Verify drops have a path in the other layout."""
+        flat = os.path.join(self.drops, 'a.mp3')
+        sharded = os.path.join(self.drops, shards.shard('a.mp3'), 'a.mp3')
+        self.assertEqual(sharded, shards.alternate(flat))
+        self.assertEqual(flat, shards.alternate(sharded))
+        self.assertIs(None, shards.alternate(os.path.join(self.temp, 'a')))
+
+    def test_prune(self):
+        """Verify only empty subfolders of drops are removed."""
+        self.touch(shards.shard('a.mp3'), 'a.mp3')
+        os.mkdir(os.path.join(self.drops, shards.shard('b.mp3')))
+        os.mkdir(os.path.join(self.drops, 'other'))
+        self.assertEqual(1, shards.prune(self.drops))
+        self.assertEqual(sorted([shards.shard('a.mp3'), 'other']),
+                         sorted(os.listdir(self.drops)))
+
+    def test_migrate(self):
+        """Verify drops can be moved between layouts."""
+        self.touch('a.mp3')
+        self.touch('b.mp3')
+        moved = shards.migrate(self.drops, shards.SHARDED)
+        new = shards.shard('a.mp3') + '/a.mp3'
+        self.assertIn(('a.mp3', new), moved)
+        self.assertEqual(2, len(moved))
+        self.assertEqual([], shards.migrate(self.drops, shards.SHARDED))
+        self.assertIn(new, shards.names(self.drops))
+        moved = shards.migrate(self.drops, shards.FLAT)
+        self.assertIn((new, 'a.mp3'), moved)
+        self.assertEqual(['a.mp3', 'b.mp3'], sorted(os.listdir(self.drops)))
+
+    def test_migrate_exists(self):
+        """Verify drops are not moved over existing files."""
+        self.touch('a.mp3')
+        self.touch(shards.shard('a.mp3'), 'a.mp3')
+        self.assertEqual([], shards.migrate(self.drops, shards.SHARDED))
+        self.assertEqual(2, len(shards.names(self.drops)))
+
+
+if __name__ == '__main__':
+    unittest.main()
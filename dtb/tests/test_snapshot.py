@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.snapshot module."""
+
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from dtb import snapshot
+from dtb.song import Song
+
+
+class TestSnapshot(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for snapshot functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'snapshot.json')
+        self.incoming = [(Song(os.path.join(self.root, 'Me', 'Jane', 'a.yml'),
+                               friendname='Jane'), "a.mp3 (from Jane)")]
+        self.outgoing = [(Song(os.path.join(self.root, 'Jane', 'Me', 'b.yml'),
+                               friendname='Jane'), "b.mp3 (to Jane)")]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_load_missing(self):
+        """Verify an empty snapshot is loaded when there is no file."""
+        self.assertEqual((None, [], []), snapshot.load(self.path, self.root))
+
+    def test_load_invalid(self):
+        """Verify invalid snapshots are ignored."""
+        for text in ("{", "[]", '{"version": 1}', '{"version": 2}'):
+            with open(self.path, 'w') as outfile:
+                outfile.write(text)
+            self.assertEqual((None, [], []),
+                             snapshot.load(self.path, self.root))
+
+    def test_save_load(self):
+        """Verify songs can be restored from a snapshot."""
+        self.assertTrue(snapshot.save(self.path, self.root,
+                                      self.incoming, self.outgoing))
+        other = tempfile.mkdtemp()  # the same share on another computer
+        try:
+            when, incoming, outgoing = snapshot.load(self.path, other,
+                                                     downloads='Downloads')
+        finally:
+            shutil.rmtree(other)
+        self.assertTrue(when)
+        song, text = incoming[0]
+        self.assertEqual(os.path.join(other, 'Me', 'Jane', 'a.yml'),
+                         song.path)
+        self.assertEqual('Jane', song.friendname)
+        self.assertEqual('Downloads', song.downloads)
+        self.assertEqual("a.mp3 (from Jane)", text)
+        song, text = outgoing[0]
+        self.assertEqual(os.path.join(other, 'Jane', 'Me', 'b.yml'),
+                         song.path)
+        self.assertIs(None, song.downloads)
+        self.assertEqual("b.mp3 (to Jane)", text)
+
+    def test_save_unchanged(self):
+        """Verify the file is only written when the songs change."""
+        snapshot.save(self.path, self.root, self.incoming, self.outgoing)
+        self.assertFalse(snapshot.save(self.path, self.root,
+                                       self.incoming, self.outgoing))
+        self.assertTrue(snapshot.save(self.path, self.root,
+                                      [], self.outgoing))
+        self.assertEqual([], snapshot.load(self.path, self.root)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
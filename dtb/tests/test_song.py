@@ -3,23 +3,30 @@
 """Unit tests for the dtb.song module."""
 
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, ANY
 
 import os
 import tempfile
 import shutil
 
-from dtb.song import Song
+from dtb import transfer, manifest, storage
+from dtb.song import Song, group
+from dtb.library import Library
+from dtb.lease import Lease
 
 from dtb.tests import EMPTY
 from dtb.tests import FAKESONG, FAKELINK, FAKEFILE, BADFAKEFILE, BROKENLINK
 
 
+@patch('dtb.readiness.SETTLE', 0)
 class TestSong(unittest.TestCase):  # pylint: disable=R0904
     """Unit tests for the Song class."""  # pylint: disable=C0103,W0212
 
     def setUp(self):
         self.temp = tempfile.mkdtemp()
+        # Leases are tested separately to not create them next to test files
+        self.lease = patch('dtb.song.lease.Lease')
+        self.lease.start().return_value.acquire.return_value = True
         self.song = Song(FAKESONG, downloads=self.temp, friendname='Jace')
         self.link = Song(FAKELINK, downloads=self.temp, friendname='Jace')
         self.file = Song(FAKEFILE, downloads=self.temp, friendname='Jace')
@@ -27,6 +34,7 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
         self.broken = Song(BROKENLINK, downloads=self.temp, friendname='Jace')
 
     def tearDown(self):
+        self.lease.stop()
         shutil.rmtree(self.temp)
         for name in os.listdir(EMPTY):
             if name != '.gitignore':
@@ -54,6 +62,18 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
         self.assertEqual(link.source, self.song.path)
         self.assertTrue(os.path.isfile(link.path))
 
+    def test_link_checksum(self):
+        """Verify a link includes the song's checksum when known."""
+        Song(FAKESONG, checksum='abc123').link(EMPTY)
+        filename = [f for f in os.listdir(EMPTY) if f.endswith('.yml')][0]
+        link = Song(os.path.join(EMPTY, filename))
+        self.assertEqual('abc123', link.checksum)
+
+    def test_checksum_unknown(self):
+        """Verify a song without a stored checksum has none."""
+        self.assertIs(None, self.song.checksum)
+        self.assertIs(None, self.link.checksum)
+
     def test_link_missing_directory(self):
         """Verify a link can be created even when the directory is gone."""
         temp = tempfile.mkdtemp()
@@ -68,6 +88,14 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
         """Verify a link can be followed."""
         self.assertEqual(self.song.path, self.song.source)
 
+    def test_source_cached(self):
+        """Verify a link is only read once for each song."""
+        with patch('dtb.storage.read', wraps=storage.read) as mock_read:
+            self.assertEqual(self.song.path, self.link.source)
+            self.assertIsNone(self.link.checksum)
+            self.assertEqual("FakeSong.mp3 (from Jace)", self.link.in_string)
+        self.assertEqual(1, mock_read.call_count)
+
     def test_source_file(self):
         """Verify a non-link YAML file can be followed."""
         self.assertEqual(self.file.path, self.file.source)
@@ -99,6 +127,25 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
         self.assertEqual(0, len(os.listdir(self.temp)))
         mock_remove.assert_called_once_with(self.broken.path)
 
+    def test_download_checksum_mismatch(self):
+        """Verify a linked song is kept when the copy does not match."""
+        Song(FAKESONG, checksum='abc123').link(EMPTY)
+        filename = [f for f in os.listdir(EMPTY) if f.endswith('.yml')][0]
+        link = Song(os.path.join(EMPTY, filename), downloads=self.temp)
+        self.assertIs(None, link.download())
+        self.assertEqual([], os.listdir(self.temp))
+        self.assertTrue(os.path.isfile(link.path))
+        self.assertRaises(IOError, link.download, catch=False)
+
+    @patch('os.remove', Mock())
+    def test_download_library(self):
+        """Verify downloads are recorded in the library."""
+        library = Mock()
+        self.link.library = library
+        path = self.link.download()
+        library.add_download.assert_called_once_with(path, 'Jace', ANY)
+        library.remove_link.assert_called_once_with(self.link.path)
+
     @patch('os.remove', Mock(side_effect=IOError))
     def test_download_error_caught(self):
         """Verify errors are caught while downloading."""
@@ -113,8 +160,12 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
     @patch('os.path.isdir', Mock(return_value=False))
     def test_download_invalid_dest(self, mock_remove):
         """Verify downloads are only attempted with a valid destination."""
+        self.song.library = Mock()
+        self.song.library.can_retry.return_value = True
         self.song.download()
         self.assertFalse(mock_remove.called)
+        self.assertFalse(self.song.library.add_failure.called)
+        self.assertRaises(IOError, self.song.download, catch=False)
 
     @patch('os.remove')
     def test_ignore(self, mock_remove):
@@ -122,6 +173,234 @@ class TestSong(unittest.TestCase):  # pylint: disable=R0904
         self.song.ignore()
         mock_remove.assert_called_once_with(self.song.path)
 
+    @patch('os.remove', Mock())
+    def test_ignore_library(self):
+        """Verify ignored songs are recorded in the library."""
+        library = Mock()
+        self.link.library = library
+        self.link.ignore()
+        library.remove_link.assert_called_once_with(self.link.path)
+        self.assertFalse(library.add_download.called)
+
+
+@patch('dtb.readiness.SETTLE', 0)
+class TestSongLease(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for downloading songs claimed by other computers."""
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.downloads = os.path.join(self.temp, 'downloads')
+        os.mkdir(self.downloads)
+        self.path = os.path.join(self.temp, 'a.mp3')
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        self.song = Song(self.path, downloads=self.downloads)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_download_claimed(self):
+        """Verify songs claimed by another computer are skipped."""
+        other = Lease(self.path, owner='other')
+        self.assertTrue(other.acquire())
+        with patch('dtb.transfer.copy') as mock_copy:
+            self.assertIs(None, self.song.download())
+        self.assertFalse(mock_copy.called)
+        self.assertTrue(os.path.exists(self.path))
+        other.release()
+        self.assertTrue(self.song.download())
+        self.assertEqual(['downloads'], os.listdir(self.temp))
+
+    def test_download_claimed_finished(self):
+        """Verify songs downloaded while waiting for a claim are skipped."""
+        with patch('os.path.exists', Mock(return_value=False)):
+            self.assertIs(None, self.song.download())
+        self.assertEqual([], os.listdir(self.downloads))
+        self.assertEqual(['a.mp3', 'downloads'], sorted(os.listdir(self.temp)))
+
+
+@patch('dtb.readiness.SETTLE', 0)
+class TestSongDuplicates(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for downloading songs linked more than once."""
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.downloads = os.path.join(self.temp, 'downloads')
+        self.links = os.path.join(self.temp, 'links')
+        os.mkdir(self.downloads)
+        os.mkdir(self.links)
+        self.library = Library(os.path.join(self.temp, 'library.sqlite3'))
+        self.path = os.path.join(self.temp, 'a.mp3')
+        self.copy = os.path.join(self.temp, 'b.mp3')
+        for path in (self.path, self.copy):
+            with open(path, 'wb') as outfile:
+                outfile.write(b'\xff' * 42)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.temp)
+
+    def link(self, path, friendname, checksum=None):
+        """Create an incoming link to a song."""
+        link = Song(path, checksum=checksum).link(self.links)
+        return Song(link, self.downloads, friendname, library=self.library)
+
+    def test_group(self):
+        """Verify songs with the same source or checksum are grouped."""
+        other = os.path.join(self.temp, 'c.mp3')
+        open(other, 'w').close()  # touch the file
+        songs = [self.link(self.path, 'a'),
+                 self.link(self.path, 'b', 'abc'),
+                 self.link(self.copy, 'c', 'abc'),
+                 self.link(other, 'd', 'def')]
+        unique = group(songs)
+        self.assertEqual([songs[0], songs[3]], unique)
+        self.assertEqual(songs[1:3], songs[0].duplicates)
+        self.assertEqual([], songs[3].duplicates)
+
+    def test_download_duplicates(self):
+        """Verify duplicate links are removed after one download."""
+        songs = group([self.link(self.path, 'a'), self.link(self.path, 'b')])
+        with patch('dtb.transfer.copy', wraps=transfer.copy) as mock_copy:
+            path = songs[0].download()
+        self.assertEqual(1, mock_copy.call_count)
+        self.assertEqual([], os.listdir(self.links))
+        self.assertEqual(['a.mp3'], os.listdir(self.downloads))
+        self.assertEqual(['b', 'a'],
+                         [row[1] for row in self.library.downloads()])
+        self.assertEqual(path, self.library.downloads()[0][2])
+
+    def test_download_failure(self):
+        """Verify failed downloads are not retried right away."""
+        song = self.link(self.path, 'a', 'abc')
+        self.assertIs(None, song.download())
+        self.assertEqual(1, self.library.failure(song.path)[0])
+        with patch('dtb.transfer.copy') as mock_copy:
+            self.assertIs(None, song.download())
+        self.assertFalse(mock_copy.called)
+        self.assertRaises(IOError, song.download, catch=False)
+        self.assertEqual(2, self.library.failure(song.path)[0])
+
+    @patch('dtb.transfer.available', Mock(return_value=0))
+    def test_download_no_space(self):
+        """Verify songs that do not fit are postponed without failing."""
+        song = self.link(self.path, 'a')
+        self.assertIs(None, song.download())
+        self.assertTrue(os.path.exists(song.path))
+        self.assertIs(None, self.library.failure(song.path))
+        self.assertRaises(IOError, song.download, catch=False)
+
+    def test_download_again(self):
+        """Verify songs sent again are not copied again."""
+        self.link(self.path, 'a').download()
+        checksum = self.library.downloads()[0][4]
+        song = self.link(self.copy, 'b', checksum)
+        with patch('dtb.transfer.copy') as mock_copy:
+            self.assertIs(None, song.download())
+        self.assertFalse(mock_copy.called)
+        self.assertEqual([], os.listdir(self.links))
+        self.assertEqual(2, len(self.library.downloads()))
+
+    def test_download_again_deleted(self):
+        """Verify songs sent again are copied when the download is gone."""
+        self.link(self.path, 'a').download()
+        checksum = self.library.downloads()[0][4]
+        os.remove(os.path.join(self.downloads, 'a.mp3'))
+        song = self.link(self.copy, 'b', checksum)
+        self.assertEqual(os.path.join(self.downloads, 'b.mp3'),
+                         song.download())
+
+
+@patch('dtb.readiness.SETTLE', 0)
+@patch('dtb.manifest.LAYOUT', manifest.MANIFEST)
+@patch('dtb.manifest.WRITER', 'Computer-1234')
+class TestSongManifest(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for songs linked from segments of links."""
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.downloads = os.path.join(self.temp, 'downloads')
+        self.links = os.path.join(self.temp, 'links')
+        os.mkdir(self.downloads)
+        self.library = Library(os.path.join(self.temp, 'library.sqlite3'))
+        self.path = os.path.join(self.temp, 'a.mp3')
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.temp)
+
+    def link(self, checksum=None):
+        """Create an incoming link to the song."""
+        link = Song(self.path, checksum=checksum).link(self.links)
+        return Song(link, self.downloads, 'a', library=self.library)
+
+    def test_link(self):
+        """Verify links are added to this computer's segment."""
+        song = self.link('abc')
+        self.link()
+        self.assertTrue(song.path.endswith(manifest.LINK))
+        self.assertEqual([manifest.writer() + manifest.SUFFIX],
+                         os.listdir(self.links))
+        self.assertEqual(self.path, song.source)
+        self.assertEqual('abc', song.checksum)
+
+    def test_download(self):
+        """Verify downloaded links are removed from the segment."""
+        song = self.link()
+        self.assertEqual(os.path.join(self.downloads, 'a.mp3'),
+                         song.download())
+        self.assertFalse(song._exists())  # pylint: disable=W0212
+        self.assertEqual({}, manifest.load(self.links))
+        self.assertEqual(1, len(self.library.downloads()))
+        self.assertIs(None, song.download())
+
+    def test_download_duplicates(self):
+        """Verify duplicate links in segments are removed."""
+        songs = group([self.link(), self.link()])
+        self.assertEqual(1, len(songs))
+        songs[0].download()
+        self.assertEqual({}, manifest.load(self.links))
+
+    def test_ignore(self):
+        """Verify links in segments can be ignored once."""
+        song = self.link()
+        song.ignore()
+        self.assertEqual(song.path, song.source)  # removed links are not read
+        self.assertRaises(FileNotFoundError, song.ignore)
+
+
+class TestSongReadiness(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for downloading songs that are still syncing."""
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.downloads = os.path.join(self.temp, 'downloads')
+        os.mkdir(self.downloads)
+        self.path = os.path.join(self.temp, 'a.mp3')
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        self.link = Song(self.path).link(self.temp)
+        self.song = Song(self.link, downloads=self.downloads)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    @patch('dtb.transfer.copy')
+    def test_download_syncing(self, mock_copy):
+        """Verify songs are not copied while their source is changing."""
+        os.utime(self.link, (0, 0))  # synced files can keep old times
+        self.assertIs(None, self.song.download())
+        self.assertFalse(mock_copy.called)
+        self.assertTrue(os.path.exists(self.link))
+
+    @patch('dtb.readiness.SETTLE', 0)
+    def test_download_settled(self):
+        """Verify songs are copied once they stop changing."""
+        self.assertTrue(self.song.download())
+        self.assertFalse(os.path.exists(self.link))
+
 
 if __name__ == '__main__':
     unittest.main()
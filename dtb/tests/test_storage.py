@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.storage module."""
+
+import unittest
+from unittest.mock import patch, Mock, PropertyMock
+
+import os
+import tempfile
+import shutil
+
+import yaml
+
+from dtb import storage, share
+from dtb.song import Song
+from dtb.user import User, get_current
+
+
+class _Backend(object):  # pylint: disable=R0904
+    """Tests shared by all storage backends."""  # pylint: disable=E1101
+
+    def test_write_read(self):
+        """Verify text can be written and read back."""
+        path = os.path.join(self.root, 'a.yml')
+        self.backend.write(path, "abc\n")
+        self.assertEqual("abc\n", self.backend.read(path))
+        self.backend.write(path, "d\n")
+        self.assertEqual("d\n", self.backend.read(path))
+        self.assertEqual(2, self.backend.stat(path).st_size)
+        self.assertTrue(self.backend.isfile(path))
+        self.assertFalse(self.backend.isdir(path))
+
+    def test_listdir(self):
+        """Verify the entries of a folder can be listed."""
+        self.backend.makedirs(os.path.join(self.root, 'a', 'b'))
+        self.backend.write(os.path.join(self.root, 'a', 'c.yml'), "")
+        names = self.backend.listdir(os.path.join(self.root, 'a'))
+        self.assertEqual(['b', 'c.yml'], sorted(names))
+        self.assertTrue(self.backend.isdir(os.path.join(self.root, 'a', 'b')))
+
+    def test_rename(self):
+        """Verify a file can replace another."""
+        src = os.path.join(self.root, 'a.tmp')
+        dst = os.path.join(self.root, 'a.yml')
+        self.backend.write(src, "new")
+        self.backend.write(dst, "old")
+        self.backend.rename(src, dst)
+        self.assertFalse(self.backend.exists(src))
+        self.assertEqual("new", self.backend.read(dst))
+
+    def test_delete(self):
+        """Verify a file can be deleted."""
+        path = os.path.join(self.root, 'a.yml')
+        self.backend.write(path, "")
+        self.backend.delete(path)
+        self.assertFalse(self.backend.exists(path))
+        self.assertRaises(FileNotFoundError, self.backend.delete, path)
+        self.assertRaises(FileNotFoundError, self.backend.read, path)
+        self.assertRaises(FileNotFoundError, self.backend.stat, path)
+
+    def test_rmdir(self):
+        """Verify only empty folders can be deleted."""
+        path = os.path.join(self.root, 'a')
+        self.backend.makedirs(path)
+        self.backend.write(os.path.join(path, 'b.yml'), "")
+        self.assertRaises(OSError, self.backend.rmdir, path)
+        self.backend.delete(os.path.join(path, 'b.yml'))
+        self.backend.rmdir(path)
+        self.assertEqual([], self.backend.listdir(self.root))
+
+    def test_rmtree(self):
+        """Verify a folder can be deleted with everything in it."""
+        path = os.path.join(self.root, 'a')
+        self.backend.makedirs(os.path.join(path, 'b'))
+        self.backend.write(os.path.join(path, 'b', 'c.yml'), "")
+        self.backend.write(os.path.join(self.root, 'a.yml'), "")
+        self.backend.rmtree(path)
+        self.assertFalse(self.backend.exists(os.path.join(path, 'b')))
+        self.assertEqual(['a.yml'], self.backend.listdir(self.root))
+        self.assertRaises(FileNotFoundError, self.backend.rmtree, path)
+
+    def test_makedirs_existing(self):
+        """Verify creating an existing folder has no effect."""
+        path = os.path.join(self.root, 'a')
+        self.backend.makedirs(path)
+        self.backend.makedirs(path)
+        self.assertEqual(['a'], self.backend.listdir(self.root))
+
+    def test_errors(self):
+        """Verify files and folders cannot be used as the other."""
+        path = os.path.join(self.root, 'a.yml')
+        self.backend.write(path, "")
+        self.assertRaises(NotADirectoryError, self.backend.listdir, path)
+        self.assertRaises(FileNotFoundError, self.backend.listdir,
+                          os.path.join(self.root, 'missing'))
+        self.assertRaises(IsADirectoryError, self.backend.read, self.root)
+        self.assertRaises(FileNotFoundError, self.backend.write,
+                          os.path.join(self.root, 'missing', 'a.yml'), "")
+
+
+class TestLocal(_Backend, unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Local class."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.backend = storage.Local()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+class TestMemory(_Backend, unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the Memory class."""
+
+    def setUp(self):
+        self.root = os.path.join(os.sep, 'memory')
+        self.backend = storage.Memory()
+        self.backend.makedirs(self.root)
+
+    def test_calls(self):
+        """Verify calls are recorded."""
+        path = os.path.join(self.root, 'a.yml')
+        self.backend.write(path, "")
+        self.backend.read(path)
+        self.backend.read(path)
+        self.assertEqual(('read', path), self.backend.calls[-1])
+        self.assertEqual(2, self.backend.count('read'))
+        self.assertEqual(4, self.backend.count())
+
+    @patch('time.sleep')
+    def test_latency(self, mock_sleep):
+        """Verify calls can be delayed."""
+        self.backend.latency = 0.5
+        self.backend.listdir(self.root)
+        mock_sleep.assert_called_once_with(0.5)
+
+    @patch('time.sleep')
+    def test_latency_operations(self, mock_sleep):
+        """Verify calls can be delayed by operation."""
+        self.backend.latency = {'listdir': 0.5}
+        self.backend.isdir(self.root)
+        self.assertFalse(mock_sleep.called)
+        self.backend.listdir(self.root)
+        mock_sleep.assert_called_once_with(0.5)
+
+    def test_mtime(self):
+        """Verify changes to a folder always change its time."""
+        before = self.backend.stat(self.root).st_mtime_ns
+        self.backend.write(os.path.join(self.root, 'a.yml'), "")
+        after = self.backend.stat(self.root).st_mtime
+        self.assertGreater(after * 1e9, before)
+
+    def test_makedirs_file(self):
+        """Verify a folder cannot replace a file."""
+        path = os.path.join(self.root, 'a')
+        self.backend.write(path, "")
+        self.assertRaises(FileExistsError, self.backend.makedirs, path)
+
+    def test_folders_not_files(self):
+        """Verify folders cannot be written, renamed over, or deleted."""
+        path = os.path.join(self.root, 'a')
+        self.backend.write(os.path.join(self.root, 'b'), "")
+        self.backend.makedirs(path)
+        self.assertRaises(IsADirectoryError, self.backend.write, path, "")
+        self.assertRaises(IsADirectoryError, self.backend.rename,
+                          os.path.join(self.root, 'b'), path)
+        self.assertRaises(IsADirectoryError, self.backend.delete, path)
+        self.assertRaises(FileNotFoundError, self.backend.rename,
+                          os.path.join(self.root, 'c'), path)
+
+
+class TestMemoryShare(unittest.TestCase):  # pylint: disable=R0904
+    """Integration tests for a sharing folder in memory."""
+
+    COUNT = 1000  # number of links to share
+
+    def setUp(self):
+        self.memory = storage.Memory()
+        self.backend = patch('dtb.storage.BACKEND', self.memory)
+        self.backend.start()
+        self.home = os.path.join(os.sep, 'memory', 'home')
+        self.root = os.path.join(self.home, 'Dropbox', 'DropTheBeat')
+        for name, info in (('Me', ('PC', 'me')), ('Friend', ('PC', 'friend'))):
+            self.add_user(name, info)
+
+    def tearDown(self):
+        self.backend.stop()
+
+    def add_user(self, name, info):
+        """Create the files of a user in memory."""
+        path = os.path.join(self.root, name)
+        storage.makedirs(os.path.join(path, User.DROPS))
+        data = [{'computer': info[0], 'username': info[1],
+                 'downloads': os.path.join(self.home, 'Downloads')}]
+        storage.write(os.path.join(path, User.INFO), yaml.dump(data))
+        storage.write(os.path.join(path, User.REQUESTS), yaml.dump([]))
+        storage.write(os.path.join(path, User.SETTINGS), yaml.dump({}))
+        for other in storage.listdir(self.root):
+            if other != name:
+                storage.makedirs(os.path.join(path, other))
+                storage.makedirs(os.path.join(self.root, other, name))
+
+    def test_find(self):
+        """Verify a sharing folder can be found in memory."""
+        self.assertEqual(self.root, share.find(self.home))
+
+    def test_incoming(self):
+        """Verify many incoming links can be listed in memory."""
+        with patch('dtb.user.get_info', Mock(return_value=('PC', 'me'))):
+            this = get_current(self.root)
+        drops = os.path.join(self.root, 'Friend', User.DROPS)
+        for index in range(self.COUNT):
+            song = Song(os.path.join(drops, "{}.mp3".format(index)))
+            song.link(os.path.join(this.path, 'Friend'))
+        songs = list(this.incoming)
+        self.assertEqual(self.COUNT, len(songs))
+        self.assertEqual(drops, os.path.dirname(songs[0].source))
+        friend = User(os.path.join(self.root, 'Friend'))
+        self.assertEqual(self.COUNT, len(list(friend.outgoing)))
+        songs[0].ignore()
+        self.assertEqual(self.COUNT - 1, len(list(this.incoming)))
+
+    @patch.object(User, 'path_library', new_callable=PropertyMock,
+                  return_value=':memory:')
+    def test_cleanup(self, _):
+        """Verify a sharing folder can be cleaned up in memory."""
+        friend = User(os.path.join(self.root, 'Friend'))
+        for name in ('linked.mp3', 'unlinked.mp3'):
+            storage.write(os.path.join(friend.path_drops, name), "")
+        song = Song(os.path.join(friend.path_drops, 'linked.mp3'))
+        song.link(os.path.join(self.root, 'Me', 'Friend'))
+        stranger = os.path.join(friend.path, 'Stranger')
+        storage.makedirs(stranger)
+        storage.write(os.path.join(stranger, 'a.yml'), "")
+        self.assertTrue(friend.cleanup())
+        self.assertEqual(['linked.mp3'], storage.listdir(friend.path_drops))
+        self.assertFalse(storage.exists(stranger))
+        self.assertTrue(self.memory.count('rmtree'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.tags module."""
+
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from dtb import tags
+
+from dtb.tests import FAKESONG
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the tag functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def write(self, filename, data):
+        """Create a file with the specified bytes."""
+        path = os.path.join(self.temp, filename)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        return path
+
+    def test_read_filename(self):
+        """Verify tags are parsed from a filename."""
+        path = self.write("The Artist - The Title.mp3", b'')
+        self.assertEqual(("The Artist", "The Title"), tags.read(path))
+
+    def test_read_filename_title(self):
+        """Verify a filename without an artist is the title."""
+        self.assertEqual((None, "FakeSong"), tags.read(FAKESONG))
+
+    def test_read_missing(self):
+        """Verify tags are parsed from the filename of a missing file."""
+        path = os.path.join(self.temp, "A - B.mp3")
+        self.assertEqual(("A", "B"), tags.read(path))
+
+    def test_read_id3v1(self):
+        """Verify tags are read from an ID3v1 footer."""
+        footer = b'TAG' + b'Title'.ljust(30, b'\x00') + \
+            b'Artist'.ljust(30, b'\x00') + b'\x00' * 65
+        path = self.write("song.mp3", b'\xff' * 100 + footer)
+        self.assertEqual(("Artist", "Title"), tags.read(path))
+
+    def test_read_id3v23(self):
+        """Verify tags are read from an ID3v2.3 header."""
+        frames = b''
+        for frame, text in ((b'TIT2', 'Title'), (b'TPE1', 'Artíst')):
+            data = b'\x01' + text.encode('utf-16')
+            frames += frame + len(data).to_bytes(4, 'big') + b'\x00\x00' + data
+        header = b'ID3\x03\x00\x00' + bytes([0, 0, len(frames) >> 7,
+                                             len(frames) & 0x7F])
+        path = self.write("song.mp3", header + frames + b'\xff' * 10)
+        self.assertEqual(("Artíst", "Title"), tags.read(path))
+
+    def test_read_id3v24(self):
+        """Verify tags are read from an ID3v2.4 header."""
+        data = b'\x03' + 'Title'.encode('utf-8')
+        frames = b'TIT2' + bytes([0, 0, 0, len(data)]) + b'\x00\x00' + data
+        frames += b'\x00' * 20  # padding
+        header = b'ID3\x04\x00\x00' + bytes([0, 0, 0, len(frames)])
+        path = self.write("A - B.mp3", header + frames)
+        self.assertEqual((None, "Title"), tags.read(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.tracing module."""
+
+import unittest
+from unittest.mock import patch
+
+import os
+import json
+import pstats
+import tempfile
+import shutil
+
+from dtb import tracing
+
+
+@tracing.traced('square')
+def square(value):
+    """Function to trace."""
+    return value * value
+
+
+@tracing.traced('count')
+def count(total):
+    """Generator to trace."""
+    for value in range(total):
+        yield value
+
+
+class TestTracing(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for tracing functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.profile = os.path.join(self.temp, 'dtb.prof')
+        self.trace = os.path.join(self.temp, 'dtb.json')
+
+    def tearDown(self):
+        tracing.TRACER.disable()
+        tracing.TRACER.clear()
+        shutil.rmtree(self.temp)
+
+    def load(self):
+        """Load the events from the trace file."""
+        with open(self.trace, 'r') as infile:
+            return json.load(infile)['traceEvents']
+
+    def test_disabled(self):
+        """Verify nothing is recorded unless enabled."""
+        self.assertEqual(4, square(2))
+        self.assertEqual([0, 1], list(count(2)))
+        self.assertEqual([], tracing.TRACER.events)
+
+    def test_disabled_generator(self):
+        """Verify generators are not wrapped in spans unless enabled."""
+        with patch.object(tracing.TRACER, 'span') as mock_span:
+            self.assertEqual([0, 1, 2], list(count(3)))
+        self.assertFalse(mock_span.called)
+
+    def test_session_trace(self):
+        """Verify spans are written to a Chrome trace file."""
+        with tracing.session(trace=self.trace):
+            self.assertEqual(9, square(3))
+            self.assertEqual([0, 1], list(count(2)))
+        self.assertFalse(tracing.TRACER.enabled)
+        self.assertFalse(os.path.exists(self.profile))
+        events = self.load()
+        self.assertEqual(['square', 'count', 'count', 'count'],
+                         [event['name'] for event in events])
+        for event in events:
+            self.assertEqual('X', event['ph'])
+            self.assertLessEqual(0, event['dur'])
+        self.assertEqual([0, 1, 2],
+                         [event['args']['step'] for event in events[1:]])
+
+    def test_session_profile(self):
+        """Verify statistics are written to a profile file."""
+        with tracing.session(profile=self.profile):
+            square(4)
+        stats = pstats.Stats(self.profile)
+        self.assertTrue(stats.total_calls)
+        self.assertFalse(os.path.exists(self.trace))
+
+    def test_session_error(self):
+        """Verify files are written when the code fails."""
+        with self.assertRaises(ValueError):
+            with tracing.session(self.profile, self.trace):
+                square(5)
+                raise ValueError
+        self.assertTrue(os.path.exists(self.profile))
+        self.assertEqual(['square'], [e['name'] for e in self.load()])
+
+    def test_generator_close(self):
+        """Verify generators stopped early are closed."""
+        iterator = count(10)
+        self.assertEqual(0, next(iterator))
+        iterator.close()
+        self.assertRaises(StopIteration, next, iterator)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""Unit tests for the dtb.transfer module."""
+
+import unittest
+from unittest.mock import patch, Mock
+
+import os
+import hashlib
+import tempfile
+import shutil
+
+from dtb import transfer
+
+from dtb.tests import FAKESONG
+
+
+class TestTokenBucket(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the TokenBucket class."""  # pylint: disable=C0103
+
+    @patch('time.sleep')
+    def test_unlimited(self, mock_sleep):
+        """Verify transfers are not delayed without a limit."""
+        bucket = transfer.TokenBucket()
+        bucket.consume(10 ** 9)
+        self.assertFalse(mock_sleep.called)
+
+    @patch('time.sleep')
+    @patch('time.monotonic', Mock(return_value=100.0))
+    def test_limited(self, mock_sleep):
+        """Verify transfers are delayed beyond the rate."""
+        bucket = transfer.TokenBucket(1000)
+        bucket.consume(1000)  # burst
+        self.assertFalse(mock_sleep.called)
+        bucket.consume(500)
+        mock_sleep.assert_called_once_with(0.5)
+
+    @patch('time.sleep')
+    def test_refill(self, mock_sleep):
+        """Verify tokens accumulate over time."""
+        with patch('time.monotonic', Mock(return_value=100.0)):
+            bucket = transfer.TokenBucket(1000, burst=2000)
+            bucket.consume(2000)
+        with patch('time.monotonic', Mock(return_value=101.0)):
+            bucket.consume(1000)
+        self.assertFalse(mock_sleep.called)
+
+    @patch('time.sleep')
+    def test_configure(self, mock_sleep):
+        """Verify the limit can be changed."""
+        bucket = transfer.TokenBucket(1)
+        bucket.configure(0)
+        bucket.consume(1000)
+        self.assertFalse(mock_sleep.called)
+
+
+class TestFunctions(unittest.TestCase):  # pylint: disable=R0904
+    """Unit tests for the transfer functions."""  # pylint: disable=C0103
+
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        with open(FAKESONG, 'rb') as infile:
+            self.checksum = hashlib.sha1(infile.read()).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_copy_directory(self):
+        """Verify a file can be copied into a directory."""
+        path, checksum = transfer.copy(FAKESONG, self.temp)
+        self.assertEqual(os.path.join(self.temp, 'FakeSong.mp3'), path)
+        self.assertEqual(self.checksum, checksum)
+        self.assertEqual(['FakeSong.mp3'], os.listdir(self.temp))
+
+    def test_copy_file(self):
+        """Verify a file can be copied to a new name."""
+        dst = os.path.join(self.temp, 'a.mp3')
+        path, _ = transfer.copy(FAKESONG, dst, self.checksum)
+        self.assertEqual(dst, path)
+        self.assertTrue(os.path.isfile(dst))
+
+    @patch('dtb.transfer.WRITE')
+    @patch('dtb.transfer.READ')
+    def test_copy_limited(self, mock_read, mock_write):
+        """Verify copies are rate limited."""
+        path = os.path.join(self.temp, 'a.mp3')
+        with open(path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        transfer.copy(path, os.path.join(self.temp, 'b.mp3'))
+        mock_read.consume.assert_called_once_with(42)
+        mock_write.consume.assert_called_once_with(42)
+
+    def test_copy_mismatch(self):
+        """Verify a copy is rejected when the checksum does not match."""
+        self.assertRaises(transfer.ChecksumError,
+                          transfer.copy, FAKESONG, self.temp, 'abc123')
+        self.assertEqual([], os.listdir(self.temp))
+
+    @patch('dtb.transfer.RESERVE', 100)
+    @patch('shutil.disk_usage')
+    def test_available(self, mock_disk_usage):
+        """Verify the reserve is subtracted from the free space."""
+        mock_disk_usage.return_value = Mock(free=1000)
+        self.assertEqual(900, transfer.available(self.temp))
+        mock_disk_usage.assert_called_once_with(self.temp)
+        transfer.available(os.path.join(self.temp, 'a.mp3'))
+        mock_disk_usage.assert_called_with(self.temp)
+
+    @patch('dtb.transfer.available', Mock(return_value=41))
+    def test_copy_no_space(self):
+        """Verify files are not copied when they do not fit."""
+        path = os.path.join(self.temp, 'a.mp3')
+        with open(path, 'wb') as outfile:
+            outfile.write(b'\xff' * 42)
+        dst = os.path.join(self.temp, 'b.mp3')
+        self.assertRaises(transfer.SpaceError, transfer.copy, path, dst)
+        self.assertEqual(['a.mp3'], os.listdir(self.temp))
+
+    def test_copy_missing(self):
+        """Verify no partial copy is left when the source is missing."""
+        path = os.path.join(self.temp, 'missing.mp3')
+        self.assertRaises(IOError, transfer.copy, path, self.temp)
+        self.assertEqual([], os.listdir(self.temp))
+
+
+if __name__ == '__main__':
+    unittest.main()
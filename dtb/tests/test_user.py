@@ -9,7 +9,9 @@ import os
 import tempfile
 import shutil
 
-from dtb.user import User, get_current
+from dtb import manifest, shards, common
+from dtb.user import User, get_current, _index
+from dtb.transfer import SpaceError
 
 from dtb.tests import FILES
 
@@ -22,7 +24,7 @@ BROKENLINK = os.path.join(FILES, 'broken.yml')
 class MockSong(Mock):
     """Mock Song class."""
 
-    link = Mock()
+    link = Mock(return_value='link.yml')
 
 
 class TestUser(unittest.TestCase):  # pylint: disable=R0904
@@ -117,8 +119,7 @@ class TestUser(unittest.TestCase):  # pylint: disable=R0904
         """Verify a user's library path is correct."""
         path = os.path.join(self.root, self.name, '.dtb', 'library.sqlite3')
         self.assertEqual(path, self.user.path_library)
-        # TODO: add this test when library support is added
-        # self.assertTrue(os.path.isfile(path))
+        self.assertTrue(os.path.isfile(path))
 
     def test_path_reuests(self):
         """Verify a user's requests path is correct."""
@@ -132,6 +133,14 @@ class TestUser(unittest.TestCase):  # pylint: disable=R0904
         self.assertEqual(path, self.user.path_settings)
         self.assertTrue(os.path.isfile(path))
 
+    def test_path_snapshot(self):
+        """Verify a user's snapshot path is correct."""
+        path = self.user.path_snapshot
+        self.assertEqual(common.LOCAL, os.path.dirname(path))
+        self.assertNotIn(self.root, path)
+        other = User(os.path.join(self.root, 'Other'), _check=False)
+        self.assertNotEqual(path, other.path_snapshot)
+
     @patch('dtb.user.get_info', Mock(return_value=INFOS[0]))
     def test_path_downloads(self):
         """Verify a user's downloads path is correct."""
@@ -181,6 +190,44 @@ class TestUser(unittest.TestCase):  # pylint: disable=R0904
         finally:
             os.remove(path)
 
+    def test_incoming_lease(self):
+        """Verify leases on incoming songs are not songs."""
+        path = os.path.join(self.user.path, 'TempUser2', '_a_song.lease')
+        open(path, 'w').close()  # touch the file
+        try:
+            self.assertEqual([], list(self.user.incoming))
+        finally:
+            os.remove(path)
+
+    @patch('dtb.manifest.LAYOUT', manifest.MANIFEST)
+    @patch('dtb.manifest.WRITER', 'Computer-1234')
+    def test_incoming_manifest(self):
+        """Verify songs linked from segments are incoming and cleaned up."""
+        self.user2.recommend(FAKESONG, [self.name])
+        segment = manifest.segment(os.path.join(self.user.path, 'TempUser2'))
+        try:
+            songs = list(self.user.incoming)
+            self.assertEqual(1, len(songs))
+            self.assertEqual('TempUser2', songs[0].friendname)
+            self.assertEqual('FakeSong.mp3', os.path.basename(
+                songs[0].source))
+            self.user.reconcile()
+            self.assertEqual(1, len(self.user.library.links(incoming=True)))
+            songs[0].ignore()
+            self.user.reconcile()
+            self.assertEqual([], self.user.library.links(incoming=True))
+            self.user2.cleanup()
+            self.assertEqual(0, os.path.getsize(segment))
+            self.assertEqual([], os.listdir(self.user2.path_drops))
+        finally:
+            os.remove(segment)
+
+    def test_incoming_deleted(self):
+        """Verify friend folders deleted while scanning are skipped."""
+        listdir = Mock(side_effect=[['TempUser2'], FileNotFoundError])
+        with patch('dtb.user.CACHE.listdir', listdir):
+            self.assertEqual([], list(self.user.incoming))
+
     def test_incoming_zero(self):
         """Verify there can be zero incoming songs."""
         songs = list(self.user.incoming)
@@ -228,6 +275,119 @@ class TestUser(unittest.TestCase):  # pylint: disable=R0904
         self.assertFalse(os.path.exists(empty))
         self.assertFalse(os.path.exists(empty2))
 
+    def test_cleanup_budget(self):
+        """Verify cleanup can be spread across multiple calls."""
+        self.user.library.set_state('cleanup', None)
+        paths = [os.path.join(self.user.path_drops, name)
+                 for name in ('_a', '_b', '_c')]
+        for path in paths:
+            open(path, 'w').close()  # touch the file
+            os.utime(path, (0, 0))
+        calls = 0
+        while not User(self.user.path).cleanup(items=2):
+            calls += 1
+            self.assertLess(calls, 10)
+        self.assertLess(1, calls)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        # Budgeted passes are not restarted right away
+        open(paths[0], 'w').close()  # touch the file
+        os.utime(paths[0], (0, 0))
+        self.assertFalse(self.user.cleanup(seconds=10))
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertTrue(self.user.cleanup())
+        self.assertFalse(os.path.exists(paths[0]))
+
+    @patch('dtb.user.RETENTION_COUNT', 1)
+    def test_cleanup_retention(self):
+        """Verify the oldest songs beyond the retention limits are deleted."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                friend = User.new(root, 'b')
+            for name in ('a.mp3', 'b.mp3', 'c.mp3'):
+                path = os.path.join(root, name)
+                with open(path, 'wb') as outfile:
+                    outfile.write(b'\xff' * 42)
+                user.recommend(path)
+            self.assertTrue(user.cleanup())
+            self.assertEqual(['c.mp3'], os.listdir(user.path_drops))
+            self.assertEqual(['c.mp3'], [os.path.basename(song.source)
+                                         for song in friend.incoming])
+            self.assertEqual(1, len(user.library.links(incoming=False)))
+            state = user.library.get_state('cleanup')
+            self.assertEqual(2, state['evicted'])
+            self.assertEqual(84, state['reclaimed'])
+        finally:
+            shutil.rmtree(root)
+
+    @patch('dtb.user.RETENTION_COUNT', 1)
+    def test_cleanup_retention_same_name(self):
+        """Verify links to another drop with the same filename are kept."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                friend = User.new(root, 'b')
+            for layout, content in ((shards.FLAT, b'\x01'),
+                                    (shards.SHARDED, b'\x02')):
+                os.mkdir(os.path.join(root, layout))
+                path = os.path.join(root, layout, 'x.mp3')
+                with open(path, 'wb') as outfile:
+                    outfile.write(content)
+                with patch('dtb.shards.LAYOUT', layout):
+                    user.recommend(path)
+            self.assertTrue(user.cleanup())
+            songs = list(friend.incoming)
+            self.assertEqual(1, len(songs))
+            self.assertTrue(os.path.isfile(songs[0].located))
+            self.assertEqual(1, len(user.library.links(incoming=False)))
+        finally:
+            shutil.rmtree(root)
+
+    def test_cleanup_empty_shards(self):
+        """Verify empty subfolders of drops are deleted during cleanup."""
+        path = os.path.join(self.user.path_drops, shards.shard('a.mp3'))
+        os.mkdir(path)
+        self.assertTrue(self.user.cleanup())
+        self.assertFalse(os.path.exists(path))
+
+    def test_cleanup_budget_links(self):
+        """Verify cleanup can pause between links in a friend's folder."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                User.new(root, 'b')
+            for name in ('a.mp3', 'b.mp3', 'c.mp3'):
+                path = os.path.join(root, name)
+                open(path, 'w').close()  # touch the file
+                user.recommend(path)
+            links = []
+            while not User(user.path).cleanup(items=1):
+                state = user.library.get_state('cleanup')
+                if state['stage'] == 'links' and state.get('link'):
+                    links.append(state['link'])
+                self.assertLess(len(links), 10)
+            self.assertEqual(3, len(links))
+            self.assertEqual(['a.mp3', 'b.mp3', 'c.mp3'],
+                             sorted(os.listdir(user.path_drops)))
+        finally:
+            shutil.rmtree(root)
+
+    def test_cleanup_new_drop(self):
+        """Verify songs dropped during a cleanup pass are kept."""
+        self.user.library.set_state('cleanup', None)
+        self.assertFalse(self.user.cleanup(items=1))
+        path = os.path.join(self.user.path_drops, '_new')
+        open(path, 'w').close()  # touch the file
+        try:
+            self.assertTrue(self.user.cleanup())
+            self.assertTrue(os.path.exists(path))
+        finally:
+            os.remove(path)
+
     @patch('dtb.user.Song', MockSong)
     def test_recommend(self,):
         """Verify a user can recommend a song."""
@@ -238,10 +398,223 @@ class TestUser(unittest.TestCase):  # pylint: disable=R0904
         self.assertIn(call(path2), MockSong.link.call_args_list)
         self.assertIn(call(path3), MockSong.link.call_args_list)
 
+    def test_import_folder(self):
+        """Verify a folder of songs can be imported and skipped later."""
+        temp = tempfile.mkdtemp()
+        try:
+            for name in ('a.mp3', 'b.mp3', '.hidden'):
+                shutil.copy(FAKESONG, os.path.join(temp, name))
+            progress = Mock()
+            self.assertEqual(2, self.user.import_folder(temp, workers=1,
+                                                        progress=progress))
+            progress.assert_called_with(2, 2)
+            self.assertEqual(0, self.user.import_folder(temp, workers=1))
+        finally:
+            shutil.rmtree(temp)
+
+    def test_import_folder_unreadable(self):
+        """Verify unreadable files are skipped without stopping the import."""
+        temp = tempfile.mkdtemp()
+        try:
+            shutil.copy(FAKESONG, os.path.join(temp, 'a.mp3'))
+            os.symlink(os.path.join(temp, 'missing.mp3'),
+                       os.path.join(temp, 'b.mp3'))
+            self.assertEqual(1, self.user.import_folder(temp, workers=1))
+            self.assertIsNone(_index(os.path.join(temp, 'missing.mp3')))
+        finally:
+            shutil.rmtree(temp)
+
+    def test_import_folder_relative(self):
+        """Verify relative and absolute paths to a folder are the same."""
+        temp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            shutil.copy(FAKESONG, os.path.join(temp, 'a.mp3'))
+            self.assertEqual(1, self.user.import_folder(temp, workers=1))
+            os.chdir(temp)
+            self.assertEqual(0, self.user.import_folder('.', workers=1))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(temp)
+
+    @patch('dtb.user.User.recommend', Mock(side_effect=SpaceError))
+    def test_import_folder_no_space(self):
+        """Verify songs that do not fit are shared later."""
+        temp = tempfile.mkdtemp()
+        try:
+            shutil.copy(FAKESONG, os.path.join(temp, 'a.mp3'))
+            self.assertEqual(1, self.user.import_folder(temp, share=True,
+                                                        workers=1))
+            stat = os.stat(os.path.join(temp, 'a.mp3'))
+            self.assertFalse(self.user.library.unchanged(
+                os.path.join(temp, 'a.mp3'), stat.st_size, stat.st_mtime_ns,
+                shared=True))
+        finally:
+            shutil.rmtree(temp)
+
+    @patch('dtb.user.User.recommend')
+    def test_import_folder_share(self, mock_recommend):
+        """Verify a folder of songs can be shared."""
+        mock_recommend.return_value = Mock(checksum='abc123')
+        temp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp, 'c.mp3')
+            shutil.copy(FAKESONG, path)
+            self.user.import_folder(temp, workers=1)
+            self.user.import_folder(temp, share=True, users=['a'], workers=1)
+            mock_recommend.assert_called_once_with(path, ['a'])
+            self.assertEqual(0, self.user.import_folder(temp, share=True))
+        finally:
+            shutil.rmtree(temp)
+
+    def test_recommend_library(self):
+        """Verify recommended songs are added to the library."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                User.new(root, 'b')
+            user.recommend(FAKESONG)
+            self.assertEqual({'FakeSong.mp3'}, user.library.drops())
+            links = user.library.links(incoming=False)
+            self.assertEqual(1, len(links))
+            self.assertEqual(('b', 'FakeSong.mp3'), links[0][1:3])
+        finally:
+            shutil.rmtree(root)
+
+    def test_recommend_same_name(self):
+        """Verify different songs with the same name are both shared."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                User.new(root, 'b')
+            other = os.path.join(root, 'other')
+            os.mkdir(other)
+            with open(os.path.join(other, 'FakeSong.mp3'), 'w') as outfile:
+                outfile.write("different")
+            first = user.recommend(FAKESONG)
+            second = user.recommend(os.path.join(other, 'FakeSong.mp3'))
+            self.assertNotEqual(first.path, second.path)
+            self.assertEqual(2, len(user.library.drops()))
+            self.assertEqual(first.path, user.recommend(FAKESONG).path)
+        finally:
+            shutil.rmtree(root)
+
+    def test_migrate_drops(self):
+        """Verify drops can be moved to subfolders and back."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                friend = User.new(root, 'b')
+            user.recommend(FAKESONG)
+            name = shards.shard('FakeSong.mp3') + '/FakeSong.mp3'
+            self.assertEqual(1, user.migrate_drops(shards.SHARDED))
+            self.assertEqual({name}, user.library.drops())
+            self.assertEqual(0, user.migrate_drops(shards.SHARDED))
+            song = list(friend.incoming)[0]
+            self.assertEqual(os.path.join(user.path_drops, *name.split('/')),
+                             song.source)
+            self.assertTrue(user.cleanup())
+            self.assertEqual([name], shards.names(user.path_drops))
+            self.assertEqual(1, user.migrate_drops(shards.FLAT))
+            self.assertEqual(['FakeSong.mp3'], os.listdir(user.path_drops))
+            song = list(friend.incoming)[0]  # links are read once per song
+            self.assertEqual(os.path.join(user.path_drops, 'FakeSong.mp3'),
+                             song.source)
+        finally:
+            shutil.rmtree(root)
+
+    @patch('dtb.shards.LAYOUT', shards.SHARDED)
+    def test_recommend_sharded(self):
+        """Verify songs can be shared into subfolders of drops."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                User.new(root, 'b')
+            song = user.recommend(FAKESONG)
+            name = shards.shard('FakeSong.mp3') + '/FakeSong.mp3'
+            self.assertEqual(os.path.join(user.path_drops, *name.split('/')),
+                             song.path)
+            self.assertEqual({name}, user.library.drops())
+            os.utime(user.path_drops, (0, 0))
+            user.reconcile()
+            self.assertEqual({name}, user.library.drops())
+        finally:
+            shutil.rmtree(root)
+
+    def test_reconcile(self):
+        """Verify the library is updated with changes on disk."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                user2 = User.new(root, 'b')
+            user2.recommend(FAKESONG)
+            shutil.copy(FAKESONG, os.path.join(user.path_drops, 'x.mp3'))
+            for path in (user.path, user.path_drops,
+                         os.path.join(user.path, 'b'),
+                         os.path.join(user2.path, 'a')):
+                os.utime(path, (0, 0))  # allow the folders to be remembered
+            user.reconcile()
+            self.assertEqual({'x.mp3'}, user.library.drops())
+            links = user.library.links(incoming=True)
+            self.assertEqual(('b', 'FakeSong.mp3'), links[0][1:3])
+            # Only changed folders are listed again
+            with patch('os.listdir') as mock_listdir:
+                user.reconcile()
+            self.assertFalse(mock_listdir.called)
+            # Removed links are kept in the history
+            for song in user.incoming:
+                song.ignore()
+            user.reconcile()
+            self.assertEqual([], user.library.links(incoming=True))
+            self.assertEqual(1, len(user.library.links(current=False)))
+        finally:
+            shutil.rmtree(root)
+
     def test_request(self):
-        """Verify a user can request a song."""
-        # TODO: update this test when feature implemented
-        self.assertRaises(NotImplementedError, self.user.request, None)
+        """Verify a user can request a song dropped by a friend."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                user2 = User.new(root, 'b')
+            song = os.path.join(root, 'Daft Punk - One More Time.mp3')
+            shutil.copy(FAKESONG, song)
+            user2.recommend(song, users=['nobody'])
+            request = user.request("one more time", "daft punk")
+            self.assertEqual('matched', request['status'])
+            self.assertEqual('b', request['friend'])
+            songs = list(user.incoming)
+            self.assertEqual(1, len(songs))
+            self.assertEqual(song.split(os.sep)[-1],
+                             os.path.basename(songs[0].source))
+        finally:
+            shutil.rmtree(root)
+
+    def test_request_later(self):
+        """Verify a request is matched when a friend shares the song."""
+        root = tempfile.mkdtemp()
+        try:
+            with patch('dtb.user.get_info', Mock(return_value=self.INFOS[0])):
+                user = User.new(root, 'a')
+                user2 = User.new(root, 'b')
+                User.new(root, 'c')
+            request = user.request("One More Time")
+            self.assertEqual('open', request['status'])
+            song = os.path.join(root, 'Daft Punk - One More Time.mp3')
+            shutil.copy(FAKESONG, song)
+            user2.recommend(song, users=['c'])
+            self.assertEqual(1, len(list(user.incoming)))
+            # The request is closed without linking the song again
+            self.assertEqual(1, len(user.match_requests()))
+            self.assertEqual([], user.match_requests())
+            self.assertEqual(1, len(list(user.incoming)))
+        finally:
+            shutil.rmtree(root)
 
     def test_check(self):
         """Verify a user can be checked."""
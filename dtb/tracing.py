@@ -0,0 +1,147 @@
+"""Classes and functions to measure where the program spends its time."""
+
+import os
+import json
+import time
+import inspect
+import logging
+import threading
+import functools
+import contextlib
+import cProfile
+
+
+class Tracer(object):
+    """Records named spans of time as Chrome trace events.
+
+    Spans are only recorded while the tracer is enabled so the wrapped
+    functions cost one attribute check otherwise.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Start recording spans."""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording spans."""
+        self.enabled = False
+
+    def clear(self):
+        """Forget all recorded spans."""
+        with self._lock:
+            self.events = []
+
+    def record(self, name, start, end, **kwargs):
+        """Add a complete span.
+
+        @param name: name of the span
+        @param start: start time from time.perf_counter()
+        @param end: end time from time.perf_counter()
+        @param kwargs: additional values to display with the span
+        """
+        event = {'name': name, 'cat': 'dtb', 'ph': 'X',
+                 'ts': round(start * 1e6, 3),
+                 'dur': round((end - start) * 1e6, 3),
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if kwargs:
+            event['args'] = kwargs
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, **kwargs):
+        """Record the time spent in a block of code."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), **kwargs)
+
+    def save(self, path):
+        """Write the recorded spans to a Chrome trace file."""
+        with self._lock:
+            data = {'traceEvents': list(self.events),
+                    'displayTimeUnit': 'ms'}
+        logging.debug("saving {}...".format(path))
+        with open(path, 'w') as outfile:
+            json.dump(data, outfile)
+
+
+# Spans from all threads in this process
+TRACER = Tracer()
+
+
+def traced(name):
+    """Decorate a function to record each call as a span.
+
+    Generator functions record a span for each step of the iteration
+    so time spent by the caller between items is not included.
+
+    @param name: name of the span
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapped_generator(*args, **kwargs):
+                iterator = function(*args, **kwargs)
+                if not TRACER.enabled:
+                    return (yield from iterator)
+                step = 0
+                try:
+                    while True:
+                        try:
+                            with TRACER.span(name, step=step):
+                                item = next(iterator)
+                        except StopIteration:
+                            return
+                        step += 1
+                        yield item
+                finally:
+                    iterator.close()
+            return wrapped_generator
+
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(name):
+                return function(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+@contextlib.contextmanager
+def session(profile=None, trace=None):
+    """Profile and/or trace the program while running a block of code.
+
+    @param profile: path to write cProfile statistics or None
+    @param trace: path to write a Chrome trace file or None
+    """
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+    if trace:
+        TRACER.clear()
+        TRACER.enable()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            logging.info("saved profile: {}".format(profile))
+        if trace:
+            TRACER.disable()
+            TRACER.save(trace)
+            TRACER.clear()
+            logging.info("saved trace: {}".format(trace))
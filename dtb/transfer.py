@@ -0,0 +1,147 @@
+"""Classes and functions to transfer song files."""
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+
+ALGORITHM = 'sha1'  # name of the checksum stored in links
+CHUNK_SIZE = 1024 * 1024  # number of bytes to read at a time
+PARTIAL = '.part'  # extension for files being copied
+RESERVE = 100 * 1024 * 1024  # bytes to leave free on the destination
+
+
+class ChecksumError(IOError):
+    """Raised when a copied file does not match its expected checksum."""
+
+
+class SpaceError(IOError):
+    """Raised when a destination does not have room for a file."""
+
+
+class TokenBucket(object):
+    """Limits the number of bytes processed per second.
+
+    Tokens accumulate at the rate up to a burst size and each byte
+    consumes one token. Callers sleep when not enough tokens are left.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        """Change the limit while transfers are running.
+
+        @param rate: number of bytes per second or 0 for no limit
+        @param burst: number of bytes allowed at once (default: 1 second)
+        """
+        with self._lock:
+            if rate != self.rate:
+                logging.debug("rate limit: {} bytes/second".format(rate))
+            unlimited = not self.rate
+            self.rate = rate or 0
+            self.burst = burst or self.rate
+            if unlimited:  # start with a full bucket
+                self._tokens = float(self.burst)
+                self._updated = time.monotonic()
+            self._tokens = min(self._tokens, self.burst)
+
+    def consume(self, count):
+        """Wait until the number of bytes can be processed."""
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            refill = (now - self._updated) * self.rate
+            self._tokens = min(self.burst, self._tokens + refill)
+            self._updated = now
+            self._tokens -= count
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+# Limits shared by all transfers in this process
+READ = TokenBucket()
+WRITE = TokenBucket()
+
+
+def available(dst):
+    """Get the number of bytes that can be written to a destination.
+
+    @param dst: path to a destination file or directory
+
+    @return: free bytes on the destination's file system minus the reserve
+    """
+    dirpath = dst if os.path.isdir(dst) else os.path.dirname(dst)
+    return shutil.disk_usage(dirpath or '.').free - RESERVE
+
+
+def admit(src, dst):
+    """Verify a file fits on a destination before it is copied.
+
+    @param src: path to the file to copy
+    @param dst: path to a destination file or directory
+    """
+    size = os.path.getsize(src)
+    free = available(dst)
+    if size > free:
+        msg = "not enough space to copy {}: {} bytes needed, {} available " \
+            "after the reserve".format(src, size, max(free, 0))
+        raise SpaceError(msg)
+
+
+def digest(path):
+    """Compute the checksum of a file's contents."""
+    hasher = hashlib.new(ALGORITHM)
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def copy(src, dst, checksum=None):
+    """Copy a file while computing its checksum in the same pass.
+
+    The file is written to a temporary name and only renamed to the
+    destination once it is complete and matches the expected checksum.
+
+    @param src: path to the file to copy
+    @param dst: path to a destination file or directory
+    @param checksum: expected checksum of the file or None to skip
+
+    @return: path to the copied file, checksum of the copied file
+    """
+    admit(src, dst)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    partial = dst + PARTIAL
+    hasher = hashlib.new(ALGORITHM)
+    try:
+        with open(src, 'rb') as infile, open(partial, 'wb') as outfile:
+            for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+                READ.consume(len(chunk))
+                hasher.update(chunk)
+                WRITE.consume(len(chunk))
+                outfile.write(chunk)
+        actual = hasher.hexdigest()
+        if checksum and checksum != actual:
+            msg = "checksum mismatch: {} ({} != {})".format(
+                src, actual, checksum)
+            raise ChecksumError(msg)
+        shutil.copymode(src, partial)
+        os.replace(partial, dst)
+    except Exception:
+        if os.path.exists(partial):
+            logging.debug("deleting partial copy {}...".format(partial))
+            os.remove(partial)
+        raise
+    return dst, actual
@@ -1,14 +1,33 @@
 """Classes and functions to interact with users."""
 
 import os
+import time
 import socket
 import getpass
-import shutil
+import filecmp
+import hashlib
 import logging
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 import yaml
 
+from dtb import transfer, library, match, tracing, lease, readiness
+from dtb import manifest, shards, storage, common
 from dtb.song import Song
+from dtb.cache import DirectoryCache
+
+
+# Listings of unchanged folders are shared by all users in this process
+CACHE = DirectoryCache()
+
+IMPORT_CHUNK_SIZE = 16  # number of files to send to each worker at a time
+CLEANUP_TIME = 0.5  # seconds to spend on budgeted cleanup
+CLEANUP_ITEMS = 1000  # number of entries to check during budgeted cleanup
+CLEANUP_INTERVAL = 300.0  # seconds between budgeted cleanup passes
+RETENTION_DAYS = 0.0  # days to keep shared songs or 0 for no limit
+RETENTION_BYTES = 0  # total bytes of shared songs to keep or 0 for no limit
+RETENTION_COUNT = 0  # number of shared songs to keep or 0 for no limit
 
 
 class User(object):
@@ -19,10 +38,12 @@ class User(object):
     SETTINGS = os.path.join(PRIVATE, 'settings.yml')  # general preferences
     REQUESTS = os.path.join(PRIVATE, 'requests.yml')
     LIBRARY = os.path.join(PRIVATE, 'library.sqlite3')
-    DROPS = os.path.join(PRIVATE, 'drops')
+    DROPS = os.path.join(PRIVATE, shards.FOLDER)
+    SNAPSHOT = 'snapshot-{}.json'  # last displayed songs on this computer
 
     def __init__(self, path, _check=True):
         self.path = path
+        self._library = None
         if _check:
             self.check()
 
@@ -47,7 +68,7 @@ class User(object):
         """
         logging.debug("creating user '{}'...".format(name))
         path = os.path.join(root, name)
-        if os.path.exists(path):
+        if storage.exists(path):
             raise EnvironmentError("user already exists: {}".format(path))
         downloads = downloads or os.path.expanduser('~/Downloads')
 
@@ -55,8 +76,8 @@ class User(object):
         user = User(path, _check=False)
 
         # Create directories
-        os.makedirs(user.path_private)
-        os.makedirs(user.path_drops)
+        storage.makedirs(user.path_private)
+        storage.makedirs(user.path_drops)
 
         # Create info
         info = get_info()
@@ -65,25 +86,26 @@ class User(object):
                  'downloads': downloads}]
         text = yaml.dump(data, default_flow_style=False)
         logging.debug("saving {}...".format(user.path_info))
-        with open(user.path_info, 'w') as outfile:
-            outfile.write(text)
+        storage.write(user.path_info, text)
 
         # Create settings
         text = yaml.dump({}, default_flow_style=False)
         logging.debug("saving {}...".format(user.path_settings))
-        with open(user.path_settings, 'w') as outfile:
-            outfile.write(text)
+        storage.write(user.path_settings, text)
 
         # Create requests
         text = yaml.dump([], default_flow_style=False)
         logging.debug("saving {}...".format(user.path_requests))
-        with open(user.path_requests, 'w') as outfile:
-            outfile.write(text)
+        storage.write(user.path_requests, text)
+
+        # Create library
+        logging.debug("creating {}...".format(user.path_library))
+        user.library.commit()
 
         # Create folders for friends
-        for name in os.listdir(root):
+        for name in storage.listdir(root):
             friendpath = os.path.join(root, name)
-            if name != user.name and os.path.isdir(friendpath):
+            if name != user.name and storage.isdir(friendpath):
                 User._makedir(os.path.join(user.path, name))
                 User._makedir(os.path.join(friendpath, user.name))
 
@@ -108,8 +130,7 @@ class User(object):
         user = User(os.path.join(root, name))
         # Update info
         logging.debug("loading {}...".format(user.path_info))
-        with open(user.path_info, 'r') as infile:
-            text = infile.read()
+        text = storage.read(user.path_info)
         data = yaml.load(text)
         info = get_info()
         if not isinstance(data, list):
@@ -120,8 +141,7 @@ class User(object):
                      'downloads': downloads})
         text = yaml.dump(data, default_flow_style=False)
         logging.debug("saving {}...".format(user.path_info))
-        with open(user.path_info, 'w') as outfile:
-            outfile.write(text)
+        storage.write(user.path_info, text)
         # Return the updated user
         return user
 
@@ -167,15 +187,37 @@ class User(object):
         """Get the path to the user's requests file."""
         return os.path.join(self.path, User.SETTINGS)
 
+    @property
+    def path_snapshot(self):
+        """Get the path to the user's snapshot of displayed songs.
+
+        Snapshots are kept on each computer, named by a hash of the user's
+        folder, so they are not synced.
+        """
+        digest = hashlib.md5(os.path.abspath(self.path).encode('utf-8'))
+        return os.path.join(common.LOCAL, User.SNAPSHOT.format(
+            digest.hexdigest()[:16]))
+
     # properties based on files ################################################
 
+    @property
+    def library(self):
+        """Get the user's library, creating it if needed."""
+        if self._library is None:
+            self._library = library.Library(self.path_library, self.root)
+        return self._library
+
+    @property
+    def requests(self):
+        """Get the user's song requests."""
+        return match.load(self.path_requests)
+
     @property
     def info(self):
         """Get a list of the user's information."""
         infos = []
         logging.debug("loading {}...".format(self.path_info))
-        with open(self.path_info, 'r') as infile:
-            text = infile.read()
+        text = storage.read(self.path_info)
         data = yaml.load(text)
         if isinstance(data, list):
             for info in data:
@@ -190,8 +232,7 @@ class User(object):
         downloads = None
         info = get_info()
         logging.debug("loading {}...".format(self.path_info))
-        with open(self.path_info, 'r') as infile:
-            text = infile.read()
+        text = storage.read(self.path_info)
         data = yaml.load(text)
         if isinstance(data, list):
             for info2 in data:
@@ -209,8 +250,7 @@ class User(object):
         # TODO: refactor all into one common reader and writer
         info = get_info()
         logging.debug("loading {}...".format(self.path_info))
-        with open(self.path_info, 'r') as infile:
-            text = infile.read()
+        text = storage.read(self.path_info)
         data = yaml.load(text)
         if not isinstance(data, list):
             logging.warning("data reset due to config format change")
@@ -227,8 +267,7 @@ class User(object):
                          'downloads': downloads})
         text = yaml.dump(data, default_flow_style=False)
         logging.debug("saving {}...".format(self.path_info))
-        with open(self.path_info, 'w') as outfile:
-            outfile.write(text)
+        storage.write(self.path_info, text)
 
     @property
     def friends(self):
@@ -238,13 +277,13 @@ class User(object):
 
     def _iter_friends(self, clean=False):
         """Iterate through the user's friends with optional cleanup."""
-        for directory in os.listdir(self.root):
+        for directory in CACHE.listdir(self.root):
             path = os.path.join(self.root, directory)
             try:
                 user = User(path)
             except ValueError as err:
                 logging.debug("invalid user: {}".format(err))
-                if clean and os.path.isdir(path):
+                if clean and storage.isdir(path):
                     logging.warning("deleting invalid user: {}".format(path))
                     self._delete(path)
             else:
@@ -252,23 +291,38 @@ class User(object):
                     yield user
 
     @property
+    @tracing.traced('User.incoming')
     def incoming(self):
         """Iterate through the list of incoming songs."""
         found = False
+        downloads = None
         logging.debug("looking for incoming songs ({})...".format(self.name))
-        for friendname in os.listdir(self.path):
+        for friendname in CACHE.listdir(self.path):
+            if friendname == User.PRIVATE:
+                continue
             friendpath = os.path.join(self.path, friendname)
-            if friendname != User.PRIVATE and os.path.isdir(friendpath):
-                for filename in os.listdir(friendpath):
-                    filepath = os.path.join(friendpath, filename)
-                    song = Song(filepath, self.path_downloads, friendname)
-                    found = True
-                    logging.debug("incoming: {}".format(song))
-                    yield song
+            try:
+                filenames = CACHE.listdir(friendpath)
+            except OSError as error:  # not a folder or deleted since listed
+                logging.debug(error)
+                continue
+            for filename in manifest.names(friendpath, filenames):
+                if lease.is_lease(filename) or \
+                        readiness.is_temporary(filename):
+                    continue
+                if not found:
+                    downloads = self.path_downloads  # only load when needed
+                filepath = os.path.join(friendpath, filename)
+                song = Song(filepath, downloads, friendname,
+                            library=self.library)
+                found = True
+                logging.debug("incoming: {}".format(song))
+                yield song
         if not found:
             logging.debug("no incoming songs ({})".format(self.name))
 
     @property
+    @tracing.traced('User.outgoing')
     def outgoing(self):
         """Iterate through the list of outgoing songs."""
         found = False
@@ -279,50 +333,224 @@ class User(object):
                     found = True
                     # TODO: is this the best way to invert ownership?
                     song.friendname = friend.name
+                    song.library = self.library
                     logging.debug("outgoing: {}".format(song))
                     yield song
         if not found:
             logging.debug("no outgoing songs ({})".format(self.name))
 
+    @property
+    def segments(self):
+        """Get the paths to segments of links in the incoming folders."""
+        paths = []
+        for friendname in CACHE.listdir(self.path):
+            friendpath = os.path.join(self.path, friendname)
+            if friendname == User.PRIVATE or not storage.isdir(friendpath):
+                continue
+            paths.extend(os.path.join(friendpath, name)
+                         for name in CACHE.listdir(friendpath)
+                         if manifest.is_segment(name))
+        return paths
+
     # methods ##################################################################
 
-    def cleanup(self):
-        """Delete invalid users, unlinked songs, and empty directories."""
+    @tracing.traced('User.cleanup')
+    def cleanup(self, seconds=None, items=None):
+        """Delete invalid users, unlinked songs, and empty directories.
+
+        Shared songs beyond the retention limits are also deleted, oldest
+        first, along with their links. The songs removed and bytes
+        reclaimed are saved in the library's 'cleanup' state.
+
+        With a budget, cleanup stops early and saves its position in the
+        library so the next call resumes where this one stopped. Passes
+        with a budget are not restarted until CLEANUP_INTERVAL has passed.
+
+        @param seconds: maximum time to spend or None for no limit
+        @param items: maximum number of entries to check or None for no limit
+
+        @return: indication that a full pass was completed
+        """
+        budgeted = seconds is not None or items is not None
+        state = self.library.get_state('cleanup')
+        if not state or 'stage' not in state:
+            done = state.get('done', 0) if state else 0
+            if budgeted and time.time() - done < CLEANUP_INTERVAL:
+                logging.debug("skipped cleanup of {}".format(self.root))
+                return False
+            state = {'start': time.time(), 'stage': 'retention', 'after': '',
+                     'drops': sorted(shards.names(self.path_drops)),
+                     'linked': [], 'evicted': 0, 'reclaimed': 0}
         logging.info("cleaning up {}...".format(self.root))
-        # Delete unlinked songs
-        paths = [os.path.join(self.path_drops, name)
-                 for name in os.listdir(self.path_drops)]
-        for song in self.outgoing:
-            try:
-                paths.remove(song.source)
-            except ValueError:
-                pass
-        for path in paths:
-            logging.info("deleting unlinked: {}".format(path))
-            self._delete(path)
-        # Delete non-friend directories
-        names = [friend.name for friend in self._iter_friends(clean=True)]
-        for name in os.listdir(self.path):
+        deadline = None if seconds is None else time.monotonic() + seconds
+        count = 0
+        for cost in self._cleanup(state):
+            count += cost
+            if (items is not None and count >= items) or \
+                    (deadline is not None and time.monotonic() >= deadline):
+                logging.debug("paused cleanup at {} {}".format(
+                    state['stage'], state['after']))
+                self.library.set_state('cleanup', dict(
+                    state, linked=sorted(state['linked'])))
+                return False
+        self.library.set_state('cleanup', {
+            'done': time.time(), 'evicted': state.get('evicted', 0),
+            'reclaimed': state.get('reclaimed', 0)})
+        return True
+
+    def _cleanup(self, state):
+        """Iterate through the steps of cleanup, updating its position.
+
+        Each stage processes entries in sorted order after the last one
+        processed so it can be resumed with only the state.
+
+        @param state: dictionary of the stage, last entry, drops when the
+            pass started, and drops found to be linked (replaced by a set
+            while running), plus the last link read in a friend's folder
+
+        @return: generator of the number of entries checked by each step
+        """
+        def remaining(names):
+            """Get the sorted names left in the current stage."""
+            return [name for name in sorted(names) if name > state['after']]
+
+        def advance(stage):
+            """Move to the next stage."""
+            state['stage'], state['after'] = stage, ''
+
+        # Delete the oldest songs beyond the retention limits
+        if state['stage'] == 'retention':
+            for cost in self._evict(state):
+                yield cost
+            advance('friends')
+
+        # Delete invalid users
+        if state['stage'] == 'friends':
+            for name in remaining(CACHE.listdir(self.root)):
+                path = os.path.join(self.root, name)
+                try:
+                    User(path)
+                except ValueError as err:
+                    logging.debug("invalid user: {}".format(err))
+                    if storage.isdir(path):
+                        logging.warning("deleting invalid user: {}".format(
+                            path))
+                        self._delete(path)
+                state['after'] = name
+                yield 1
+            advance('links')
+
+        # Find songs linked to friends, one link at a time
+        linked = state['linked'] = set(state['linked'])
+        if state['stage'] == 'links':
+            for name in remaining(CACHE.listdir(self.root)):
+                dirpath = os.path.join(self.root, name, self.name)
+                filenames = []
+                if name != self.name and storage.isdir(dirpath):
+                    filenames = sorted(manifest.names(dirpath,
+                                                      CACHE.listdir(dirpath)))
+                    if not state.get('link'):
+                        manifest.compact(dirpath)
+                for filename in filenames:
+                    if filename <= state.get('link', '') or \
+                            lease.is_lease(filename):
+                        continue
+                    # Keep drops in either layout to not check for moves
+                    source = Song(os.path.join(dirpath, filename)).source
+                    for path in (source, shards.alternate(source)):
+                        drop = path and shards.relative(self.path_drops, path)
+                        if drop:
+                            linked.add(drop)
+                    state['link'] = filename
+                    yield 1
+                state['after'], state['link'] = name, ''
+                yield 1
+            advance('drops')
+
+        # Delete unlinked songs, keeping those dropped during this pass
+        if state['stage'] == 'drops':
+            for name in remaining(state['drops']):
+                path = os.path.join(self.path_drops, name)
+                if name not in linked and storage.exists(path) and \
+                        storage.stat(path).st_mtime < state['start']:
+                    logging.info("deleting unlinked: {}".format(path))
+                    self._delete(path)
+                    self.library.remove_drop(name)
+                state['after'] = name
+                yield 1
+            shards.prune(self.path_drops)
+            advance('others')
+
+        # Delete non-friend directories, compact links from friends, and
+        # delete leases left behind by stopped processes
+        for name in remaining(CACHE.listdir(self.path)):
             path = os.path.join(self.path, name)
-            if name not in names and name != User.PRIVATE:
+            if name != User.PRIVATE and (name == self.name or not _is_user(
+                    os.path.join(self.root, name))):
                 logging.warning("deleting non-friend: {}".format(path))
                 self._delete(path)
+            elif name != User.PRIVATE and storage.isdir(path):
+                manifest.compact(path)
+                lease.clean(path, CACHE.listdir(path))
+            state['after'] = name
+            yield 1
+
+    def _evict(self, state):
+        """Iterate through deleting shared songs beyond retention limits.
+
+        @param state: dictionary to count the songs and bytes removed
+
+        @return: generator of the number of entries changed by each step
+        """
+        if not any((RETENTION_DAYS, RETENTION_BYTES, RETENTION_COUNT)):
+            return
+        if not state['after']:
+            self.reconcile()  # find drops from this user's other computers
+        expired = self.library.expired(RETENTION_DAYS * 24 * 60 * 60,
+                                       RETENTION_BYTES, RETENTION_COUNT)
+        for name, size in expired:
+            path = os.path.join(self.path_drops, *name.split('/'))
+            # Remove links so friends do not try to download the song, but
+            # not links to another drop with the same filename
+            links = self.library.links(incoming=False,
+                                       name=os.path.basename(name))
+            for link in links:
+                song = Song(os.path.join(self.root, link[0]),
+                            library=self.library)
+                try:
+                    if song.located == path:
+                        song.ignore()
+                except FileNotFoundError:
+                    self.library.remove_link(song.path)
+            logging.info("deleting expired: {}".format(path))
+            if storage.exists(path):
+                size = storage.stat(path).st_size
+                self._delete(path)
+            self.library.remove_drop(name)
+            state['after'] = name
+            state['evicted'] = state.get('evicted', 0) + 1
+            state['reclaimed'] = state.get('reclaimed', 0) + size
+            yield len(links) + 1
+        if expired:
+            logging.info("reclaimed {} bytes from {} song(s)".format(
+                state['reclaimed'], state['evicted']))
 
     @staticmethod
     def _makedir(path):
         """Create a directory if needed."""
-        if not os.path.exists(path):
-            os.makedirs(path)
+        if not storage.exists(path):
+            storage.makedirs(path)
 
     @staticmethod
     def _delete(path):
         """Delete a file or directory."""
         logging.debug("deleting {}...".format(path))
-        if os.path.isdir(path):
-            shutil.rmtree(path)
+        if storage.isdir(path):
+            storage.rmtree(path)
         else:
-            os.remove(path)
+            storage.delete(path)
 
+    @tracing.traced('User.recommend')
     def recommend(self, path, users=None):
         """Recommend a song to a list of users.
 
@@ -332,38 +560,277 @@ class User(object):
         @return: shared Song
         """
         logging.info("recommending {}...".format(path))
-        shutil.copy(path, self.path_drops)
-        song = Song(os.path.join(self.path_drops, os.path.basename(path)))
+        filename = os.path.basename(path)
+        dst = os.path.join(shards.folder(self.path_drops, filename), filename)
+        if os.path.isfile(dst) and not filecmp.cmp(path, dst, shallow=False):
+            # Keep different songs with the same name, e.g. from albums
+            stem, ext = os.path.splitext(filename)
+            filename = "{}-{}{}".format(stem, transfer.digest(path)[:8], ext)
+            dst = os.path.join(shards.folder(self.path_drops, filename),
+                               filename)
+        dst, checksum = transfer.copy(path, dst)
+        name = shards.relative(self.path_drops, dst)
+        tokens = self.library.add_drop(name, dst, checksum)
+        song = Song(dst, checksum=checksum)
         for friend in self.friends:
-            if not users or friend.name in users:
-                song.link(os.path.join(friend.path, self.name))
+            recipient = not users or friend.name in users
+            # Also send the song to friends who requested it
+            for request in friend.requests.match(tokens):
+                if self.library.add_match(request['id'], friend.name, name):
+                    logging.info("matched request from {}: {}".format(
+                        friend.name, request['title']))
+                    recipient = True
+            if recipient:
+                link = song.link(os.path.join(friend.path, self.name))
+                self.library.add_link(link, friend.name,
+                                      os.path.basename(dst))
         return song
 
-    def request(self, song):
-        """Request a new song."""
-        raise NotImplementedError("TODO: implement song requests")
+    def migrate_drops(self, layout=None):
+        """Move the user's drops to another layout.
+
+        Moved drops are renamed in the library and links in their own files
+        are rewritten so friends running older versions can still find them.
+
+        @param layout: layout to move to or None for the current setting
+
+        @return: number of drops moved
+        """
+        logging.info("migrating {}...".format(self.path_drops))
+        moved = shards.migrate(self.path_drops, layout)
+        moves = {}
+        for old, new in moved:
+            self.library.rename_drop(old, new)
+            moves[os.path.join(self.path_drops, *old.split('/'))] = \
+                os.path.join(self.path_drops, *new.split('/'))
+        self.library.commit()
+        if moves:
+            for friend in self.friends:
+                dirpath = os.path.join(friend.path, self.name)
+                if not storage.isdir(dirpath):
+                    continue
+                for filename in CACHE.listdir(dirpath):
+                    Song(os.path.join(dirpath, filename)).retarget(moves)
+        return len(moved)
+
+    def reconcile(self):
+        """Update the library with changes from other computers and users.
+
+        Only folders modified since they were last reconciled are listed.
+        """
+        logging.info("reconciling {}...".format(self.path_library))
+        catalog = self.library
+        # Update drops
+        # Drops added to subfolders do not change the drops folder itself
+        mtime = catalog.changed(self.path_drops, shards.folders(
+            self.path_drops, CACHE.listdir(self.path_drops)))
+        if mtime is not None:
+            names = set(shards.names(self.path_drops))
+            known = catalog.drops()
+            for name in names - known:
+                catalog.add_drop(name, os.path.join(self.path_drops, name))
+            for name in known - names:
+                catalog.remove_drop(name)
+            catalog.reconciled(self.path_drops, mtime)
+        # Update links from and to friends
+        for friendname in CACHE.listdir(self.path):
+            if friendname == User.PRIVATE:
+                continue
+            for dirpath, incoming in (
+                    (os.path.join(self.path, friendname), True),
+                    (os.path.join(self.root, friendname, self.name), False)):
+                try:
+                    filenames = CACHE.listdir(dirpath)
+                except OSError:
+                    filenames = []
+                # Links added to segments do not change the folder itself
+                segments = [os.path.join(dirpath, name) for name in filenames
+                            if manifest.is_segment(name)]
+                mtime = catalog.changed(dirpath, segments)
+                if mtime is None:
+                    continue
+                names = set(name for name in manifest.names(dirpath, filenames)
+                            if not lease.is_lease(name))
+                known = catalog.link_names(dirpath)
+                for name in names - known:
+                    path = os.path.join(dirpath, name)
+                    source = Song(path).source
+                    catalog.add_link(path, friendname,
+                                     os.path.basename(source), incoming)
+                for name in known - names:
+                    catalog.remove_link(os.path.join(dirpath, name))
+                catalog.reconciled(dirpath, mtime)
+
+    def import_folder(self, dirpath, share=False, users=None, workers=None,
+                      progress=None):
+        """Index, and optionally recommend, all the songs in a folder.
+
+        Checksums and tags are computed in a pool of processes while the
+        results are added to the library as they arrive. Files unchanged
+        since they were last imported are skipped, as are files that
+        cannot be read. Shared files are only read once, while copying.
+
+        @param dirpath: path to a folder of songs
+        @param share: also recommend each song
+        @param users: names of users to recommend to or None for all
+        @param workers: number of processes or None for one per CPU
+        @param progress: function to call with the files done and total
+
+        @return: number of files imported
+        """
+        count = 0
+        catalog = self.library
+        # Paths are keyed the same way however the folder was given
+        dirpath = os.path.abspath(dirpath)
+        try:
+            paths = []
+            for path in _iter_files(dirpath):
+                try:
+                    stat = os.stat(path)
+                except OSError as error:
+                    logging.warning("not imported: {}".format(error))
+                    continue
+                if catalog.unchanged(path, stat.st_size, stat.st_mtime_ns,
+                                     shared=share):
+                    logging.debug("unchanged: {}".format(path))
+                else:
+                    paths.append(path)
+            logging.info("importing {} file(s)...".format(len(paths)))
+            with ProcessPoolExecutor(workers) as executor:
+                results = executor.map(partial(_index, checksum=not share),
+                                       paths, chunksize=IMPORT_CHUNK_SIZE)
+                for done, result in enumerate(results, start=1):
+                    if result:
+                        self._import(catalog, result, share, users)
+                        count += 1
+                    if done % IMPORT_CHUNK_SIZE == 0:
+                        catalog.commit()
+                    if progress:
+                        progress(done, len(paths))
+        finally:
+            catalog.commit()
+        return count
+
+    def _import(self, catalog, result, share, users):
+        """Add an indexed file to the library, sharing it if requested."""
+        path, size, mtime, checksum, artist, title = result
+        shared = share
+        if share:
+            try:
+                checksum = self.recommend(path, users).checksum
+            except OSError as error:
+                logging.warning("not shared: {}".format(error))
+                shared = False
+        catalog.add_song(path, size, mtime, checksum, artist, title,
+                         shared=shared)
+
+    def request(self, title, artist=None):
+        """Request a song from friends.
+
+        Songs already dropped by friends are searched immediately, and
+        songs recommended later are matched as they are shared.
+
+        @param title: title of the song
+        @param artist: name of the artist or None
+
+        @return: new request
+        """
+        logging.info("requesting {}...".format(title))
+        request = self.requests.add(title, artist)
+        for matched in self.match_requests():
+            if matched['id'] == request['id']:
+                return matched
+        return request
+
+    def match_requests(self):
+        """Match open requests to songs dropped by friends.
+
+        Songs already sent by a friend for a request are not linked again.
+
+        @return: list of requests that were matched
+        """
+        pending = [r for r in self.requests if r.get('status') == 'open']
+        if not pending:
+            return []
+        self.reconcile()
+        matched = []
+        for friend in self.friends:
+            if not pending:
+                break
+            if not os.path.isfile(friend.path_library):
+                continue
+            received = set(link[2] for link in self.library.links(
+                incoming=True, friend=friend.name))
+            catalog = library.Library(friend.path_library, readonly=True)
+            try:
+                for request in list(pending):
+                    tokens = match.tokenize(request.get('title'),
+                                            request.get('artist'))
+                    names = catalog.search(tokens)
+                    if not names:
+                        continue
+                    name = names[0]
+                    if os.path.basename(name) not in received:
+                        song = Song(os.path.join(friend.path_drops, name))
+                        link = song.link(os.path.join(self.path, friend.name))
+                        self.library.add_link(link, friend.name,
+                                              os.path.basename(name),
+                                              incoming=True)
+                    matched.append(self.requests.close(request['id'],
+                                                       friend.name, name))
+                    pending.remove(request)
+            finally:
+                catalog.close()
+        return matched
 
     def check(self):
         """Verify the user's directory is valid."""
-        if not os.path.isdir(self.path):
+        if not storage.isdir(self.path):
             raise ValueError("not a directory: {}".format(self.path))
         for path in (self.path_private, self.path_drops):
-            if not os.path.isdir(path):
+            if not storage.isdir(path):
                 raise ValueError("missing folder: {}".format(path))
-        # TODO: also check self.path_library when library support is added
+        # The library is not required as it is created when first used
         for path in (self.path_info, self.path_requests, self.path_settings):
-            if not os.path.isfile(path):
+            if not storage.isfile(path):
                 raise ValueError("missing file: {}".format(path))
 
     def delete(self):
         """Delete the user."""
         for friend in self.friends:
             path = os.path.join(friend.path, self.name)
-            if os.path.exists(path):
+            if storage.exists(path):
                 logging.info("deleting {}...".format(path))
-                shutil.rmtree(path)
+                storage.rmtree(path)
         logging.info("deleting {}...".format(self.path))
-        shutil.rmtree(self.path)
+        storage.rmtree(self.path)
+
+
+def _is_user(path):
+    """Determine if a directory is a valid user."""
+    try:
+        User(path)
+    except ValueError:
+        return False
+    return True
+
+
+def _index(path, checksum=True):
+    """Catalog a file in a worker process or get None if it is unreadable."""
+    try:
+        return library.index(path, checksum)
+    except OSError as error:
+        logging.warning("not imported: {}".format(error))
+        return None
+
+
+def _iter_files(dirpath):
+    """Iterate through the paths of all non-hidden files in a folder."""
+    for subdirpath, dirnames, filenames in os.walk(dirpath):
+        dirnames[:] = sorted(n for n in dirnames if not n.startswith('.'))
+        for filename in sorted(filenames):
+            if not filename.startswith('.'):
+                yield os.path.join(subdirpath, filename)
 
 
 def get_info():
@@ -371,6 +838,7 @@ def get_info():
     return socket.gethostname(), getpass.getuser()  # pylint: disable=no-member
 
 
+@tracing.traced('user.get_current')
 def get_current(root):
     """Get the current user based on this computer's information.
 
@@ -380,7 +848,7 @@ def get_current(root):
     """
     info = get_info()
     logging.debug("looking for {} in {}...".format(info, root))
-    for directory in os.listdir(root):
+    for directory in storage.listdir(root):
         path = os.path.join(root, directory)
         try:
             user = User(path)